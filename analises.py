@@ -0,0 +1,139 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import arquivo
+import db
+import snapshot
+
+# --- ANÁLISES ---
+# As colunas de vendas são lidas em lotes direto para arrays NumPy e todas as contas
+# (margem, mix, ranking, mapa de calor, crescimento) são vetorizadas. O resultado
+# fica em cache até mudar a versão de vendas/estoque/clientes ou virar o dia.
+LOTE = 50000
+TOP = 10
+DIAS_SEMANA = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _colunas(cursor, tipos):
+    partes = [[] for _ in tipos]
+    while True:
+        linhas = cursor.fetchmany(LOTE)
+        if not linhas:
+            break
+        for parte, tipo, coluna in zip(partes, tipos, zip(*linhas)):
+            parte.append(np.asarray(coluna, dtype=tipo))
+    return [np.concatenate(p) if p else np.empty(0, dtype=t) for p, t in zip(partes, tipos)]
+
+
+def _carregar(conn, inicio):
+    # hora sai do próprio timestamp ('YYYY-mm-dd HH:MM:...'), sem parse em Python
+    with arquivo.historico(conn, inicio) as tabela:
+        cur = conn.execute(f'''SELECT dia, CAST(substr(timestamp, 12, 2) AS INTEGER), COALESCE(cli_id, -1), prod,
+                                      COALESCE(qtd, 0), COALESCE(total, 0)
+                               FROM {tabela} WHERE dia >= ?''', (inicio,))
+        dia, hora, cli, prod, qtd, total = _colunas(cur, ('datetime64[D]', float, np.int64, object, float, float))
+    codigos, produtos = pd.factorize(prod, use_na_sentinel=False)
+    return {'dia': dia, 'hora': np.nan_to_num(hora, nan=0).astype(np.int8), 'cli': cli,
+            'prod': codigos, 'produtos': list(produtos), 'qtd': qtd, 'total': total}
+
+
+def _ranking(ids, valores, nomes, n=TOP):
+    ordem = np.argsort(valores)[::-1][:n]
+    return [{'id': int(ids[i]), 'nome': nomes.get(int(ids[i]), f"#{ids[i]}"), 'valor': float(valores[i])}
+            for i in ordem if valores[i] > 0]
+
+
+def calcular(conn, dias=90, hoje=None):
+    hoje = np.datetime64(hoje or datetime.now().strftime("%Y-%m-%d"), 'D')
+    inicio_atual = hoje - np.timedelta64(dias - 1, 'D')
+    inicio_anterior = inicio_atual - np.timedelta64(dias, 'D')
+    v = _carregar(conn, str(inicio_anterior))
+    atual = v['dia'] >= inicio_atual
+    anterior = ~atual
+
+    receita_atual = float(v['total'][atual].sum())
+    receita_anterior = float(v['total'][anterior].sum())
+    n_atual = int(atual.sum())
+
+    # Margem e mix por produto no período atual
+    n_prod = len(v['produtos'])
+    receita_p = np.bincount(v['prod'][atual], weights=v['total'][atual], minlength=n_prod)
+    qtd_p = np.bincount(v['prod'][atual], weights=v['qtd'][atual], minlength=n_prod)
+    custos = dict(conn.execute("SELECT produto, COALESCE(preco_custo, 0) FROM estoque").fetchall())
+    custo_unit = np.array([custos.get(p, 0.0) for p in v['produtos']], dtype=float)
+    custo_p = qtd_p * custo_unit
+    margem_p = receita_p - custo_p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margem_pct = np.where(receita_p > 0, margem_p / receita_p * 100, 0.0)
+    mix = receita_p / receita_atual * 100 if receita_atual else np.zeros(n_prod)
+    produtos = [{'produto': v['produtos'][i], 'qtd': int(qtd_p[i]), 'receita': float(receita_p[i]), 'custo': float(custo_p[i]),
+                 'margem': float(margem_p[i]), 'margem_pct': float(margem_pct[i]), 'mix_pct': float(mix[i])}
+                for i in np.argsort(receita_p)[::-1] if receita_p[i] > 0]
+
+    # Ranking de clientes: receita no período e dívida em aberto (todo o histórico, via índice parcial)
+    ids_r, inv = np.unique(v['cli'][atual], return_inverse=True)
+    receita_c = np.bincount(inv, weights=v['total'][atual], minlength=len(ids_r))
+    cli_d, pend_d = _colunas(conn.execute("SELECT COALESCE(cli_id, -1), pendente FROM vendas WHERE pendente > 0"), (np.int64, float))
+    ids_d, inv_d = np.unique(cli_d, return_inverse=True)
+    divida_c = np.bincount(inv_d, weights=pend_d, minlength=len(ids_d))
+    escolhidos = {int(ids_r[i]) for i in np.argsort(receita_c)[::-1][:TOP]} | {int(ids_d[i]) for i in np.argsort(divida_c)[::-1][:TOP]}
+    nomes = {}
+    if escolhidos:
+        marcas = ",".join("?" * len(escolhidos))
+        nomes = dict(conn.execute(f"SELECT id, nome FROM clientes WHERE id IN ({marcas})", list(escolhidos)).fetchall())
+
+    # Mapa de calor dia da semana x hora (1970-01-01 foi quinta: +3 faz segunda = 0)
+    semana = (v['dia'][atual].astype(np.int64) + 3) % 7
+    calor = np.bincount(semana * 24 + v['hora'][atual], weights=v['total'][atual], minlength=7 * 24).reshape(7, 24)
+
+    # Série diária do período atual e do anterior, alinhadas por posição
+    pos = (v['dia'] - inicio_anterior).astype(np.int64)
+    por_dia = np.bincount(pos, weights=v['total'], minlength=2 * dias)[:2 * dias]
+
+    return {
+        'dias': dias,
+        'inicio': str(inicio_atual),
+        'fim': str(hoje),
+        'receita': receita_atual,
+        'receita_anterior': receita_anterior,
+        'crescimento_pct': (receita_atual / receita_anterior - 1) * 100 if receita_anterior else None,
+        'vendas': n_atual,
+        'ticket_medio': receita_atual / n_atual if n_atual else 0.0,
+        'margem': float(margem_p.sum()),
+        'produtos': produtos,
+        'top_receita': _ranking(ids_r, receita_c, nomes),
+        'top_divida': _ranking(ids_d, divida_c, nomes),
+        'calor': [{'name': DIAS_SEMANA[d], 'data': [round(float(x), 2) for x in calor[d]]} for d in range(6, -1, -1)],
+        'serie_atual': [round(float(x), 2) for x in por_dia[dias:]],
+        'serie_anterior': [round(float(x), 2) for x in por_dia[:dias]],
+        'serie_labels': [str(inicio_atual + np.timedelta64(i, 'D')) for i in range(dias)],
+    }
+
+
+def resumo(dias=90):
+    """calcular() sobre a cópia de leitura, com cache por processo invalidado pela versão dos dados."""
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    conn = snapshot.conexao()
+    try:
+        # Versão lida da própria cópia: o cache acompanha o snapshot, não a base viva.
+        versao = tuple(sorted(db.versoes_dados(conn, ('vendas', 'estoque', 'clientes')).items()))
+        chave = (dias, hoje)
+        with _lock:
+            guardado = _cache.get(chave)
+        if guardado and guardado[0] == versao:
+            return guardado[1]
+        resultado = calcular(conn, dias, hoje)
+    finally:
+        conn.close()
+    with _lock:
+        # Só uma janela por dia fica guardada: dias anteriores saem do cache.
+        for velha in [k for k in _cache if k[1] != hoje]:
+            del _cache[velha]
+        _cache[chave] = (versao, resultado)
+    return resultado
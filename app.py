@@ -1,45 +1,233 @@
-from flask import Flask, render_template_string, request, redirect, url_for, flash, Response, session
-import sqlite3
+from flask import Flask, render_template, request, redirect, url_for, flash, Response, session, jsonify, send_from_directory, send_file, make_response
 from datetime import datetime, timedelta
-import csv
-import io
+import click
+import functools
+import gzip
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import re
+import time
+from jinja2 import DictLoader
 from werkzeug.security import generate_password_hash, check_password_hash
+from db import get_db, transacao, pool_stats, migrar, reconstruir_resumo, versoes_dados, versao_aplicada, MIGRACOES
+import analises
+import arquivo
+import cep
+import escrita
+import jobs
+import metricas
+import relatorios
+import reposicao
+import rotas
+import snapshot
+from relatorios import filtros_vendas
 
 # --- INICIALIZAÇÃO DO SISTEMA ---
 app = Flask(__name__)
 app.secret_key = "eggpro_v10_titanium_ultra_key"
 
 # --- BANCO DE DADOS ---
-def get_db():
-    conn = sqlite3.connect('eggpro_v10.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
+# Não roda na importação: quem sobe o processo chama init_db() uma vez (serve.py no
+# mestre, antes do fork; `python app.py` e `flask init-db` no desenvolvimento).
 def init_db():
     with get_db() as conn:
-        conn.execute('''CREATE TABLE IF NOT EXISTS usuarios (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                        username TEXT UNIQUE, password TEXT)''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS clientes (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                        nome TEXT, tel TEXT, cep TEXT, rua TEXT, bairro TEXT, cidade TEXT, estado TEXT, numero TEXT)''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS estoque (
-                        produto TEXT PRIMARY KEY, qtd INTEGER, preco_custo REAL, preco_sugerido REAL)''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS vendas (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                        cli_id INTEGER, cli_nome TEXT, data TEXT, timestamp DATETIME,
-                        prod TEXT, qtd INTEGER, valor_unit REAL, total REAL, 
-                        pago_pix REAL, pago_dinheiro REAL, pendente REAL)''')
-        
+        aplicadas = migrar(conn)
         hash_pw = generate_password_hash('123')
         conn.execute("INSERT OR IGNORE INTO usuarios (username, password) VALUES (?, ?)", ('admin', hash_pw))
         
         prods = [("Branco Extra", 100, 12.0, 16.0), ("Vermelho Extra", 100, 14.0, 19.0), ("Jumbo", 50, 18.0, 24.0)]
         for p in prods:
-            conn.execute("INSERT OR IGNORE INTO estoque (produto, qtd, preco_custo, preco_sugerido) VALUES (?, ?, ?, ?)", p)
+            if conn.execute("INSERT OR IGNORE INTO estoque (produto, qtd, preco_custo, preco_sugerido) VALUES (?, ?, ?, ?)", p).rowcount:
+                reposicao.movimentar(conn, p[0], p[1], 'inicial')
+        conn.commit()
+        jobs.recuperar_orfaos(conn)  # relatórios deixados em 'rodando' por um processo anterior
+    return aplicadas
+
+@app.cli.command('init-db')
+def init_db_cmd():
+    """Aplica as migrações pendentes e os dados iniciais."""
+    aplicadas = init_db()
+    click.echo(f"Migrações aplicadas: {aplicadas}" if aplicadas else "Banco já está na versão atual.")
+
+@app.cli.command('reconstruir-resumo')
+@click.option('--inicio', help='Primeiro dia (YYYY-mm-dd); padrão: todo o histórico.')
+@click.option('--fim', help='Último dia (YYYY-mm-dd).')
+def reconstruir_resumo_cmd(inicio, fim):
+    """Recalcula vendas_diarias a partir de vendas."""
+    with get_db() as conn, arquivo.historico(conn, inicio, fim) as tabela:
+        conn.execute("BEGIN IMMEDIATE")
+        n = reconstruir_resumo(conn, inicio, fim, tabela)
         conn.commit()
+    click.echo(f"{n} linhas de resumo recalculadas.")
+
+@app.cli.command('cep-importar')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+def cep_importar_cmd(csv_path):
+    """Pré-carrega o cache de CEP a partir de um CSV (cep, logradouro, bairro, cidade, uf)."""
+    with open(csv_path, encoding='utf-8-sig') as f:
+        texto = f.read()
+    with get_db() as conn:
+        importados, ignorados = cep.importar_csv(conn, texto)
+    click.echo(f"{importados} CEPs importados, {ignorados} linhas ignoradas.")
+
+@app.cli.command('geocodificar')
+@click.option('--limite', type=int, help='Máximo de consultas à fonte nesta execução.')
+def geocodificar_cmd(limite):
+    """Geocodifica os clientes ainda sem coordenadas (ou com endereço alterado)."""
+    with get_db() as conn:
+        clis = conn.execute("SELECT * FROM clientes ORDER BY id").fetchall()
+        coords = rotas.geocodificar(conn, clis, limite)
+    click.echo(f"{len(coords)} de {len(clis)} clientes com coordenadas.")
+
+@app.cli.command('previsao')
+@click.option('--completo', is_flag=True, help='Recalcula todos os produtos, não só os que tiveram vendas novas.')
+def previsao_cmd(completo):
+    """Atualiza a previsão de consumo e o ponto de pedido do estoque."""
+    with get_db() as conn:
+        n = reposicao.atualizar(conn, completo)
+        for s in reposicao.alertas(conn):
+            click.echo(f"REPOR {s['produto']}: saldo {s['saldo']}, {s['taxa']:.1f}/dia, sugestão {s['sugestao']}")
+    click.echo(f"{n} produto(s) recalculado(s).")
+
+@app.cli.command('arquivar')
+@click.option('--antes', help='Dia de corte (YYYY-mm-dd); padrão: EGGPRO_ARQUIVO_MESES meses atrás.')
+@click.option('--vacuum', is_flag=True, help='Compacta a base principal no final.')
+def arquivar_cmd(antes, vacuum):
+    """Move vendas quitadas anteriores ao corte para arquivos anuais."""
+    with get_db() as conn:
+        n = arquivo.arquivar(conn, antes, ao_mover=lambda mes, qtd: click.echo(f"{mes}: {qtd} vendas"))
+        if vacuum:
+            conn.execute("VACUUM")
+    click.echo(f"{n} vendas arquivadas em {arquivo.pasta()}.")
+
+# --- MÉTRICAS ---
+@app.before_request
+def medir_inicio():
+    metricas.inicio_requisicao(request.endpoint)
+
+@app.before_request
+def iniciar_snapshot():
+    snapshot.iniciar()  # thread de renovação da cópia, uma por processo (depois do fork)
+
+@app.after_request
+def medir_fim(resp):
+    resumo = metricas.fim_requisicao(request.method, resp.status_code)
+    if resumo:
+        resp.headers['Server-Timing'] = f"app;dur={resumo[0] * 1000:.1f}, sql;dur={resumo[2] * 1000:.1f};desc=\"{resumo[1]} consultas\""
+    return resp
+
+@app.errorhandler(escrita.Ocupada)
+def escrita_ocupada(e):
+    # Fila de escrita travada ou sobrecarregada: 503 para o cliente (ou o service worker) repetir.
+    if request.path.startswith('/api/'):
+        return jsonify(erro=str(e)), 503, {'Retry-After': '5'}
+    return Response(str(e), status=503, mimetype='text/plain', headers={'Retry-After': '5'})
+
+@app.route('/vivo')
+def vivo():
+    return jsonify(vivo=True, pid=os.getpid())
+
+@app.route('/pronto')
+def pronto():
+    # Prontidão para o balanceador: o pool entrega uma conexão e o schema está na versão
+    # deste código. Só lê; migrar é com o init_db do deploy.
+    try:
+        with get_db() as conn:
+            versao = versao_aplicada(conn)
+    except Exception as e:
+        return jsonify(pronto=False, erro=str(e), pid=os.getpid()), 503
+    ok = versao >= len(MIGRACOES)
+    return jsonify(pronto=ok, schema=versao, esperado=len(MIGRACOES), pid=os.getpid()), 200 if ok else 503
+
+# Com EGGPRO_METRICS_TOKEN o coletor manda "Authorization: Bearer <token>"; sem ele,
+# /metrics só responde para quem conecta da própria máquina.
+METRICS_TOKEN = os.environ.get('EGGPRO_METRICS_TOKEN', '')
+
+@app.route('/metrics')
+def metrics():
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            return Response("token inválido\n", status=401, mimetype='text/plain', headers={'WWW-Authenticate': 'Bearer'})
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return Response("só local\n", status=403, mimetype='text/plain')
+    extras = {f'eggpro_db_pool_{k}': v for k, v in pool_stats().items()}
+    extras.update({f'eggpro_escrita_{k}': v for k, v in escrita.stats().items()})
+    extras.update({f'eggpro_cep_{k}': v for k, v in cep.stats().items()})
+    extras.update({f'eggpro_snapshot_{k}': int(v) if isinstance(v, bool) else v
+                   for k, v in snapshot.info().items() if isinstance(v, (int, float))})
+    return Response(metricas.texto_prometheus(extras), mimetype='text/plain; version=0.0.4')
+
+# --- COMPRESSÃO E CACHE HTTP ---
+COMPRESSAO_MIN = int(os.environ.get('EGGPRO_COMPRESSAO_MIN', '1024'))
+COMPRESSIVEIS = {'text/html', 'text/csv', 'text/plain', 'application/json'}
+INICIO_PROCESSO = str(time.time())  # novo deploy/restart invalida todas as ETags
 
-init_db()
+def condicional(*tabelas, copia=False):
+    """GET com ETag fraca derivada das versões das tabelas que a página lê.
+
+    Se nada mudou desde a última visita a resposta é um 304, sem consultas nem template.
+    Com copia=True a página lê o snapshot, então a ETag acompanha a cópia, não a base viva.
+    """
+    def decorador(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Mensagens flash pendentes precisam aparecer, então nunca viram 304.
+            if request.method != 'GET' or not session.get('user') or session.get('_flashes'):
+                return view(*args, **kwargs)
+            if copia and snapshot.ATIVO:
+                versoes = {'snapshot': snapshot.versao()}
+            else:
+                with get_db() as conn:
+                    versoes = versoes_dados(conn, tabelas)
+            chave = (INICIO_PROCESSO, request.full_path, session['user'], datetime.now().strftime("%Y-%m-%d"), sorted(versoes.items()))
+            etag = hashlib.sha1(repr(chave).encode()).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag, weak=True)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            resp.vary.add('Cookie')
+            return resp
+        return wrapper
+    return decorador
+
+@app.after_request
+def comprimir(resp):
+    if (resp.status_code != 200 or resp.direct_passthrough or 'Content-Encoding' in resp.headers
+            or resp.mimetype not in COMPRESSIVEIS or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return resp
+    resp.vary.add('Accept-Encoding')
+    if resp.is_streamed:
+        # Relatórios continuam em streaming: comprime pedaço a pedaço.
+        resp.response = relatorios.gzip_stream(resp.iter_encoded())
+        resp.headers.pop('Content-Length', None)
+    else:
+        corpo = resp.get_data()
+        if len(corpo) < COMPRESSAO_MIN:
+            return resp
+        resp.set_data(gzip.compress(corpo, compresslevel=6))
+    resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
+def dia_br(dia):
+    # 'YYYY-mm-dd' -> 'dd/mm/YYYY', formato usado nas telas
+    return f"{dia[8:10]}/{dia[5:7]}/{dia[0:4]}" if dia else ''
+
+app.jinja_env.filters['dia_br'] = dia_br
+
+def duracao(segundos):
+    if segundos is None: return '—'
+    if segundos < 90: return f"{segundos:.0f} s"
+    if segundos < 5400: return f"{segundos / 60:.0f} min"
+    return f"{segundos / 3600:.1f} h"
+
+app.jinja_env.filters['duracao'] = duracao
 
 # --- TEMPLATE BASE ---
 BASE_HTML = """
@@ -49,10 +237,15 @@ BASE_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>EggPro Titanium v10.2</title>
+    {% if ASSETS %}
+    <link href="{{ url_for('assets', nome=ASSETS['app.css']) }}" rel="stylesheet" />
+    <script src="{{ url_for('assets', nome=ASSETS['app.js']) }}"></script>
+    {% else %}
     <link href="https://cdn.jsdelivr.net/npm/daisyui@4.4.19/dist/full.min.css" rel="stylesheet" />
     <script src="https://cdn.tailwindcss.com"></script>
-    <script src="https://unpkg.com/lucide@latest"></script>
-    <script src="https://cdn.jsdelivr.net/npm/apexcharts"></script>
+    <script src="https://unpkg.com/lucide@0.460.0"></script>
+    <script src="https://cdn.jsdelivr.net/npm/apexcharts@3.54.1"></script>
+    {% endif %}
     <style>.glass-card { background: rgba(255, 255, 255, 0.03); backdrop-filter: blur(10px); border: 1px solid rgba(255,255,255,0.1); }</style>
 </head>
 <body class="bg-base-300 min-h-screen font-sans">
@@ -65,6 +258,7 @@ BASE_HTML = """
                 <div class="flex-1 px-2 font-black text-primary italic">EGGPRO v10</div>
             </div>
             <main class="p-4 md:p-10">
+                <div id="fila-offline" class="alert alert-warning mb-6 shadow-lg hidden"></div>
                 {% with messages = get_flashed_messages(with_categories=true) %}
                   {% if messages %}
                     {% for category, msg in messages %}
@@ -72,7 +266,7 @@ BASE_HTML = """
                     {% endfor %}
                   {% endif %}
                 {% endwith %}
-                {{ content | safe }}
+                {% block content %}{% endblock %}
             </main>
         </div> 
         <div class="drawer-side z-50">
@@ -85,9 +279,12 @@ BASE_HTML = """
                 <li><a href="/"><i data-lucide="layout-dashboard"></i> Dashboard</a></li>
                 <li><a href="/vender" class="bg-primary/10 text-primary font-bold"><i data-lucide="shopping-cart"></i> Nova Venda</a></li>
                 <li><a href="/vendas_log"><i data-lucide="history"></i> Histórico</a></li>
+                <li><a href="/analises"><i data-lucide="chart-column"></i> Análises</a></li>
+                <li><a href="/relatorios"><i data-lucide="file-down"></i> Relatórios</a></li>
                 <li><a href="/financeiro"><i data-lucide="dollar-sign"></i> Financeiro</a></li>
                 <li><a href="/estoque"><i data-lucide="package"></i> Estoque</a></li>
                 <li><a href="/clientes"><i data-lucide="users"></i> Clientes</a></li>
+                <li><a href="/rotas"><i data-lucide="route"></i> Rota de Entrega</a></li>
                 <div class="divider opacity-20">SISTEMA</div>
                 <li><a href="/usuarios"><i data-lucide="lock"></i> Operadores</a></li>
                 <li><a href="/logout" class="text-error"><i data-lucide="log-out"></i> Sair</a></li>
@@ -95,28 +292,114 @@ BASE_HTML = """
         </div>
     </div>
     {% else %}
-        {{ content | safe }}
+        {{ self.content() }}
     {% endif %}
-    <script>lucide.createIcons();</script>
+    <script>
+        let buscaTimer;
+        function buscarCliente(input) {
+            const caixa = input.closest('.busca-cliente'), lista = caixa.querySelector('ul'), oculto = caixa.querySelector('input[type=hidden]');
+            oculto.value = '';
+            clearTimeout(buscaTimer);
+            const q = input.value.trim();
+            if (q.length < 2) { lista.classList.add('hidden'); return; }
+            buscaTimer = setTimeout(() => fetch('/clientes/buscar?q=' + encodeURIComponent(q)).then(r => r.json()).then(res => {
+                lista.innerHTML = '';
+                res.forEach(c => {
+                    const li = document.createElement('li'), a = document.createElement('a');
+                    a.textContent = c.nome + (c.bairro ? ' — ' + c.bairro : '');
+                    a.onclick = () => { oculto.value = c.id; input.value = c.nome; lista.classList.add('hidden'); };
+                    li.appendChild(a); lista.appendChild(li);
+                });
+                lista.classList.toggle('hidden', !res.length);
+            }), 200);
+        }
+        lucide.createIcons();
+        {% if session.get('user') %}
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.register('/sw.js');
+            const sincronizar = () => navigator.serviceWorker.ready.then(r => r.active && r.active.postMessage('sincronizar'));
+            navigator.serviceWorker.addEventListener('message', ev => {
+                const aviso = document.getElementById('fila-offline'), { fila, erros } = ev.data;
+                aviso.innerHTML = `<a href="/fila">${fila} registro(s) feitos sem conexão aguardando envio` + (erros ? ` (${erros} com erro — corrigir)` : '') + '</a>';
+                aviso.classList.toggle('hidden', !fila);
+            });
+            window.addEventListener('online', sincronizar);
+            sincronizar();
+        }
+        {% else %}
+        // Sem sessão (saiu ou expirou): nada do usuário anterior fica no cache do aparelho.
+        if ('caches' in window) caches.keys().then(nomes => nomes.filter(n => n.startsWith('eggpro-')).forEach(n => caches.delete(n)));
+        {% endif %}
+    </script>
 </body>
 </html>
 """
 
-# --- DASHBOARD ---
-@app.route('/')
-def dashboard():
-    if not session.get('user'): return redirect(url_for('login'))
-    hoje = datetime.now().strftime("%d/%m/%Y")
-    with get_db() as conn:
-        resumo = conn.execute("SELECT SUM(total), SUM(pago_pix + pago_dinheiro), SUM(pendente) FROM vendas WHERE data = ?", (hoje,)).fetchone()
-        grafico = conn.execute("SELECT data, SUM(total) as t FROM vendas GROUP BY data ORDER BY timestamp DESC LIMIT 7").fetchall()
-    
-    labels = [r['data'] for r in reversed(grafico)]
-    valores = [r['t'] for r in reversed(grafico)]
+# --- ARQUIVOS ESTÁTICOS ---
+# `npm run build` gera static/dist com nomes por hash de conteúdo; sem o build
+# (ambiente de desenvolvimento) a base cai de volta para as CDNs.
+DIST = os.path.join(app.root_path, 'static', 'dist')
+
+def carregar_manifesto():
+    try:
+        with open(os.path.join(DIST, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+ASSETS = carregar_manifesto()
+app.jinja_env.globals['ASSETS'] = ASSETS
 
-    page_content = render_template_string("""
+@app.route('/assets/<path:nome>')
+def assets(nome):
+    # O nome muda a cada build, então o navegador pode guardar o arquivo para sempre.
+    aceita = request.headers.get('Accept-Encoding', '')
+    for ext, codificacao in (('.br', 'br'), ('.gz', 'gzip')):
+        if codificacao in aceita and os.path.isfile(os.path.join(DIST, nome + ext)):
+            resp = send_from_directory(DIST, nome + ext, mimetype=mimetypes.guess_type(nome)[0])
+            resp.headers['Content-Encoding'] = codificacao
+            break
+    else:
+        resp = send_from_directory(DIST, nome)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+# --- TEMPLATES ---
+# Cada página é registrada uma vez e herda de base.html; o Jinja compila na primeira
+# renderização e reaproveita o código compilado nas seguintes.
+TEMPLATES = {'base.html': BASE_HTML}
+TEMPLATES['macros.html'] = """
+{% macro busca_cliente(campo='cliente_id', cli_id='', cli_nome='', obrigatorio=True, classe='input-bordered w-full') %}
+<div class="relative busca-cliente">
+    <input type="hidden" name="{{ campo }}" value="{{ cli_id or '' }}">
+    <input type="text" value="{{ cli_nome or '' }}" placeholder="Buscar cliente (nome, telefone, bairro, rua)" autocomplete="off"
+           class="input {{ classe }}" oninput="buscarCliente(this)" {{ 'required' if obrigatorio }}>
+    <ul class="menu bg-base-200 rounded-box shadow-2xl absolute z-50 w-full mt-1 hidden"></ul>
+</div>
+{% endmacro %}
+
+{% macro aviso_snapshot(snap) %}
+{% if snap.ativo %}
+<div class="flex items-center gap-2 text-xs opacity-60 mb-6">
+    <i data-lucide="database" class="w-4"></i>
+    <span>Dados da cópia de leitura feita em {{ snap.feita_em or '—' }} (refeita a cada {{ snap.max_idade|duracao }})</span>
+    <form method="POST" action="{{ url_for('sistema_snapshot') }}"><button class="btn btn-ghost btn-xs">Atualizar agora</button></form>
+</div>
+{% endif %}
+{% endmacro %}
+"""
+app.jinja_loader = DictLoader(TEMPLATES)
+
+def precompilar_templates():
+    for nome in TEMPLATES:
+        app.jinja_env.get_template(nome)
+
+# --- DASHBOARD ---
+TEMPLATES['dashboard.html'] = """
+{% extends "base.html" %}{% block content %}
     <h1 class="text-3xl font-black italic mb-8">Painel Principal</h1>
-    <div class="grid grid-cols-1 md:grid-cols-3 gap-6 mb-10">
+    <div class="grid grid-cols-1 md:grid-cols-4 gap-6 mb-10">
         <div class="stats glass-card shadow">
             <div class="stat"><div class="stat-title text-xs font-bold uppercase">Vendido Hoje</div><div class="stat-value text-primary">R$ {{ "%.2f"|format(resumo[0] or 0) }}</div></div>
         </div>
@@ -126,7 +409,17 @@ def dashboard():
         <div class="stats glass-card shadow border-l-4 border-error">
             <div class="stat"><div class="stat-title text-xs font-bold uppercase">Em Aberto</div><div class="stat-value text-error">R$ {{ "%.2f"|format(resumo[2] or 0) }}</div></div>
         </div>
+        <div class="stats glass-card shadow">
+            <div class="stat"><div class="stat-title text-xs font-bold uppercase">Margem Hoje</div><div class="stat-value text-secondary">R$ {{ "%.2f"|format(resumo[3] or 0) }}</div></div>
+        </div>
+    </div>
+    {% if repor %}
+    <div class="alert alert-warning mb-6 shadow-lg flex-wrap"><i data-lucide="package-x"></i>
+        <span class="font-bold">Repor estoque:</span>
+        {% for s in repor %}<span>{{ s.produto }} ({{ s.saldo }} bjs{% if s.dias_restantes is not none %}, ~{{ "%.0f"|format(s.dias_restantes) }} dia(s){% endif %}){{ "," if not loop.last }}</span>{% endfor %}
+        <a href="/estoque" class="btn btn-sm">Ver estoque</a>
     </div>
+    {% endif %}
     <div class="card bg-base-100 p-6 shadow-xl"><div id="chart"></div></div>
     <script>
         new ApexCharts(document.querySelector("#chart"), {
@@ -137,17 +430,96 @@ def dashboard():
             xaxis: { categories: {{ labels | tojson }} }
         }).render();
     </script>
-    """, resumo=resumo, valores=valores, labels=labels)
-    return render_template_string(BASE_HTML, content=page_content)
+    {% endblock %}
+"""
 
-# --- HISTÓRICO E RELATÓRIOS (NOVO) ---
-@app.route('/vendas_log')
-def vendas_log():
+@app.route('/')
+@condicional('vendas', 'estoque', 'estoque_previsao')
+def dashboard():
     if not session.get('user'): return redirect(url_for('login'))
+    agora = datetime.now()
+    hoje, inicio = agora.strftime("%Y-%m-%d"), (agora - timedelta(days=6)).strftime("%Y-%m-%d")
     with get_db() as conn:
-        vendas = conn.execute("SELECT * FROM vendas ORDER BY id DESC").fetchall()
+        # vendas_diarias tem uma linha por dia e produto: o painel lê O(dias exibidos), não o histórico.
+        resumo = conn.execute('''SELECT SUM(r.vendido), SUM(r.recebido), SUM(r.pendente), SUM(r.vendido - r.qtd * COALESCE(e.preco_custo, 0))
+                                 FROM vendas_diarias r LEFT JOIN estoque e ON e.produto = r.prod WHERE r.dia = ?''', (hoje,)).fetchone()
+        grafico = conn.execute("SELECT dia, SUM(vendido) as t FROM vendas_diarias WHERE dia >= ? GROUP BY dia ORDER BY dia", (inicio,)).fetchall()
+        repor = reposicao.alertas(conn)
     
-    page_content = render_template_string("""
+    labels = [dia_br(r['dia']) for r in grafico]
+    valores = [r['t'] for r in grafico]
+
+    return render_template('dashboard.html', resumo=resumo, valores=valores, labels=labels, repor=repor)
+
+# --- ANÁLISES ---
+TEMPLATES['analises.html'] = """
+{% extends "base.html" %}{% from "macros.html" import aviso_snapshot %}{% block content %}
+    <div class="flex flex-col md:flex-row justify-between md:items-center mb-4 gap-4">
+        <h1 class="text-3xl font-black italic">Análises</h1>
+        <div class="join">
+            {% for d in [30, 90, 365] %}<a href="{{ url_for('analises_page', dias=d) }}" class="btn btn-sm join-item {{ 'btn-primary' if a.dias == d }}">{{ d }} dias</a>{% endfor %}
+        </div>
+    </div>
+    {{ aviso_snapshot(snap) }}
+    <div class="grid grid-cols-1 md:grid-cols-4 gap-6 mb-10">
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Receita</div><div class="stat-value text-primary text-2xl">R$ {{ "%.2f"|format(a.receita) }}</div>
+            <div class="stat-desc">{% if a.crescimento_pct is not none %}<span class="{{ 'text-success' if a.crescimento_pct >= 0 else 'text-error' }}">{{ "%+.1f"|format(a.crescimento_pct) }}%</span> vs. {{ a.dias }} dias anteriores{% else %}sem período anterior{% endif %}</div></div></div>
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Margem</div><div class="stat-value text-secondary text-2xl">R$ {{ "%.2f"|format(a.margem) }}</div></div></div>
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Vendas</div><div class="stat-value text-2xl">{{ a.vendas }}</div></div></div>
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Ticket Médio</div><div class="stat-value text-2xl">R$ {{ "%.2f"|format(a.ticket_medio) }}</div></div></div>
+    </div>
+    <div class="card bg-base-100 p-6 shadow-xl mb-6"><div id="serie"></div></div>
+    <div class="card bg-base-100 overflow-x-auto shadow-xl mb-6">
+        <table class="table table-zebra">
+            <thead><tr><th>Produto</th><th>Qtd</th><th>Receita</th><th>Custo</th><th>Margem</th><th>Margem %</th><th>Mix %</th></tr></thead>
+            <tbody>
+                {% for p in a.produtos %}
+                <tr><td class="font-bold">{{ p.produto }}</td><td>{{ p.qtd }}</td><td>R$ {{ "%.2f"|format(p.receita) }}</td><td>R$ {{ "%.2f"|format(p.custo) }}</td>
+                    <td class="text-secondary">R$ {{ "%.2f"|format(p.margem) }}</td><td>{{ "%.1f"|format(p.margem_pct) }}%</td><td>{{ "%.1f"|format(p.mix_pct) }}%</td></tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    <div class="grid grid-cols-1 md:grid-cols-2 gap-6 mb-6">
+        {% for titulo, lista, cor in [('Maiores clientes (receita)', a.top_receita, 'text-primary'), ('Maiores devedores', a.top_divida, 'text-error')] %}
+        <div class="card bg-base-100 shadow-xl p-6">
+            <h3 class="font-black mb-4">{{ titulo }}</h3>
+            {% for c in lista %}<div class="flex justify-between py-1 border-b border-white/5"><span>{{ c.nome }}</span><span class="{{ cor }} font-bold">R$ {{ "%.2f"|format(c.valor) }}</span></div>
+            {% else %}<p class="opacity-50">Nada no período.</p>{% endfor %}
+        </div>
+        {% endfor %}
+    </div>
+    <div class="card bg-base-100 p-6 shadow-xl"><h3 class="font-black">Receita por dia da semana e hora</h3><div id="calor"></div></div>
+    <script>
+        new ApexCharts(document.querySelector("#serie"), {
+            series: [{ name: 'Período atual', data: {{ a.serie_atual | tojson }} }, { name: 'Período anterior', data: {{ a.serie_anterior | tojson }} }],
+            chart: { type: 'area', height: 300, theme: 'dark', toolbar: {show:false} },
+            colors: ['#641ae6', '#64748b'], stroke: { curve: 'smooth', width: 2 }, dataLabels: { enabled: false },
+            xaxis: { categories: {{ a.serie_labels | tojson }}, tickAmount: 10 }
+        }).render();
+        new ApexCharts(document.querySelector("#calor"), {
+            series: {{ a.calor | tojson }},
+            chart: { type: 'heatmap', height: 320, theme: 'dark', toolbar: {show:false} },
+            colors: ['#641ae6'], dataLabels: { enabled: false },
+            xaxis: { categories: [...Array(24).keys()].map(h => h + 'h') }
+        }).render();
+    </script>
+    {% endblock %}
+"""
+
+@app.route('/analises')
+@condicional('vendas', 'estoque', 'clientes', copia=True)
+def analises_page():
+    if not session.get('user'): return redirect(url_for('login'))
+    dias = min(max(request.args.get('dias', 90, type=int), 7), 730)
+    return render_template('analises.html', a=analises.resumo(dias), snap=snapshot.info())
+
+# --- HISTÓRICO E RELATÓRIOS (NOVO) ---
+VENDAS_POR_PAGINA = 50
+VENDAS_POR_PAGINA_MAX = 500
+
+TEMPLATES['vendas_log.html'] = """
+{% extends "base.html" %}{% from "macros.html" import busca_cliente %}{% block content %}
     <div class="flex flex-col md:flex-row justify-between items-start md:items-center mb-8 gap-4">
         <h1 class="text-3xl font-black italic">Histórico de Vendas</h1>
         
@@ -159,10 +531,39 @@ def vendas_log():
                 <li><a href="/relatorio/diario"><i data-lucide="calendar"></i> Hoje (Diário)</a></li>
                 <li><a href="/relatorio/semanal"><i data-lucide="calendar-days"></i> Últimos 7 dias</a></li>
                 <li><a href="/relatorio/mensal"><i data-lucide="calendar-range"></i> Últimos 30 dias</a></li>
+                <li><a href="{{ url_for('gerar_relatorio', periodo='filtro', **filtros) }}"><i data-lucide="filter"></i> Filtro atual (CSV)</a></li>
+                <li><a href="{{ url_for('gerar_relatorio', periodo='filtro', formato='xlsx', **filtros) }}"><i data-lucide="sheet"></i> Filtro atual (Excel)</a></li>
+                <div class="divider my-0 text-xs opacity-50">Em segundo plano</div>
+                {% for formato, rotulo in [('pdf', 'PDF'), ('xlsx', 'Excel'), ('csv', 'CSV')] %}
+                <li><form method="POST" action="{{ url_for('relatorios_jobs') }}" class="p-0">
+                    <input type="hidden" name="periodo" value="filtro"><input type="hidden" name="formato" value="{{ formato }}">
+                    {% for k, v in filtros.items() %}<input type="hidden" name="{{ k }}" value="{{ v }}">{% endfor %}
+                    <button class="w-full text-left px-4 py-2"><i data-lucide="clock" class="inline w-4"></i> Filtro atual ({{ rotulo }})</button>
+                </form></li>
+                {% endfor %}
             </ul>
         </div>
     </div>
 
+    <form method="GET" class="card bg-base-100 shadow-xl p-4 mb-6 grid grid-cols-2 md:grid-cols-6 gap-2">
+        <div class="col-span-2 md:col-span-1">{{ busca_cliente('cliente', filtros.get('cliente'), cli_nome, obrigatorio=False, classe='input-bordered input-sm w-full') }}</div>
+        <select name="produto" class="select select-bordered select-sm">
+            <option value="">Todos os produtos</option>
+            {% for p in prods %}<option {{ 'selected' if filtros.get('produto') == p['produto'] }}>{{ p['produto'] }}</option>{% endfor %}
+        </select>
+        <select name="status" class="select select-bordered select-sm">
+            <option value="">Qualquer status</option>
+            <option value="pago" {{ 'selected' if filtros.get('status') == 'pago' }}>Pago</option>
+            <option value="pendente" {{ 'selected' if filtros.get('status') == 'pendente' }}>Pendente</option>
+        </select>
+        <input name="inicio" type="date" value="{{ filtros.get('inicio', '') }}" class="input input-bordered input-sm" />
+        <input name="fim" type="date" value="{{ filtros.get('fim', '') }}" class="input input-bordered input-sm" />
+        <div class="flex gap-2 col-span-2 md:col-span-1">
+            <button class="btn btn-primary btn-sm flex-1"><i data-lucide="filter"></i> Filtrar</button>
+            <a href="/vendas_log" class="btn btn-ghost btn-sm">Limpar</a>
+        </div>
+    </form>
+
     <div class="card bg-base-100 overflow-x-auto shadow-xl">
         <table class="table table-zebra">
             <thead><tr><th>ID</th><th>Cliente</th><th>Data</th><th>Produto</th><th>Total</th><th>Status</th><th>Ação</th></tr></thead>
@@ -175,60 +576,184 @@ def vendas_log():
                     <td>{{ v['prod'] }} ({{ v['qtd'] }}x)</td>
                     <td class="font-bold text-primary">R$ {{ "%.2f"|format(v['total']) }}</td>
                     <td>{{ "Pago" if v['pendente'] <= 0 else "Pendente" }}</td>
-                    <td><a href="/vendas/excluir/{{ v['id'] }}" class="btn btn-ghost btn-xs text-error" onclick="return confirm('Estornar?')">Estornar</a></td>
+                    <td>{% if v['id'] in arquivadas %}<span class="badge badge-ghost badge-sm" title="Vendas arquivadas não podem ser estornadas">arquivada</span>{% else %}<a href="/vendas/excluir/{{ v['id'] }}" class="btn btn-ghost btn-xs text-error" onclick="return confirm('Estornar?')">Estornar</a>{% endif %}</td>
                 </tr>
+                {% else %}
+                <tr><td colspan="7" class="text-center opacity-50">Nenhuma venda encontrada.</td></tr>
                 {% endfor %}
             </tbody>
         </table>
     </div>
-    """, vendas=vendas)
-    return render_template_string(BASE_HTML, content=page_content)
+    <div class="flex justify-between mt-6">
+        {% if cursor_ant %}<a href="{{ url_for('vendas_log', depois=cursor_ant, **filtros) }}" class="btn btn-sm"><i data-lucide="chevron-left"></i> Mais recentes</a>{% else %}<span></span>{% endif %}
+        {% if cursor_prox %}<a href="{{ url_for('vendas_log', antes=cursor_prox, **filtros) }}" class="btn btn-sm">Mais antigas <i data-lucide="chevron-right"></i></a>{% endif %}
+    </div>
+    {% endblock %}
+"""
+
+@app.route('/vendas_log')
+@condicional('vendas', 'clientes', 'estoque')
+def vendas_log():
+    if not session.get('user'): return redirect(url_for('login'))
+    filtros, where, params = filtros_vendas(request.args)
+    n = min(max(request.args.get('n', VENDAS_POR_PAGINA, type=int), 1), VENDAS_POR_PAGINA_MAX)
+    if n != VENDAS_POR_PAGINA: filtros['n'] = n
+    antes, depois = request.args.get('antes', type=int), request.args.get('depois', type=int)
+
+    # Paginação por chave (id): cada página é um range scan de n+1 linhas, não importa quantas vendas existam.
+    if depois:
+        where.append("id > ?"); params.append(depois); ordem = "ASC"
+    else:
+        if antes: where.append("id < ?"); params.append(antes)
+        ordem = "DESC"
+    query = "SELECT * FROM {}" + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY id {ordem} LIMIT ?"
+    arquivadas = set()
+    with get_db() as conn:
+        vendas = conn.execute(query.format('vendas'), params + [n + 1]).fetchall()
+        # Com anos arquivados no período, a página só precisa da união se puder alcançar ids arquivados.
+        arquivado = arquivo.max_id(conn, filtros.get('inicio'), filtros.get('fim'))
+        if arquivado is not None and (depois < arquivado if depois else len(vendas) <= n or vendas[-1]['id'] < arquivado):
+            with arquivo.historico(conn, filtros.get('inicio'), filtros.get('fim')) as tabela:
+                vendas = conn.execute(query.format(tabela), params + [n + 1]).fetchall()
+            # Vendas do arquivo não podem ser estornadas: a página esconde o botão para elas.
+            ids = [v['id'] for v in vendas]
+            quentes = {r[0] for r in conn.execute(f"SELECT id FROM vendas WHERE id IN ({','.join('?' * len(ids))})", ids)} if ids else set()
+            arquivadas = set(ids) - quentes
+        cli = conn.execute("SELECT nome FROM clientes WHERE id = ?", (filtros['cliente'],)).fetchone() if 'cliente' in filtros else None
+        prods = conn.execute("SELECT produto FROM estoque ORDER BY produto").fetchall()
+
+    tem_mais = len(vendas) > n
+    vendas = vendas[:n]
+    if depois:
+        vendas.reverse()
+        cursor_prox = vendas[-1]['id'] if vendas else None
+        cursor_ant = vendas[0]['id'] if tem_mais and vendas else None
+    else:
+        cursor_prox = vendas[-1]['id'] if tem_mais else None
+        cursor_ant = vendas[0]['id'] if antes and vendas else None
+
+    return render_template('vendas_log.html', vendas=vendas, cli_nome=cli['nome'] if cli else '', prods=prods, filtros=filtros, cursor_ant=cursor_ant, cursor_prox=cursor_prox, arquivadas=arquivadas)
 
 @app.route('/relatorio/<periodo>')
 def gerar_relatorio(periodo):
     if not session.get('user'): return redirect(url_for('login'))
-    agora = datetime.now()
-    query = "SELECT * FROM vendas"
-    params = []
+    args = request.args.copy()
+    _, _, nome = relatorios.consulta_relatorio(periodo, args)
+    formato = args.get('formato', 'csv')
+    if formato not in relatorios.FORMATOS: formato = 'csv'
+    escrever, mimetype, ext = relatorios.FORMATOS[formato]
 
-    if periodo == 'diario':
-        query += " WHERE data = ?"; params.append(agora.strftime("%d/%m/%Y"))
-    elif periodo == 'semanal':
-        query += " WHERE timestamp >= ?"; params.append((agora - timedelta(days=7)))
-    elif periodo == 'mensal':
-        query += " WHERE timestamp >= ?"; params.append((agora - timedelta(days=30)))
+    def gerar():
+        # Exportações longas leem a cópia de leitura: não disputam lock nem cache com as vendas.
+        conn = snapshot.conexao()
+        try:
+            with arquivo.historico(conn, *relatorios.intervalo(periodo, args)) as tabela:
+                query, params, _ = relatorios.consulta_relatorio(periodo, args, tabela=tabela)
+                cur = conn.execute(query, params)
+                try:
+                    yield from escrever(cur)
+                finally:
+                    cur.close()  # cliente desistiu no meio: o cursor precisa fechar antes do DETACH
+        finally:
+            conn.close()
 
-    with get_db() as conn:
-        vendas = conn.execute(query, params).fetchall()
+    corpo = gerar()
+    if request.args.get('gzip'):
+        corpo, mimetype, ext = relatorios.gzip_stream(corpo), 'application/gzip', ext + '.gz'
+    return Response(corpo, mimetype=mimetype, headers={"Content-Disposition": f"attachment;filename={nome}.{ext}"})
 
-    output = io.StringIO()
-    output.write('\ufeff') # Garante acentos no Excel
-    writer = csv.writer(output, delimiter=';')
-    writer.writerow(['ID', 'Cliente', 'Data', 'Produto', 'Qtd', 'Total', 'Pendente'])
-    for v in vendas:
-        writer.writerow([v['id'], v['cli_nome'], v['data'], v['prod'], v['qtd'], v['total'], v['pendente']])
-
-    output.seek(0)
-    return Response(output.read(), mimetype="text/csv", headers={"Content-Disposition": f"attachment;filename=relatorio_{periodo}.csv"})
+TEMPLATES['relatorios_jobs.html'] = """
+{% extends "base.html" %}{% from "macros.html" import aviso_snapshot %}{% block content %}
+    {% if pendentes %}<meta http-equiv="refresh" content="3">{% endif %}
+    <h1 class="text-3xl font-black italic mb-4">Relatórios</h1>
+    {{ aviso_snapshot(snap) }}
+    <form method="POST" class="card bg-base-100 shadow-xl p-4 mb-6 grid grid-cols-2 md:grid-cols-5 gap-2">
+        <select name="periodo" class="select select-bordered select-sm">
+            <option value="filtro">Intervalo abaixo</option><option value="diario">Hoje</option>
+            <option value="semanal">Últimos 7 dias</option><option value="mensal">Últimos 30 dias</option>
+        </select>
+        <input name="inicio" type="date" class="input input-bordered input-sm" />
+        <input name="fim" type="date" class="input input-bordered input-sm" />
+        <select name="formato" class="select select-bordered select-sm"><option value="pdf">PDF</option><option value="xlsx">Excel</option><option value="csv">CSV</option></select>
+        <button class="btn btn-primary btn-sm">Gerar</button>
+    </form>
+    <div class="card bg-base-100 overflow-x-auto shadow-xl">
+        <table class="table">
+            <thead><tr><th>Pedido</th><th>Período</th><th>Formato</th><th>Status</th><th></th></tr></thead>
+            <tbody>
+                {% for j in jobs %}
+                <tr>
+                    <td class="text-xs">{{ j['criado_em'].replace('T', ' ') }}</td>
+                    <td>{{ j['periodo'] }}</td>
+                    <td class="uppercase">{{ j['formato'] }}</td>
+                    <td>
+                        {% if j['status'] == 'pronto' %}<span class="badge badge-success">pronto</span> <span class="text-xs opacity-50">{{ (j['bytes'] / 1024) | round(1) }} KB</span>
+                        {% elif j['status'] == 'erro' %}<span class="badge badge-error" title="{{ j['erro'] }}">erro</span>
+                        {% elif j['status'] == 'expirado' %}<span class="badge badge-ghost">expirado</span>
+                        {% else %}<span class="loading loading-spinner loading-xs"></span> {{ j['status'] }}{% endif %}
+                    </td>
+                    <td>{% if j['status'] == 'pronto' %}<a href="{{ url_for('relatorios_download', job_id=j['id']) }}" class="btn btn-xs btn-primary"><i data-lucide="download"></i> Baixar</a>{% endif %}</td>
+                </tr>
+                {% else %}
+                <tr><td colspan="5" class="text-center opacity-50">Nenhum relatório pedido.</td></tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    {% endblock %}
+"""
 
-# --- CLIENTES ---
-@app.route('/clientes', methods=['GET', 'POST'])
-def clientes():
+@app.route('/relatorios', methods=['GET', 'POST'])
+def relatorios_jobs():
     if not session.get('user'): return redirect(url_for('login'))
     if request.method == 'POST':
-        f = request.form
-        with get_db() as conn:
-            conn.execute("INSERT INTO clientes (nome, tel, cep, rua, bairro, cidade, estado, numero) VALUES (?,?,?,?,?,?,?,?)", 
-                        (f['nome'], f['tel'], f['cep'], f['rua'], f['bairro'], f['cidade'], f['estado'], f['numero']))
-            conn.commit()
-        flash("Cliente cadastrado!", "success")
+        try:
+            jobs.enviar(session['user'], request.form.get('periodo', 'filtro'), request.form.get('formato', 'csv'), request.form)
+            flash("Relatório na fila; ele aparece aqui quando ficar pronto.", "info")
+        except (jobs.FilaCheia, ValueError) as e:
+            flash(str(e), "error")
+        return redirect(url_for('relatorios_jobs'))
+    lista = jobs.listar(session['user'])
+    return render_template('relatorios_jobs.html', jobs=lista, pendentes=any(j['status'] in ('fila', 'rodando') for j in lista),
+                           snap=snapshot.info())
 
-    with get_db() as conn:
-        clis = conn.execute("SELECT * FROM clientes ORDER BY nome").fetchall()
-    
-    page_content = render_template_string(r"""
-    <div class="flex justify-between items-center mb-8">
+@app.route('/relatorios/<job_id>')
+def relatorios_status(job_id):
+    if not session.get('user'): return jsonify({}), 401
+    job = jobs.obter(job_id, session['user'])
+    if job is None: return jsonify({'erro': 'não encontrado'}), 404
+    return jsonify({k: job[k] for k in ('id', 'periodo', 'formato', 'status', 'criado_em', 'concluido_em', 'bytes', 'erro')})
+
+@app.route('/relatorios/<job_id>/download')
+def relatorios_download(job_id):
+    if not session.get('user'): return redirect(url_for('login'))
+    job = jobs.obter(job_id, session['user'])
+    if job is None or job['status'] != 'pronto' or not os.path.exists(job['arquivo'] or ''):
+        flash("Relatório indisponível ou expirado.", "warning")
+        return redirect(url_for('relatorios_jobs'))
+    return send_file(job['arquivo'], mimetype=jobs.FORMATOS[job['formato']][0], as_attachment=True, download_name=job['nome'])
+
+# --- CLIENTES ---
+CLIENTES_POR_PAGINA = 60
+
+def consulta_fts(termo):
+    # Cada palavra vira um prefixo entre aspas, então nada do que foi digitado é lido como sintaxe FTS.
+    return " ".join(f'"{t}"*' for t in re.findall(r'\w+', termo))
+
+def buscar_clientes(conn, termo, limite=20):
+    consulta = consulta_fts(termo)
+    if not consulta: return []
+    return conn.execute('''SELECT c.* FROM clientes_fts f JOIN clientes c ON c.id = f.rowid
+                           WHERE clientes_fts MATCH ? ORDER BY f.rank LIMIT ?''', (consulta, limite)).fetchall()
+
+TEMPLATES['clientes.html'] = r"""
+{% extends "base.html" %}{% block content %}
+    <div class="flex flex-col md:flex-row justify-between md:items-center mb-8 gap-4">
         <h1 class="text-3xl font-black italic">Clientes</h1>
+        <form method="GET" class="flex gap-2 flex-1 md:max-w-md">
+            <input name="q" value="{{ q }}" placeholder="Nome, telefone, bairro ou rua" class="input input-bordered flex-1" />
+            <button class="btn btn-ghost btn-square"><i data-lucide="search"></i></button>
+        </form>
         <button class="btn btn-primary" onclick="m_c.showModal()">+ Novo Cliente</button>
     </div>
     <div class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
@@ -246,8 +771,14 @@ def clientes():
                 <div class="badge badge-outline mt-2">{{ c['tel'] }}</div>
             </div>
         </div>
+        {% else %}
+        <p class="opacity-50">Nenhum cliente encontrado.</p>
         {% endfor %}
     </div>
+    <div class="flex justify-between mt-6">
+        {% if cursor_ant %}<a href="{{ url_for('clientes', antes=cursor_ant) }}" class="btn btn-sm"><i data-lucide="chevron-left"></i> Anteriores</a>{% else %}<span></span>{% endif %}
+        {% if cursor_prox %}<a href="{{ url_for('clientes', apos=cursor_prox) }}" class="btn btn-sm">Próximos <i data-lucide="chevron-right"></i></a>{% endif %}
+    </div>
     <dialog id="m_c" class="modal">
         <div class="modal-box w-11/12 max-w-2xl">
             <h3 class="font-black text-2xl mb-6">Cadastrar Cliente</h3>
@@ -269,34 +800,91 @@ def clientes():
         function buscarCEP(idCep, idRua, idBairro, idCidade, idUf) {
             let cep = document.getElementById(idCep).value.replace(/\D/g, '');
             if (cep.length != 8) return;
-            fetch(`https://viacep.com.br/ws/${cep}/json/`)
-                .then(r => r.json()).then(d => {
-                    if (!d.erro) {
-                        document.getElementById(idRua).value = d.logradouro;
-                        document.getElementById(idBairro).value = d.bairro;
-                        document.getElementById(idCidade).value = d.localidade;
-                        document.getElementById(idUf).value = d.uf;
-                    }
-                });
+            fetch(`/cep/${cep}`).then(r => r.ok ? r.json() : null).then(d => {
+                if (d) {
+                    document.getElementById(idRua).value = d.logradouro;
+                    document.getElementById(idBairro).value = d.bairro;
+                    document.getElementById(idCidade).value = d.cidade;
+                    document.getElementById(idUf).value = d.uf;
+                }
+            }).catch(() => {});
         }
     </script>
-    """, clis=clis)
-    return render_template_string(BASE_HTML, content=page_content)
+    {% endblock %}
+"""
 
-@app.route('/clientes/editar/<int:id>', methods=['GET', 'POST'])
-def clientes_editar(id):
+@app.route('/clientes', methods=['GET', 'POST'])
+@condicional('clientes')
+def clientes():
     if not session.get('user'): return redirect(url_for('login'))
-    with get_db() as conn:
-        if request.method == 'POST':
-            f = request.form
-            conn.execute("UPDATE clientes SET nome=?, tel=?, cep=?, rua=?, bairro=?, cidade=?, estado=?, numero=? WHERE id=?", 
-                        (f['nome'], f['tel'], f['cep'], f['rua'], f['bairro'], f['cidade'], f['estado'], f['numero'], id))
+    if request.method == 'POST':
+        f = request.form
+        with get_db() as conn:
+            conn.execute("INSERT INTO clientes (nome, tel, cep, rua, bairro, cidade, estado, numero) VALUES (?,?,?,?,?,?,?,?)", 
+                        (f['nome'], f['tel'], f['cep'], f['rua'], f['bairro'], f['cidade'], f['estado'], f['numero']))
             conn.commit()
-            flash("Cliente atualizado!", "info")
-            return redirect(url_for('clientes'))
-        c = conn.execute("SELECT * FROM clientes WHERE id=?", (id,)).fetchone()
+        flash("Cliente cadastrado!", "success")
+
+    q = request.args.get('q', '').strip()
+    apos, antes = request.args.get('apos', type=int), request.args.get('antes', type=int)
+    n = CLIENTES_POR_PAGINA
+    cursor_ant = cursor_prox = None
+    with get_db() as conn:
+        if q:
+            clis = buscar_clientes(conn, q, n)
+        elif antes:
+            # Página anterior: percorre (nome, id) ao contrário a partir do primeiro cliente exibido.
+            clis = conn.execute("SELECT * FROM clientes WHERE (nome, id) < (SELECT nome, id FROM clientes WHERE id = ?) ORDER BY nome DESC, id DESC LIMIT ?", (antes, n + 1)).fetchall()
+            tem_mais = len(clis) > n
+            clis = clis[:n][::-1]
+            cursor_ant = clis[0]['id'] if tem_mais and clis else None
+            cursor_prox = clis[-1]['id'] if clis else None
+        else:
+            if apos:
+                clis = conn.execute("SELECT * FROM clientes WHERE (nome, id) > (SELECT nome, id FROM clientes WHERE id = ?) ORDER BY nome, id LIMIT ?", (apos, n + 1)).fetchall()
+            else:
+                clis = conn.execute("SELECT * FROM clientes ORDER BY nome, id LIMIT ?", (n + 1,)).fetchall()
+            tem_mais = len(clis) > n
+            clis = clis[:n]
+            cursor_prox = clis[-1]['id'] if tem_mais else None
+            cursor_ant = clis[0]['id'] if apos and clis else None
     
-    page_content = render_template_string(r"""
+    return render_template('clientes.html', clis=clis, q=q, cursor_ant=cursor_ant, cursor_prox=cursor_prox)
+
+@app.route('/clientes/buscar')
+@condicional('clientes')
+def clientes_buscar():
+    if not session.get('user'): return jsonify([]), 401
+    with get_db() as conn:
+        clis = buscar_clientes(conn, request.args.get('q', ''), min(request.args.get('limite', 20, type=int), 100))
+    return jsonify([{'id': c['id'], 'nome': c['nome'], 'tel': c['tel'], 'bairro': c['bairro']} for c in clis])
+
+@app.route('/clientes/offline')
+@condicional('clientes')
+def clientes_offline():
+    # Lista compacta que o service worker guarda para a busca de clientes funcionar sem sinal.
+    if not session.get('user'): return jsonify([]), 401
+    with get_db() as conn:
+        clis = conn.execute("SELECT id, nome, tel, bairro, rua FROM clientes ORDER BY nome").fetchall()
+    return jsonify([list(c) for c in clis])
+
+@app.route('/cep/<valor>')
+def cep_buscar(valor):
+    if not session.get('user'): return jsonify(erro='login'), 401
+    try:
+        endereco = cep.buscar(valor)
+    except ValueError as e:
+        return jsonify(erro=str(e)), 400
+    except cep.FonteIndisponivel:
+        return jsonify(erro="CEP fora do cache e consulta externa indisponível."), 503
+    if endereco is None:
+        return jsonify(erro="CEP não encontrado."), 404
+    resp = jsonify(endereco)
+    resp.headers['Cache-Control'] = 'private, max-age=86400'
+    return resp
+
+TEMPLATES['clientes_editar.html'] = r"""
+{% extends "base.html" %}{% block content %}
     <div class="max-w-2xl mx-auto card bg-base-100 shadow-2xl p-8 border-t-8 border-info">
         <h2 class="text-3xl font-black italic mb-8">Editar Cliente</h2>
         <form method="POST" class="grid grid-cols-2 gap-4">
@@ -316,18 +904,33 @@ def clientes_editar(id):
         function buscarCEP(idCep, idRua, idBairro, idCidade, idUf) {
             let cep = document.getElementById(idCep).value.replace(/\D/g, '');
             if (cep.length != 8) return;
-            fetch(`https://viacep.com.br/ws/${cep}/json/`).then(r => r.json()).then(d => {
-                if (!d.erro) {
+            fetch(`/cep/${cep}`).then(r => r.ok ? r.json() : null).then(d => {
+                if (d) {
                     document.getElementById(idRua).value = d.logradouro;
                     document.getElementById(idBairro).value = d.bairro;
-                    document.getElementById(idCidade).value = d.localidade;
+                    document.getElementById(idCidade).value = d.cidade;
                     document.getElementById(idUf).value = d.uf;
                 }
-            });
+            }).catch(() => {});
         }
     </script>
-    """, c=c)
-    return render_template_string(BASE_HTML, content=page_content)
+    {% endblock %}
+"""
+
+@app.route('/clientes/editar/<int:id>', methods=['GET', 'POST'])
+def clientes_editar(id):
+    if not session.get('user'): return redirect(url_for('login'))
+    with get_db() as conn:
+        if request.method == 'POST':
+            f = request.form
+            conn.execute("UPDATE clientes SET nome=?, tel=?, cep=?, rua=?, bairro=?, cidade=?, estado=?, numero=? WHERE id=?", 
+                        (f['nome'], f['tel'], f['cep'], f['rua'], f['bairro'], f['cidade'], f['estado'], f['numero'], id))
+            conn.commit()
+            flash("Cliente atualizado!", "info")
+            return redirect(url_for('clientes'))
+        c = conn.execute("SELECT * FROM clientes WHERE id=?", (id,)).fetchone()
+    
+    return render_template('clientes_editar.html', c=c)
 
 @app.route('/clientes/excluir/<int:id>')
 def clientes_excluir(id):
@@ -337,38 +940,155 @@ def clientes_excluir(id):
     flash("Cliente removido.", "warning")
     return redirect(url_for('clientes'))
 
-# --- VENDA ---
-@app.route('/vender', methods=['GET', 'POST'])
-def vender():
+# --- ROTA DE ENTREGA ---
+TEMPLATES['rotas.html'] = """
+{% extends "base.html" %}{% block content %}
+    <div class="flex flex-col md:flex-row justify-between items-start md:items-center mb-8 gap-4">
+        <h1 class="text-3xl font-black italic">Rota de Entrega</h1>
+        <form method="GET" class="flex flex-wrap gap-2 items-center">
+            <input name="dia" type="date" value="{{ r.dia }}" class="input input-bordered input-sm" />
+            <label class="label cursor-pointer gap-2"><input type="checkbox" name="pendentes" value="1" class="checkbox checkbox-sm" {{ 'checked' if pendentes }} /><span class="label-text">Incluir saldos em aberto</span></label>
+            <input type="hidden" name="enviado" value="1" />
+            <button class="btn btn-primary btn-sm"><i data-lucide="route"></i> Planejar</button>
+        </form>
+    </div>
+    <div class="grid grid-cols-2 md:grid-cols-4 gap-6 mb-8">
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Paradas</div><div class="stat-value text-2xl">{{ r.paradas|length }}</div></div></div>
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Distância (linha reta)</div><div class="stat-value text-primary text-2xl">{{ "%.1f"|format(r.total_km) }} km</div></div></div>
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Sem 2-opt</div><div class="stat-value text-2xl opacity-60">{{ "%.1f"|format(r.km_sem_2opt) }} km</div></div></div>
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">Calculada em</div><div class="stat-value text-2xl">{{ "%.0f"|format(r.duracao * 1000) }} ms</div></div></div>
+    </div>
+    {% if r.sem_coordenadas %}
+    <div class="alert alert-warning mb-6 shadow-lg"><span>{{ r.sem_coordenadas|length }} cliente(s) fora da rota por falta de coordenadas:
+        {% for c in r.sem_coordenadas[:10] %}<a href="{{ url_for('clientes_editar', id=c['id']) }}" class="link">{{ c['nome'] }}</a>{{ ", " if not loop.last }}{% endfor %}{{ "…" if r.sem_coordenadas|length > 10 }}
+        — {% if na_fila %}{{ na_fila }} na fila de geocodificação, recarregue em instantes{% else %}confira o endereço{% endif %} ou rode <code>flask geocodificar</code>.</span></div>
+    {% endif %}
+    {% if r.paradas %}
+    <div class="grid grid-cols-1 lg:grid-cols-3 gap-6">
+        <div class="card bg-base-100 shadow-xl p-4">
+            <svg viewBox="0 0 100 100" class="w-full">
+                <polygon points="{% for x, y in r.desenho %}{{ x }},{{ y }} {% endfor %}" fill="none" stroke="#641ae6" stroke-width="0.5" />
+                {% for x, y in r.desenho %}
+                <circle cx="{{ x }}" cy="{{ y }}" r="{{ 1.8 if loop.first else 1.1 }}" fill="{{ '#f87272' if loop.first else '#fbbf24' }}" />
+                {% if not loop.first and r.paradas|length <= 60 %}<text x="{{ x + 1.3 }}" y="{{ y - 1 }}" font-size="2.5" fill="currentColor">{{ loop.index0 }}</text>{% endif %}
+                {% endfor %}
+            </svg>
+            <p class="text-xs opacity-50 mt-2">Em vermelho a origem ({{ "centro das paradas" if r.origem_centro else "EGGPRO_ROTA_ORIGEM" }}). Distâncias em linha reta.</p>
+        </div>
+        <div class="card bg-base-100 overflow-x-auto shadow-xl lg:col-span-2">
+            <table class="table table-zebra table-sm">
+                <thead><tr><th>#</th><th>Cliente</th><th>Endereço</th><th>Bandejas</th><th>Em aberto</th><th>Trecho</th><th>Acum.</th><th></th></tr></thead>
+                <tbody>
+                    {% for p in r.paradas %}{% set c = p.cliente %}
+                    <tr>
+                        <td class="font-black">{{ p.ordem }}</td>
+                        <td class="font-bold">{{ c['nome'] }}<div class="text-xs opacity-50">{{ c['tel'] or '' }}</div></td>
+                        <td class="text-xs">{{ c['rua'] or '' }}, {{ c['numero'] or '' }}<div class="opacity-50">{{ c['bairro'] or '' }}</div></td>
+                        <td>{{ c['qtd_dia']|int if c['qtd_dia'] else '' }}</td>
+                        <td class="{{ 'text-error font-bold' if c['pendente'] > 0 }}">{{ "R$ %.2f"|format(c['pendente']) if c['pendente'] > 0 else '' }}</td>
+                        <td class="text-xs">{{ "%.1f"|format(p.trecho_km) }} km</td>
+                        <td class="text-xs">{{ "%.1f"|format(p.acumulado_km) }} km</td>
+                        <td><a href="https://www.google.com/maps/search/?api=1&query={{ p.lat }},{{ p.lon }}" target="_blank" rel="noopener" class="btn btn-ghost btn-xs"><i data-lucide="map-pin"></i></a></td>
+                    </tr>
+                    {% endfor %}
+                    <tr><td></td><td colspan="4" class="opacity-50">Volta à origem</td><td class="text-xs">{{ "%.1f"|format(r.volta_km) }} km</td><td class="text-xs">{{ "%.1f"|format(r.total_km) }} km</td><td></td></tr>
+                </tbody>
+            </table>
+        </div>
+    </div>
+    {% elif not r.sem_coordenadas %}
+    <p class="opacity-50">Nenhum cliente com venda no dia{{ " ou saldo em aberto" if pendentes }}.</p>
+    {% endif %}
+    {% endblock %}
+"""
+
+@app.route('/rotas')
+def rotas_page():
     if not session.get('user'): return redirect(url_for('login'))
+    dia = request.args.get('dia') or datetime.now().strftime("%Y-%m-%d")
+    pendentes = request.args.get('pendentes') == '1' or not request.args.get('enviado')
     with get_db() as conn:
-        if request.method == 'POST':
-            f = request.form
-            total = int(f['qtd']) * float(f['valor_unit'])
-            pend = total - (float(f['pago_pix'] or 0) + float(f['pago_dinheiro'] or 0))
-            cli = conn.execute("SELECT nome FROM clientes WHERE id=?", (f['cliente_id'],)).fetchone()
-            conn.execute("INSERT INTO vendas (cli_id, cli_nome, data, timestamp, prod, qtd, valor_unit, total, pago_pix, pago_dinheiro, pendente) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
-                         (f['cliente_id'], cli['nome'], datetime.now().strftime("%d/%m/%Y"), datetime.now(), f['produto'], f['qtd'], f['valor_unit'], total, f['pago_pix'], f['pago_dinheiro'], pend))
-            conn.execute("UPDATE estoque SET qtd = qtd - ? WHERE produto = ?", (f['qtd'], f['produto']))
-            conn.commit()
-            return redirect(url_for('vendas_log'))
-        clis = conn.execute("SELECT * FROM clientes ORDER BY nome").fetchall()
-        prods = conn.execute("SELECT * FROM estoque WHERE qtd > 0").fetchall()
-    
-    page_content = render_template_string("""
-    <div class="max-w-xl mx-auto card bg-base-100 shadow-2xl p-8 border-t-8 border-primary">
+        r = rotas.planejar(conn, dia, pendentes)
+    # A página só lê clientes_geo; quem falta vai para a thread de fundo e aparece numa próxima visita.
+    na_fila = rotas.agendar(r['a_geocodificar']) if r['a_geocodificar'] else 0
+    return render_template('rotas.html', r=r, pendentes=pendentes, na_fila=na_fila)
+
+# --- VENDA ---
+class EstoqueInsuficiente(Exception):
+    def __init__(self, faltando):
+        super().__init__("Estoque insuficiente: " + ", ".join(f"{p} (tem {q})" for p, q in faltando))
+        self.faltando = faltando
+
+def registrar_venda(conn, cli_id, itens, pago_pix=0.0, pago_dinheiro=0.0, agora=None):
+    """Grava um carrinho (lista de (produto, qtd, valor_unit)) numa única transação.
+
+    O estoque só é baixado se houver saldo para todas as linhas; se faltar qualquer
+    produto nada é gravado e EstoqueInsuficiente lista o que faltou.
+    """
+    agora = agora or datetime.now()
+    if pago_pix < 0 or pago_dinheiro < 0:
+        raise ValueError("Pagamento não pode ser negativo")
+    por_produto = {}
+    for prod, qtd, _ in itens:
+        por_produto[prod] = por_produto.get(prod, 0) + qtd
+
+    with transacao(conn):
+        cli = conn.execute("SELECT nome FROM clientes WHERE id=?", (cli_id,)).fetchone()
+        if cli is None:
+            raise LookupError(f"Cliente {cli_id} não encontrado")
+        baixa = conn.executemany("UPDATE estoque SET qtd = qtd - ? WHERE produto = ? AND qtd >= ?",
+                                 [(q, p, q) for p, q in por_produto.items()])
+        if baixa.rowcount < len(por_produto):
+            marcas = ",".join("?" * len(por_produto))
+            saldo = dict(conn.execute(f"SELECT produto, qtd FROM estoque WHERE produto IN ({marcas})", list(por_produto)).fetchall())
+            raise EstoqueInsuficiente([(p, saldo.get(p, 0)) for p, q in por_produto.items() if saldo.get(p, 0) < q])
+
+        ultima = conn.execute("SELECT COALESCE(MAX(id), 0) FROM vendas").fetchone()[0]
+        # O pagamento cobre as linhas na ordem: primeiro o PIX, depois o dinheiro.
+        # Troco (pagamento acima do total) fica como pendente negativo na última linha, como antes.
+        pix, din, linhas = pago_pix, pago_dinheiro, []
+        for n, (prod, qtd, valor_unit) in enumerate(itens, start=1):
+            total = qtd * valor_unit
+            p = pix if n == len(itens) else min(pix, total)
+            pix -= p
+            d = din if n == len(itens) else min(din, total - p)
+            din -= d
+            linhas.append((cli_id, cli['nome'], agora.strftime("%d/%m/%Y"), agora.strftime("%Y-%m-%d"), agora,
+                           prod, qtd, valor_unit, total, p, d, total - p - d))
+        conn.executemany("INSERT INTO vendas (cli_id, cli_nome, data, dia, timestamp, prod, qtd, valor_unit, total, pago_pix, pago_dinheiro, pendente) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", linhas)
+        reposicao.movimentar_vendas(conn, ultima)
+    return len(linhas)
+
+def itens_do_form(f):
+    itens = []
+    for prod, qtd, valor in zip(f.getlist('produto'), f.getlist('qtd'), f.getlist('valor_unit')):
+        if not prod or not qtd: continue
+        qtd, valor = int(qtd), float(valor)
+        if qtd <= 0: raise ValueError("Quantidade deve ser positiva")
+        itens.append((prod, qtd, valor))
+    if not itens: raise ValueError("Carrinho vazio")
+    return itens
+
+TEMPLATES['vender.html'] = """
+{% extends "base.html" %}{% from "macros.html" import busca_cliente %}{% block content %}
+    <div class="max-w-2xl mx-auto card bg-base-100 shadow-2xl p-8 border-t-8 border-primary">
         <h2 class="text-3xl font-black mb-6 italic">Nova Venda</h2>
         <form method="POST" class="space-y-4">
-            <select name="cliente_id" class="select select-bordered w-full">
-                {% for c in clis %}<option value="{{ c['id'] }}">{{ c['nome'] }}</option>{% endfor %}
-            </select>
-            <div class="flex gap-2">
-                <select name="produto" class="select select-bordered flex-1">
-                    {% for p in prods %}<option value="{{ p['produto'] }}">{{ p['produto'] }}</option>{% endfor %}
-                </select>
-                <input name="qtd" type="number" value="1" class="input input-bordered w-24" />
+            {{ busca_cliente() }}
+            <div id="itens" class="space-y-2">
+                <div class="item flex gap-2">
+                    <select name="produto" class="select select-bordered flex-1" onchange="sugerirPreco(this)">
+                        {% for p in prods %}<option value="{{ p['produto'] }}" data-preco="{{ p['preco_sugerido'] or '' }}">{{ p['produto'] }} ({{ p['qtd'] }})</option>{% endfor %}
+                    </select>
+                    <input name="qtd" type="number" min="1" value="1" class="input input-bordered w-20" oninput="somar()" />
+                    <input name="valor_unit" step="0.01" type="number" placeholder="Preço" class="input input-bordered w-28" oninput="somar()" required />
+                    <button type="button" class="btn btn-ghost btn-square text-error" onclick="removerItem(this)"><i data-lucide="x"></i></button>
+                </div>
+            </div>
+            <div class="flex justify-between items-center">
+                <button type="button" class="btn btn-outline btn-sm" onclick="adicionarItem()"><i data-lucide="plus"></i> Item</button>
+                <span class="text-xl font-black">Total: R$ <span id="total_carrinho">0.00</span></span>
             </div>
-            <input name="valor_unit" step="0.01" type="number" placeholder="Preço Unitário" class="input input-bordered w-full" required />
             <div class="grid grid-cols-2 gap-2">
                 <input name="pago_pix" placeholder="Valor PIX" step="0.01" type="number" class="input input-bordered border-success" />
                 <input name="pago_dinheiro" placeholder="Valor Dinheiro" step="0.01" type="number" class="input input-bordered border-success" />
@@ -376,20 +1096,54 @@ def vender():
             <button class="btn btn-primary w-full">FINALIZAR</button>
         </form>
     </div>
-    """, clis=clis, prods=prods)
-    return render_template_string(BASE_HTML, content=page_content)
+    <script>
+        function somar() {
+            let t = 0;
+            document.querySelectorAll('#itens .item').forEach(l => {
+                t += (parseFloat(l.querySelector('[name=qtd]').value) || 0) * (parseFloat(l.querySelector('[name=valor_unit]').value) || 0);
+            });
+            document.getElementById('total_carrinho').innerText = t.toFixed(2);
+        }
+        function sugerirPreco(sel) {
+            let preco = sel.selectedOptions[0].dataset.preco, campo = sel.parentElement.querySelector('[name=valor_unit]');
+            if (preco && !campo.value) { campo.value = preco; somar(); }
+        }
+        function adicionarItem() {
+            let nova = document.querySelector('#itens .item').cloneNode(true);
+            nova.querySelector('[name=qtd]').value = 1;
+            nova.querySelector('[name=valor_unit]').value = '';
+            document.getElementById('itens').appendChild(nova);
+            sugerirPreco(nova.querySelector('select'));
+        }
+        function removerItem(btn) {
+            if (document.querySelectorAll('#itens .item').length > 1) { btn.closest('.item').remove(); somar(); }
+        }
+        sugerirPreco(document.querySelector('#itens select'));
+    </script>
+    {% endblock %}
+"""
 
-# --- ESTOQUE ---
-@app.route('/estoque', methods=['GET', 'POST'])
-def estoque():
+@app.route('/vender', methods=['GET', 'POST'])
+@condicional('estoque')
+def vender():
     if not session.get('user'): return redirect(url_for('login'))
+    if request.method == 'POST':
+        f = request.form
+        try:
+            escrita.executar(registrar_venda, f['cliente_id'], itens_do_form(f),
+                             float(f.get('pago_pix') or 0), float(f.get('pago_dinheiro') or 0))
+        except (EstoqueInsuficiente, LookupError, ValueError) as e:
+            flash(str(e), "error")
+            return redirect(url_for('vender'))
+        reposicao.agendar()
+        return redirect(url_for('vendas_log'))
     with get_db() as conn:
-        if request.method == 'POST':
-            conn.execute("UPDATE estoque SET qtd = qtd + ? WHERE produto = ?", (request.form['qtd'], request.form['produto']))
-            conn.commit()
-            flash("Estoque atualizado!", "success")
-        dados = conn.execute("SELECT * FROM estoque").fetchall()
-    page_content = render_template_string("""
+        prods = conn.execute("SELECT * FROM estoque WHERE qtd > 0").fetchall()
+    return render_template('vender.html', prods=prods)
+
+# --- ESTOQUE ---
+TEMPLATES['estoque.html'] = """
+{% extends "base.html" %}{% block content %}
     <h1 class="text-3xl font-black mb-8 italic text-secondary">Estoque</h1>
     <div class="grid grid-cols-1 md:grid-cols-2 gap-8">
         <div class="card bg-base-100 p-8 shadow-xl border-t-4 border-secondary">
@@ -403,75 +1157,362 @@ def estoque():
         </div>
         <div class="space-y-4">
             {% for d in dados %}
-            <div class="card bg-base-100 p-4 shadow-xl flex flex-row justify-between items-center">
-                <span class="font-bold">{{ d['produto'] }}</span>
-                <span class="badge badge-lg {{ 'badge-error' if d['qtd'] < 15 else 'badge-primary' }}">{{ d['qtd'] }} bjs</span>
+            <div class="card bg-base-100 p-4 shadow-xl flex flex-row justify-between items-center {{ 'border-l-4 border-error' if d.alerta }}">
+                <div>
+                    <span class="font-bold">{{ d.produto }}</span>
+                    <div class="text-xs opacity-60">
+                        {% if d.taxa > 0 %}{{ "%.1f"|format(d.taxa) }} bjs/dia · acaba em {{ "%.0f"|format(d.dias_restantes) if d.dias_restantes > 0 else 0 }} dia(s) · repor abaixo de {{ "%.0f"|format(d.ponto_pedido) }}
+                        {% else %}sem vendas recentes{% endif %}
+                    </div>
+                    {% if d.alerta and d.sugestao %}<div class="text-xs text-error font-bold">Pedir {{ d.sugestao }} bjs (cobre {{ "%.0f"|format(prazo + cobertura) }} dias)</div>{% endif %}
+                </div>
+                <span class="badge badge-lg {{ 'badge-error' if d.alerta else 'badge-primary' }}">{{ d.saldo }} bjs</span>
             </div>
             {% endfor %}
         </div>
     </div>
-    """, dados=dados)
-    return render_template_string(BASE_HTML, content=page_content)
+    {% endblock %}
+"""
 
-# --- FINANCEIRO ---
-@app.route('/financeiro')
-def financeiro():
+def entrada_estoque(conn, produto, qtd):
+    with transacao(conn):
+        n = conn.execute("UPDATE estoque SET qtd = qtd + ? WHERE produto = ?", (qtd, produto)).rowcount
+        if n:
+            reposicao.movimentar(conn, produto, qtd, 'entrada')
+        return n
+
+@app.route('/estoque', methods=['GET', 'POST'])
+@condicional('estoque', 'estoque_previsao')
+def estoque():
     if not session.get('user'): return redirect(url_for('login'))
+    if request.method == 'POST':
+        try:
+            qtd = int(request.form.get('qtd') or '')
+            if qtd <= 0: raise ValueError
+        except ValueError:
+            flash("Quantidade deve ser um número inteiro positivo.", "error")
+            return redirect(url_for('estoque'))
+        if not escrita.executar(entrada_estoque, request.form.get('produto', ''), qtd):
+            flash("Produto não encontrado.", "error")
+            return redirect(url_for('estoque'))
+        reposicao.agendar()
+        flash("Estoque atualizado!", "success")
     with get_db() as conn:
-        pendentes = conn.execute("SELECT * FROM vendas WHERE pendente > 0 ORDER BY id DESC").fetchall()
-    page_content = render_template_string("""
-    <h1 class="text-3xl font-black mb-8 italic text-error">Pendências</h1>
-    <div class="grid grid-cols-1 gap-4">
-        {% for v in pendentes %}
-        <div class="card bg-base-100 p-6 shadow-xl flex flex-row justify-between items-center border border-error/20">
-            <div>
-                <h3 class="text-xl font-bold text-primary">{{ v['cli_nome'] }}</h3>
-                <p class="text-xs opacity-50">Venda #{{ v['id'] }} - {{ v['data'] }}</p>
-            </div>
-            <div class="flex items-center gap-6">
-                <div class="text-right text-error font-black">R$ {{ "%.2f"|format(v['pendente']) }}</div>
-                <button class="btn btn-success" onclick="abrirBaixa('{{ v['id'] }}', '{{ v['pendente'] }}', '{{ v['cli_nome'] }}')">Receber</button>
-            </div>
-        </div>
+        dados = reposicao.situacao(conn)
+    return render_template('estoque.html', dados=dados, prazo=reposicao.PRAZO_REPOSICAO, cobertura=reposicao.COBERTURA)
+
+# --- FINANCEIRO ---
+# Contas a receber por cliente. Tudo lê só as vendas em aberto pelo índice parcial
+# idx_vendas_pendentes, então o custo acompanha o número de devedores e não o histórico.
+FORMAS_PAGAMENTO = {'pix': 'pago_pix', 'dinheiro': 'pago_dinheiro'}
+FAIXAS_ATRASO = (7, 30)  # 0–7, 8–30 e 31+ dias
+DEVEDORES_POR_PAGINA = 100
+
+def contas_a_receber(conn, hoje=None, limite=None, offset=0):
+    """Devedores do maior saldo para o menor, com as faixas de atraso.
+
+    Cada linha traz também os totais gerais (soma_*) e o número de devedores,
+    calculados por janela antes do LIMIT: a paginação não custa uma segunda consulta.
+    """
+    hoje = hoje or datetime.now()
+    d7, d30 = ((hoje - timedelta(days=d)).strftime("%Y-%m-%d") for d in FAIXAS_ATRASO)
+    return conn.execute('''SELECT a.*, COALESCE(c.nome, '#' || a.cli_id) AS nome, COUNT(*) OVER () AS devedores,
+                                  SUM(a.total) OVER () AS soma_total, SUM(a.ate_7) OVER () AS soma_ate_7,
+                                  SUM(a.ate_30) OVER () AS soma_ate_30, SUM(a.acima_30) OVER () AS soma_acima_30
+                           FROM (SELECT cli_id, COUNT(*) AS vendas, TOTAL(pendente) AS total,
+                                        TOTAL(CASE WHEN dia >= :d7 THEN pendente END) AS ate_7,
+                                        TOTAL(CASE WHEN dia < :d7 AND dia >= :d30 THEN pendente END) AS ate_30,
+                                        TOTAL(CASE WHEN dia < :d30 THEN pendente END) AS acima_30,
+                                        MIN(dia) AS mais_antiga
+                                 FROM vendas WHERE pendente > 0 GROUP BY cli_id) a
+                           LEFT JOIN clientes c ON c.id = a.cli_id
+                           ORDER BY a.total DESC, a.cli_id LIMIT :limite OFFSET :offset''',
+                        {'d7': d7, 'd30': d30, 'limite': -1 if limite is None else limite, 'offset': offset}).fetchall()
+
+def _abater(conn, abertas, valor, forma):
+    # Aplica `valor` às vendas na ordem dada; chamado já dentro da transação.
+    coluna = FORMAS_PAGAMENTO[forma]
+    resto, baixas = round(valor, 2), []
+    for v in abertas:
+        if resto <= 0: break
+        parte = min(resto, v['pendente'])
+        baixas.append((parte, round(v['pendente'] - parte, 2), v['id']))
+        resto = round(resto - parte, 2)
+    conn.executemany(f"UPDATE vendas SET {coluna} = {coluna} + ?, pendente = ? WHERE id = ?", baixas)
+    return len(baixas), round(valor - resto, 2), resto
+
+def _validar_pagamento(valor, forma):
+    if forma not in FORMAS_PAGAMENTO: raise ValueError(f"Forma de pagamento inválida: {forma}")
+    if not valor > 0: raise ValueError("Valor deve ser positivo")
+
+def dar_baixa(conn, venda_id, valor, forma):
+    """Abate um pagamento de uma venda. Devolve (vendas abatidas, valor aplicado, sobra)."""
+    _validar_pagamento(valor, forma)
+    with transacao(conn):
+        abertas = conn.execute("SELECT id, pendente FROM vendas WHERE id = ? AND pendente > 0", (venda_id,)).fetchall()
+        return _abater(conn, abertas, valor, forma)
+
+def receber_fifo(conn, cli_id, valor, forma):
+    """Distribui um pagamento pelas vendas em aberto do cliente, da mais antiga para a mais nova.
+
+    Tudo numa transação: ou o valor inteiro é distribuído, ou nada muda. O que passar
+    da dívida volta como sobra (troco), sem virar crédito.
+    """
+    _validar_pagamento(valor, forma)
+    with transacao(conn):
+        abertas = conn.execute("SELECT id, pendente FROM vendas WHERE cli_id = ? AND pendente > 0 ORDER BY dia, id", (cli_id,)).fetchall()
+        return _abater(conn, abertas, valor, forma)
+
+def avisar_baixa(abatidas, aplicado, sobra):
+    if not abatidas:
+        flash("Nada em aberto para receber.", "warning")
+        return
+    flash(f"R$ {aplicado:.2f} recebido em {abatidas} venda(s)." + (f" Sobra de R$ {sobra:.2f} (troco)." if sobra > 0 else ""), "success")
+
+TEMPLATES['financeiro.html'] = """
+{% extends "base.html" %}{% block content %}
+    <div class="flex justify-between items-center mb-8">
+        <h1 class="text-3xl font-black italic text-error">Contas a Receber</h1>
+        <span class="badge badge-lg">{{ n_devedores }} devedor(es)</span>
+    </div>
+    <div class="grid grid-cols-2 md:grid-cols-4 gap-6 mb-8">
+        {% for titulo, valor, cor in [('Total em aberto', soma.total, 'text-error'), ('0–7 dias', soma.ate_7, 'text-success'), ('8–30 dias', soma.ate_30, 'text-warning'), ('31+ dias', soma.acima_30, 'text-error')] %}
+        <div class="stats glass-card shadow"><div class="stat"><div class="stat-title text-xs font-bold uppercase">{{ titulo }}</div><div class="stat-value {{ cor }} text-2xl">R$ {{ "%.2f"|format(valor) }}</div></div></div>
         {% endfor %}
     </div>
+    <div class="card bg-base-100 overflow-x-auto shadow-xl">
+        <table class="table table-zebra">
+            <thead><tr><th>Cliente</th><th>Vendas</th><th>0–7</th><th>8–30</th><th>31+</th><th>Total</th><th>Desde</th><th></th></tr></thead>
+            <tbody>
+                {% for d in devedores %}
+                <tr>
+                    <td class="font-bold text-primary">{% if d['cli_id'] %}<a href="{{ url_for('vendas_log', cliente=d['cli_id'], status='pendente') }}" class="link link-hover">{{ d['nome'] }}</a>{% else %}{{ d['nome'] }}{% endif %}</td>
+                    <td>{{ d['vendas'] }}</td>
+                    <td>{{ "%.2f"|format(d['ate_7']) }}</td>
+                    <td class="text-warning">{{ "%.2f"|format(d['ate_30']) }}</td>
+                    <td class="text-error">{{ "%.2f"|format(d['acima_30']) }}</td>
+                    <td class="font-black text-error">R$ {{ "%.2f"|format(d['total']) }}</td>
+                    <td class="text-xs">{{ d['mais_antiga']|dia_br }}</td>
+                    <td>{% if d['cli_id'] %}<button class="btn btn-success btn-sm" onclick="abrirBaixa('{{ d['cli_id'] }}', '{{ '%.2f'|format(d['total']) }}', {{ d['nome']|tojson|forceescape }})">Receber</button>{% endif %}</td>
+                </tr>
+                {% else %}
+                <tr><td colspan="8" class="text-center opacity-50">Nenhuma pendência.</td></tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    {% if paginas > 1 %}
+    <div class="flex justify-between mt-6">
+        {% if pagina > 1 %}<a href="{{ url_for('financeiro', pagina=pagina - 1) }}" class="btn btn-sm"><i data-lucide="chevron-left"></i> Maiores saldos</a>{% else %}<span></span>{% endif %}
+        <span class="text-sm opacity-50">Página {{ pagina }} de {{ paginas }}</span>
+        {% if pagina < paginas %}<a href="{{ url_for('financeiro', pagina=pagina + 1) }}" class="btn btn-sm">Menores saldos <i data-lucide="chevron-right"></i></a>{% endif %}
+    </div>
+    {% endif %}
     <dialog id="modal_baixa" class="modal"><div class="modal-box">
-        <h3 class="font-bold text-lg mb-4">Receber de <span id="b_nome" class="text-primary"></span></h3>
-        <form action="/vendas/dar_baixa" method="POST" class="space-y-4">
-            <input type="hidden" name="venda_id" id="b_id">
-            <input type="number" step="0.01" name="valor_pago" id="b_valor" class="input input-bordered w-full" required>
+        <h3 class="font-bold text-lg mb-1">Receber de <span id="b_nome" class="text-primary"></span></h3>
+        <p class="text-xs opacity-50 mb-4">O valor quita as vendas mais antigas primeiro.</p>
+        <form action="{{ url_for('financeiro_receber') }}" method="POST" class="space-y-4">
+            <input type="hidden" name="cliente_id" id="b_id">
+            <input type="number" step="0.01" min="0.01" name="valor_pago" id="b_valor" class="input input-bordered w-full" required>
             <select name="forma" class="select select-bordered w-full"><option value="pix">PIX</option><option value="dinheiro">Dinheiro</option></select>
             <button class="btn btn-success w-full">Confirmar</button>
         </form>
     </div></dialog>
     <script>function abrirBaixa(id, val, nome){ document.getElementById('b_id').value=id; document.getElementById('b_nome').innerText=nome; document.getElementById('b_valor').value=val; modal_baixa.showModal(); }</script>
-    """, pendentes=pendentes)
-    return render_template_string(BASE_HTML, content=page_content)
+    {% endblock %}
+"""
+
+@app.route('/financeiro')
+@condicional('vendas', 'clientes')
+def financeiro():
+    if not session.get('user'): return redirect(url_for('login'))
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    with get_db() as conn:
+        devedores = contas_a_receber(conn, limite=DEVEDORES_POR_PAGINA, offset=(pagina - 1) * DEVEDORES_POR_PAGINA)
+    primeira = devedores[0] if devedores else None
+    soma = {k: primeira[f'soma_{k}'] if primeira else 0.0 for k in ('total', 'ate_7', 'ate_30', 'acima_30')}
+    paginas = -(-primeira['devedores'] // DEVEDORES_POR_PAGINA) if primeira else 1
+    return render_template('financeiro.html', devedores=devedores, soma=soma, pagina=pagina, paginas=paginas,
+                           n_devedores=primeira['devedores'] if primeira else 0)
+
+@app.route('/financeiro/receber', methods=['POST'])
+def financeiro_receber():
+    if not session.get('user'): return redirect(url_for('login'))
+    f = request.form
+    try:
+        avisar_baixa(*escrita.executar(receber_fifo, int(f['cliente_id']), float(f['valor_pago']), f['forma']))
+    except ValueError as e:
+        flash(str(e), "error")
+    return redirect(url_for('financeiro'))
 
 @app.route('/vendas/dar_baixa', methods=['POST'])
 def dar_baixa_venda():
-    v_id, valor, forma = request.form['venda_id'], float(request.form['valor_pago']), request.form['forma']
-    with get_db() as conn:
-        v = conn.execute("SELECT * FROM vendas WHERE id=?", (v_id,)).fetchone()
-        novo_p = max(0, v['pendente'] - valor)
-        if forma == 'pix': conn.execute("UPDATE vendas SET pago_pix = pago_pix + ?, pendente = ? WHERE id = ?", (valor, novo_p, v_id))
-        else: conn.execute("UPDATE vendas SET pago_dinheiro = pago_dinheiro + ?, pendente = ? WHERE id = ?", (valor, novo_p, v_id))
-        conn.commit()
-    flash("Baixa efetuada!", "success")
+    if not session.get('user'): return redirect(url_for('login'))
+    f = request.form
+    try:
+        avisar_baixa(*escrita.executar(dar_baixa, int(f['venda_id']), float(f['valor_pago']), f['forma']))
+    except ValueError as e:
+        flash(str(e), "error")
     return redirect(url_for('financeiro'))
 
+# --- SINCRONIZAÇÃO OFFLINE ---
+# O service worker (assets/sw.js) guarda vendas e recebimentos feitos sem sinal e
+# manda tudo num POST só. Cada item traz uma chave gerada no aparelho: reenviar o
+# mesmo lote devolve o resultado guardado em vez de gravar de novo.
+SYNC_MAX_ITENS = int(os.environ.get('EGGPRO_SYNC_MAX', '500'))
+SYNC_VALIDADE = timedelta(days=int(os.environ.get('EGGPRO_SYNC_VALIDADE_D', '90')))
+
+def _quando(valor):
+    if not valor: return None
+    try:
+        d = datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Campo quando inválido: {str(valor)[:30]!r}") from None
+    return d.astimezone().replace(tzinfo=None) if d.tzinfo else d
+
+def _campo(item, campo, tipo=int, padrao=None):
+    # Vazio é ausente (KeyError vira "Campo obrigatório ausente"); lixo vira mensagem com o nome do campo.
+    valor = item.get(campo)
+    if valor is None or valor == '':
+        if padrao is not None: return padrao
+        raise KeyError(campo)
+    try:
+        return tipo(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Campo {campo} inválido: {str(valor)[:30]!r}") from None
+
+def aplicar_item(conn, item):
+    tipo = item.get('tipo')
+    if tipo == 'venda':
+        itens = [(str(_campo(i, 'produto', str)), _campo(i, 'qtd'), _campo(i, 'valor_unit', float)) for i in item.get('itens') or []]
+        if not itens: raise ValueError("Carrinho vazio")
+        if any(qtd <= 0 for _, qtd, _ in itens): raise ValueError("Quantidade deve ser positiva")
+        linhas = registrar_venda(conn, _campo(item, 'cliente_id'), itens, _campo(item, 'pago_pix', float, 0.0),
+                                 _campo(item, 'pago_dinheiro', float, 0.0), _quando(item.get('quando')))
+        return {'linhas': linhas}
+    if tipo == 'pagamento':
+        valor, forma = _campo(item, 'valor', float), item.get('forma') or 'dinheiro'
+        if item.get('venda_id'):
+            r = dar_baixa(conn, _campo(item, 'venda_id'), valor, forma)
+        else:
+            r = receber_fifo(conn, _campo(item, 'cliente_id'), valor, forma)
+        return dict(zip(('abatidas', 'aplicado', 'sobra'), r))
+    raise ValueError(f"Tipo desconhecido: {tipo}")
+
+def aplicar_sincronizacao(conn, usuario, itens):
+    """Aplica o lote numa transação; cada item tem seu SAVEPOINT e seu resultado."""
+    agora = datetime.now()
+    resultados = []
+    with transacao(conn):
+        conn.execute("DELETE FROM sync_chaves WHERE criado_em < ?", ((agora - SYNC_VALIDADE).isoformat(timespec='seconds'),))
+        for item in itens:
+            chave = str(item.get('chave') or '')[:100]
+            if not chave:
+                resultados.append({'chave': None, 'status': 'erro', 'erro': "Item sem chave"})
+                continue
+            antigo = conn.execute("SELECT resultado FROM sync_chaves WHERE chave = ?", (chave,)).fetchone()
+            if antigo:
+                resultados.append({'chave': chave, 'status': 'duplicado', 'resultado': json.loads(antigo['resultado'])})
+                continue
+            try:
+                with transacao(conn):
+                    r = aplicar_item(conn, item)
+                    conn.execute("INSERT INTO sync_chaves (chave, usuario, tipo, resultado, criado_em) VALUES (?,?,?,?,?)",
+                                 (chave, usuario, item.get('tipo'), json.dumps(r), agora.isoformat(timespec='seconds')))
+            except KeyError as e:
+                resultados.append({'chave': chave, 'status': 'erro', 'erro': f"Campo obrigatório ausente: {e.args[0]}"})
+            except (EstoqueInsuficiente, LookupError, ValueError, TypeError) as e:
+                resultados.append({'chave': chave, 'status': 'erro', 'erro': str(e)})
+            else:
+                resultados.append({'chave': chave, 'status': 'ok', 'resultado': r})
+    return resultados
+
+@app.route('/api/sync', methods=['POST'])
+def api_sync():
+    if not session.get('user'): return jsonify(erro="Sessão expirada"), 401
+    dados = request.get_json(silent=True)
+    itens = dados.get('itens') if isinstance(dados, dict) else None
+    if not isinstance(itens, list) or not all(isinstance(i, dict) for i in itens):
+        return jsonify(erro="Esperado {\"itens\": [...]}"), 400
+    if len(itens) > SYNC_MAX_ITENS:
+        return jsonify(erro=f"No máximo {SYNC_MAX_ITENS} itens por lote"), 413
+    resultados = escrita.executar(aplicar_sincronizacao, session['user'], itens)
+    reposicao.agendar()
+    contagem = {s: sum(1 for r in resultados if r['status'] == s) for s in ('ok', 'duplicado', 'erro')}
+    return jsonify(resultados=resultados, **contagem)
+
+TEMPLATES['fila.html'] = """
+{% extends "base.html" %}{% from "macros.html" import busca_cliente %}{% block content %}
+    <h1 class="text-3xl font-black italic mb-4">Registros sem conexão</h1>
+    <p class="opacity-60 mb-6">Guardados neste aparelho. Os recusados pelo servidor não são reenviados até serem corrigidos ou descartados.</p>
+    <div class="card bg-base-100 overflow-x-auto shadow-xl">
+        <table class="table"><thead><tr><th>Quando</th><th>Registro</th><th>Situação</th><th></th></tr></thead><tbody id="fila"></tbody></table>
+    </div>
+    <template id="trocar-cliente">
+        <form class="flex gap-2 mt-2">{{ busca_cliente(obrigatorio=True, classe='input-bordered input-sm w-56') }}<button class="btn btn-sm btn-primary">Trocar cliente e reenviar</button></form>
+    </template>
+    <script>
+        function pedir(msg) {
+            return navigator.serviceWorker.ready.then(r => new Promise(ok => {
+                const canal = new MessageChannel();
+                canal.port1.onmessage = ev => ok(ev.data);
+                r.active.postMessage(msg, [canal.port2]);
+            }));
+        }
+        function descrever(i) {
+            if (i.tipo === 'venda') return 'Venda: ' + i.itens.map(x => `${x.qtd}x ${x.produto}`).join(', ') + (i.cliente_id ? ` (cliente ${i.cliente_id})` : ' (sem cliente)');
+            return `Pagamento R$ ${i.valor} ` + (i.venda_id ? `da venda ${i.venda_id}` : `do cliente ${i.cliente_id || '?'}`);
+        }
+        function botao(texto, classe, acao) {
+            const b = document.createElement('button');
+            b.className = 'btn btn-xs ' + classe; b.textContent = texto; b.onclick = acao;
+            return b;
+        }
+        async function mostrar() {
+            const corpo = document.getElementById('fila'), itens = await pedir({ acao: 'listar' });
+            corpo.innerHTML = itens.length ? '' : '<tr><td colspan="4" class="text-center opacity-50">Nada pendente neste aparelho.</td></tr>';
+            itens.forEach(i => {
+                const tr = corpo.insertRow();
+                tr.insertCell().textContent = i.quando.replace('T', ' ');
+                const registro = tr.insertCell();
+                registro.textContent = descrever(i);
+                tr.insertCell().innerHTML = i.erro ? '<span class="text-error"></span>' : '<span class="opacity-60">aguardando envio</span>';
+                if (i.erro) tr.cells[2].firstChild.textContent = i.erro;
+                const acoes = tr.insertCell();
+                acoes.className = 'flex gap-1';
+                if (i.erro) acoes.appendChild(botao('Reenviar', 'btn-ghost', () => pedir({ acao: 'reenviar', chave: i.chave }).then(mostrar)));
+                acoes.appendChild(botao('Descartar', 'btn-error btn-outline', () => confirm('Descartar este registro?') && pedir({ acao: 'descartar', chave: i.chave }).then(mostrar)));
+                if (i.erro && !i.venda_id) {
+                    const form = document.getElementById('trocar-cliente').content.firstElementChild.cloneNode(true);
+                    form.onsubmit = ev => {
+                        ev.preventDefault();
+                        const id = form.querySelector('input[type=hidden]').value;
+                        if (id) pedir({ acao: 'corrigir', chave: i.chave, cliente_id: id }).then(mostrar);
+                    };
+                    registro.appendChild(form);
+                }
+            });
+        }
+        if ('serviceWorker' in navigator) mostrar();
+    </script>
+    {% endblock %}
+"""
+
+@app.route('/fila')
+def fila_offline():
+    if not session.get('user'): return redirect(url_for('login'))
+    return render_template('fila.html')
+
+@app.route('/sw.js')
+def service_worker():
+    # Servido da raiz (e não de /assets) para o service worker cobrir o site inteiro.
+    resp = send_from_directory(os.path.join(app.root_path, 'assets'), 'sw.js', mimetype='text/javascript')
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
 # --- USUÁRIOS E LOGIN ---
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        u, p = request.form['username'], request.form['password']
-        with get_db() as conn:
-            user = conn.execute("SELECT * FROM usuarios WHERE username = ?", (u,)).fetchone()
-            if user and check_password_hash(user['password'], p):
-                session['user'] = u
-                return redirect(url_for('dashboard'))
-        flash("Erro no login!", "error")
-    return render_template_string(BASE_HTML, content="""
+TEMPLATES['login.html'] = """
+{% extends "base.html" %}{% block content %}
     <div class="flex items-center justify-center min-h-screen">
         <div class="card w-96 bg-base-100 shadow-2xl border-t-8 border-primary p-8 text-center">
             <h2 class="text-3xl font-black italic mb-6">EGGPRO v10</h2>
@@ -482,18 +1523,23 @@ def login():
             </form>
         </div>
     </div>
-    """)
+    {% endblock %}
+"""
 
-@app.route('/usuarios', methods=['GET', 'POST'])
-def usuarios():
-    if not session.get('user'): return redirect(url_for('login'))
-    with get_db() as conn:
-        if request.method == 'POST':
-            u, p = request.form['username'], generate_password_hash(request.form['password'])
-            conn.execute("INSERT OR IGNORE INTO usuarios (username, password) VALUES (?,?)", (u, p))
-            conn.commit()
-        users = conn.execute("SELECT id, username FROM usuarios").fetchall()
-    page_content = render_template_string("""
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        u, p = request.form['username'], request.form['password']
+        with get_db() as conn:
+            user = conn.execute("SELECT * FROM usuarios WHERE username = ?", (u,)).fetchone()
+            if user and check_password_hash(user['password'], p):
+                session['user'] = u
+                return redirect(url_for('dashboard'))
+        flash("Erro no login!", "error")
+    return render_template('login.html')
+
+TEMPLATES['usuarios.html'] = """
+{% extends "base.html" %}{% block content %}
     <h1 class="text-3xl font-black italic mb-8">Operadores</h1>
     <div class="grid grid-cols-1 md:grid-cols-3 gap-6">
         {% for u in users %}
@@ -505,8 +1551,33 @@ def usuarios():
         <div class="card bg-base-100 p-6 shadow-xl"><button class="btn btn-primary" onclick="m_u.showModal()">+ Novo</button></div>
     </div>
     <dialog id="m_u" class="modal"><div class="modal-box"><form method="POST" class="space-y-4"><input name="username" placeholder="Usuário" class="input input-bordered w-full" required /><input name="password" type="password" placeholder="Senha" class="input input-bordered w-full" required /><button class="btn btn-primary w-full">Criar</button></form></div></dialog>
-    """, users=users)
-    return render_template_string(BASE_HTML, content=page_content)
+    {% endblock %}
+"""
+
+@app.route('/usuarios', methods=['GET', 'POST'])
+@condicional('usuarios')
+def usuarios():
+    if not session.get('user'): return redirect(url_for('login'))
+    with get_db() as conn:
+        if request.method == 'POST':
+            u, p = request.form['username'], generate_password_hash(request.form['password'])
+            conn.execute("INSERT OR IGNORE INTO usuarios (username, password) VALUES (?,?)", (u, p))
+            conn.commit()
+        users = conn.execute("SELECT id, username FROM usuarios").fetchall()
+    return render_template('usuarios.html', users=users)
+
+@app.route('/sistema/db')
+def sistema_db():
+    if not session.get('user'): return redirect(url_for('login'))
+    return jsonify({**pool_stats(), 'escrita': escrita.stats(), 'snapshot': snapshot.info()})
+
+@app.route('/sistema/snapshot', methods=['POST'])
+def sistema_snapshot():
+    if not session.get('user'): return redirect(url_for('login'))
+    if snapshot.ATIVO:
+        snapshot.agendar()
+        flash("A cópia de leitura está sendo refeita; recarregue em instantes.", "info")
+    return redirect(request.referrer or url_for('relatorios_jobs'))
 
 @app.route('/logout')
 def logout():
@@ -520,15 +1591,33 @@ def usuarios_excluir(id):
         conn.commit()
     return redirect(url_for('usuarios'))
 
+def estornar_venda(conn, venda_id):
+    """Apaga a venda e devolve a quantidade ao estoque; False se ela não existe mais."""
+    with transacao(conn):
+        v = conn.execute("SELECT qtd, prod FROM vendas WHERE id=?", (venda_id,)).fetchone()
+        if v is None:
+            return False
+        conn.execute("UPDATE estoque SET qtd = qtd + ? WHERE produto = ?", (v['qtd'], v['prod']))
+        reposicao.movimentar(conn, v['prod'], v['qtd'], 'estorno', venda_id)
+        conn.execute("DELETE FROM vendas WHERE id=?", (venda_id,))
+        return True
+
 @app.route('/vendas/excluir/<int:id>')
 def vendas_excluir(id):
-    with get_db() as conn:
-        v = conn.execute("SELECT * FROM vendas WHERE id=?", (id,)).fetchone()
-        conn.execute("UPDATE estoque SET qtd = qtd + ? WHERE produto = ?", (v['qtd'], v['prod']))
-        conn.execute("DELETE FROM vendas WHERE id=?", (id,))
-        conn.commit()
-    flash("Estornado!", "warning")
+    if not session.get('user'): return redirect(url_for('login'))
+    if escrita.executar(estornar_venda, id):
+        reposicao.agendar()
+        flash("Estornado!", "warning")
+    else:
+        with get_db() as conn, arquivo.historico(conn) as tabela:
+            arquivada = tabela != 'vendas' and conn.execute(f"SELECT 1 FROM {tabela} WHERE id = ?", (id,)).fetchone()
+        flash("Venda arquivada não pode ser estornada." if arquivada else "Venda não encontrada.", "error")
     return redirect(url_for('vendas_log'))
 
+if os.environ.get('EGGPRO_PRECOMPILAR'):
+    precompilar_templates()
+
 if __name__ == '__main__':
+    # Servidor de desenvolvimento; em produção use serve.py.
+    init_db()
     app.run(debug=True, port=5000)
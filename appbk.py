@@ -31,8 +31,12 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # --- BANCO DE DADOS ---
+DB_PATH = 'ovos_midnight.db'
+
+# O schema é conferido uma vez por processo (st.cache_resource), não a cada rerun.
+@st.cache_resource
 def init_db():
-    conn = sqlite3.connect('ovos_midnight.db', check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS clientes (id INTEGER PRIMARY KEY, nome TEXT, tel TEXT, endereco TEXT)''')
     c.execute('''CREATE TABLE IF NOT EXISTS estoque (produto TEXT PRIMARY KEY, qtd INTEGER)''')
@@ -40,19 +44,98 @@ def init_db():
     prods = ["Branco Extra", "Vermelho Extra", "Branco Grande", "Vermelho Grande", "Branco Médio", "Vermelho Médio", "Branco Jumbo", "Vermelho Jumbo"]
     for p in prods:
         c.execute("INSERT OR IGNORE INTO estoque (produto, qtd) VALUES (?, 0)", (p,))
+    # Contador de alterações: toda gravação soma 1, e os carregadores em cache usam o valor como chave.
+    c.execute('''CREATE TABLE IF NOT EXISTS versao (id INTEGER PRIMARY KEY CHECK (id = 1), n INTEGER NOT NULL)''')
+    c.execute("INSERT OR IGNORE INTO versao (id, n) VALUES (1, 0)")
+    # Índices da grade do Financeiro (filtro por cliente/débito, ordem por data)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_vendas_cli ON vendas (cli_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data, id)")
     conn.commit()
-    return conn
+    conn.close()
+    return True
+
+def conexao():
+    # Uma conexão por sessão do navegador: a transação de uma sessão nunca vai junto no
+    # commit de outra. check_same_thread=False porque cada rerun pode vir numa thread nova.
+    if 'conn' not in st.session_state:
+        st.session_state.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    return st.session_state.conn
+
+init_db()
+conn = conexao()
+
+def versao():
+    return conn.execute("SELECT n FROM versao").fetchone()[0]
+
+def marcar_alteracao():
+    # Chamado antes do commit, na mesma transação da gravação.
+    conn.execute("UPDATE versao SET n = n + 1")
+
+# --- CARREGADORES EM CACHE ---
+# Streamlit roda o script inteiro a cada clique; com o cache as consultas só voltam a
+# rodar quando a versão muda. max_entries descarta as versões antigas.
+@st.cache_data(max_entries=4, show_spinner=False)
+def metricas_home(n_versao):
+    receita, pendente, vendas = conn.execute("SELECT TOTAL(total), TOTAL(pendente), COUNT(*) FROM vendas").fetchone()
+    clientes = conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0]
+    return {'receita': receita, 'pendente': pendente, 'vendas': vendas, 'clientes': clientes}
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def carregar_clientes(n_versao):
+    return pd.read_sql_query("SELECT id, nome, tel, endereco FROM clientes", conn)
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def carregar_estoque(n_versao):
+    return pd.read_sql_query("SELECT produto, qtd FROM estoque", conn)
+
+# --- FINANCEIRO: GRADE PAGINADA ---
+# Filtro, ordem e página vão para o SQL; o navegador só recebe POR_PAGINA linhas.
+POR_PAGINA = 50
+ORDENACAO = {
+    "Mais recentes": "v.id DESC",
+    "Mais antigas": "v.id ASC",
+    "Data (recente)": "v.data DESC, v.id DESC",
+    "Maior débito": "v.pendente DESC, v.id DESC",
+    "Maior total": "v.total DESC, v.id DESC",
+    "Cliente (A-Z)": "c.nome COLLATE NOCASE, v.id DESC",
+}
 
-conn = init_db()
+def _filtro_financeiro(busca, produto, so_pendentes):
+    where, params = [], []
+    if busca:
+        where.append("c.nome LIKE ?")
+        params.append(f"%{busca}%")
+    if produto:
+        where.append("v.prod = ?")
+        params.append(produto)
+    if so_pendentes:
+        where.append("v.pendente > 0")
+    return (" WHERE " + " AND ".join(where)) if where else "", params
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def contar_financeiro(n_versao, busca, produto, so_pendentes):
+    where, params = _filtro_financeiro(busca, produto, so_pendentes)
+    return conn.execute(f"SELECT COUNT(*), TOTAL(v.pendente) FROM vendas v JOIN clientes c ON v.cli_id = c.id{where}", params).fetchone()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def pagina_financeiro(n_versao, busca, produto, so_pendentes, ordem, pagina):
+    where, params = _filtro_financeiro(busca, produto, so_pendentes)
+    return pd.read_sql_query(f'''
+        SELECT v.id, v.data, c.nome as cliente, v.prod, v.qtd, v.valor, v.total, v.pago, v.pendente 
+        FROM vendas v JOIN clientes c ON v.cli_id = c.id{where}
+        ORDER BY {ORDENACAO[ordem]} LIMIT ? OFFSET ?
+    ''', conn, params=params + [POR_PAGINA, (pagina - 1) * POR_PAGINA])
 
 # --- FUNÇÕES DE MANIPULAÇÃO ---
-def excluir_venda(venda_id, produto, qtd_retorno):
-    # Deleta a venda
-    conn.execute("DELETE FROM vendas WHERE id = ?", (venda_id,))
-    # Devolve a quantidade ao estoque
-    conn.execute("UPDATE estoque SET qtd = qtd + ? WHERE produto = ?", (qtd_retorno, produto))
+def excluir_vendas(vendas):
+    # Deleta as vendas e devolve as quantidades ao estoque, tudo num commit só
+    for v in vendas:
+        conn.execute("DELETE FROM vendas WHERE id = ?", (int(v['id']),))
+        conn.execute("UPDATE estoque SET qtd = qtd + ? WHERE produto = ?", (int(v['qtd']), v['prod']))
+    marcar_alteracao()
     conn.commit()
-    st.toast(f"Venda #{venda_id} removida e estoque devolvido!", icon="🗑️")
+    ids = ", ".join(f"#{v['id']}" for v in vendas)
+    st.toast(f"Venda(s) {ids} removida(s) e estoque devolvido!", icon="🗑️")
     st.rerun()
 
 @st.dialog("Editar Venda")
@@ -66,6 +149,7 @@ def editar_venda_modal(venda):
         novo_pendente = novo_total - novo_pago
         conn.execute("""UPDATE vendas SET valor=?, total=?, pago=?, pendente=? WHERE id=?""", 
                      (novo_valor, novo_total, novo_pago, novo_pendente, venda['id']))
+        marcar_alteracao()
         conn.commit()
         st.success("Venda atualizada!")
         st.rerun()
@@ -80,20 +164,18 @@ with st.sidebar:
 # --- HOME ---
 if menu == "Home":
     st.markdown("<h2 style='color:#FBBF24;'>📊 Visão de Comando</h2>", unsafe_allow_html=True)
-    df_v = pd.read_sql_query("SELECT * FROM vendas", conn)
-    total_receita = df_v['total'].sum() if not df_v.empty else 0
-    total_pendente = df_v['pendente'].sum() if not df_v.empty else 0
+    m = metricas_home(versao())
     
     c1, c2, c3, c4 = st.columns(4)
-    c1.metric("Faturamento Total", f"R$ {total_receita:,.2f}")
-    c2.metric("Contas a Receber", f"R$ {total_pendente:,.2f}")
-    c3.metric("Vendas Realizadas", len(df_v))
-    c4.metric("Clientes", pd.read_sql_query("SELECT COUNT(*) FROM clientes", conn).iloc[0,0])
+    c1.metric("Faturamento Total", f"R$ {m['receita']:,.2f}")
+    c2.metric("Contas a Receber", f"R$ {m['pendente']:,.2f}")
+    c3.metric("Vendas Realizadas", m['vendas'])
+    c4.metric("Clientes", m['clientes'])
 
 # --- VENDAS (PDV) ---
 elif menu == "Vendas":
     st.markdown("<h2 style='color:#FBBF24;'>🛒 Frente de Caixa</h2>", unsafe_allow_html=True)
-    df_cli = pd.read_sql_query("SELECT * FROM clientes", conn)
+    df_cli = carregar_clientes(versao())
     if df_cli.empty:
         st.warning("Cadastre um cliente primeiro.")
     else:
@@ -116,6 +198,7 @@ elif menu == "Vendas":
                     conn.execute("INSERT INTO vendas (cli_id, data, prod, valor, qtd, total, pago, pendente) VALUES (?,?,?,?,?,?,?,?)",
                                 (int(cli_id), str(date.today()), prod_name, v_unit, qtd, total, pago, total-pago))
                     conn.execute("UPDATE estoque SET qtd = qtd - ? WHERE produto = ?", (qtd, prod_name))
+                    marcar_alteracao()
                     conn.commit()
                     st.balloons()
                     st.rerun()
@@ -127,61 +210,59 @@ elif menu == "Estoque":
     col1, col2 = st.columns([1, 2])
     with col1:
         with st.form("add_est"):
-            p_sel = st.selectbox("Produto", pd.read_sql_query("SELECT produto FROM estoque", conn)['produto'].tolist())
+            p_sel = st.selectbox("Produto", carregar_estoque(versao())['produto'].tolist())
             q_add = st.number_input("Quantidade", min_value=1)
             if st.form_submit_button("Adicionar"):
                 conn.execute("UPDATE estoque SET qtd = qtd + ? WHERE produto = ?", (q_add, p_sel))
+                marcar_alteracao()
                 conn.commit()
                 st.rerun()
     with col2:
-        df_e = pd.read_sql_query("SELECT produto as 'Produto', qtd as 'Saldo' FROM estoque", conn)
+        df_e = carregar_estoque(versao()).rename(columns={'produto': 'Produto', 'qtd': 'Saldo'})
         st.dataframe(df_e, use_container_width=True, hide_index=True)
 
 # --- FINANCEIRO (COM EDITAR E REMOVER) ---
 elif menu == "Financeiro":
     st.markdown("<h2 style='color:#FBBF24;'>💰 Fluxo e Histórico</h2>", unsafe_allow_html=True)
     
-    # Query para pegar os dados
-    df_f = pd.read_sql_query('''
-        SELECT v.id, v.data, c.nome as cliente, v.prod, v.qtd, v.valor, v.total, v.pago, v.pendente 
-        FROM vendas v JOIN clientes c ON v.cli_id = c.id ORDER BY v.id DESC
-    ''', conn)
+    n_versao = versao()
+    f1, f2, f3, f4 = st.columns([2, 2, 2, 1])
+    busca = f1.text_input("Cliente", placeholder="Buscar por nome").strip()
+    produto = f2.selectbox("Produto", ["Todos"] + carregar_estoque(n_versao)['produto'].tolist())
+    produto = None if produto == "Todos" else produto
+    ordem = f3.selectbox("Ordenar por", list(ORDENACAO))
+    so_pendentes = f4.checkbox("Só com débito")
 
-    if df_f.empty:
-        st.info("Nenhuma venda registrada.")
+    n_linhas, debito = contar_financeiro(n_versao, busca, produto, so_pendentes)
+    if n_linhas == 0:
+        st.info("Nenhuma venda encontrada.")
     else:
-        st.markdown("<div class='card-dark'>", unsafe_allow_html=True)
-        # Cabeçalho da tabela customizada
-        h1, h2, h3, h4, h5, h6, h7 = st.columns([1, 2, 2, 1, 1, 1, 1])
-        h1.write("**Data**")
-        h2.write("**Cliente**")
-        h3.write("**Produto**")
-        h4.write("**Total**")
-        h5.write("**Débito**")
-        h6.write("**Edit**")
-        h7.write("**Sair**")
-        st.divider()
-
-        for index, row in df_f.iterrows():
-            c1, c2, c3, c4, c5, c6, c7 = st.columns([1, 2, 2, 1, 1, 1, 1])
-            c1.write(row['data'])
-            c2.write(row['cliente'])
-            c3.write(f"{row['qtd']}x {row['prod']}")
-            c4.write(f"R${row['total']:.2f}")
-            
-            # Cor para o débito (vermelho se houver pendência)
-            cor_debito = "#F87171" if row['pendente'] > 0 else "#34D399"
-            c5.markdown(f"<span style='color:{cor_debito};'>R${row['pendente']:.2f}</span>", unsafe_allow_html=True)
-            
-            # Botão Editar
-            if c6.button("✏️", key=f"edit_{row['id']}"):
-                editar_venda_modal(row)
-            
-            # Botão Excluir
-            if c7.button("🗑️", key=f"del_{row['id']}"):
-                excluir_venda(row['id'], row['prod'], row['qtd'])
-        
-        st.markdown("</div>", unsafe_allow_html=True)
+        paginas = (n_linhas + POR_PAGINA - 1) // POR_PAGINA
+        p1, p2 = st.columns([1, 3])
+        pagina = p1.number_input("Página", min_value=1, max_value=paginas, value=1, step=1)
+        p2.markdown(f"<br>{n_linhas} venda(s) · débito R$ {debito:,.2f} · página {pagina} de {paginas}", unsafe_allow_html=True)
+
+        df_f = pagina_financeiro(n_versao, busca, produto, so_pendentes, ordem, int(pagina))
+        grade = st.dataframe(
+            df_f, use_container_width=True, hide_index=True,
+            # A seleção é por posição: a chave muda com filtro/página/versão para não marcar outra venda.
+            on_select="rerun", selection_mode="multi-row", key=f"grade_{hash((n_versao, busca, produto, so_pendentes, ordem, pagina))}",
+            column_config={
+                "id": st.column_config.NumberColumn("#", format="%d"),
+                "data": "Data", "cliente": "Cliente", "prod": "Produto", "qtd": "Qtd",
+                "valor": st.column_config.NumberColumn("Unit.", format="R$ %.2f"),
+                "total": st.column_config.NumberColumn("Total", format="R$ %.2f"),
+                "pago": st.column_config.NumberColumn("Pago", format="R$ %.2f"),
+                "pendente": st.column_config.NumberColumn("Débito", format="R$ %.2f"),
+            })
+        selecionadas = df_f.iloc[grade.selection.rows]
+
+        # Ações sobre as linhas marcadas na grade
+        a1, a2, _ = st.columns([1, 1, 3])
+        if a1.button("✏️ Editar", disabled=len(selecionadas) != 1):
+            editar_venda_modal(selecionadas.iloc[0])
+        if a2.button(f"🗑️ Excluir ({len(selecionadas)})", disabled=selecionadas.empty):
+            excluir_vendas(selecionadas.to_dict('records'))
 
 # --- CLIENTES ---
 elif menu == "Clientes":
@@ -192,6 +273,7 @@ elif menu == "Clientes":
         e = st.text_input("Endereço")
         if st.form_submit_button("Salvar"):
             conn.execute("INSERT INTO clientes (nome, tel, endereco) VALUES (?,?,?)", (n,t,e))
+            marcar_alteracao()
             conn.commit()
             st.rerun()
-    st.dataframe(pd.read_sql_query("SELECT nome, tel, endereco FROM clientes", conn), use_container_width=True)
+    st.dataframe(carregar_clientes(versao())[['nome', 'tel', 'endereco']], use_container_width=True)
@@ -0,0 +1,141 @@
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import db
+
+# --- ARQUIVO (DADOS FRIOS) ---
+# Vendas quitadas e antigas saem da base principal para um arquivo SQLite por ano
+# (arquivo/vendas_AAAA.db). A tabela vendas_arquivo, na base principal, diz quais anos
+# existem e que intervalo de dias/ids cada um cobre; só as consultas cujo período
+# alcança esse intervalo anexam os arquivos (ATTACH) e leem a união quente + fria.
+MESES_QUENTES = int(os.environ.get('EGGPRO_ARQUIVO_MESES', '12'))
+
+
+def pasta():
+    return os.environ.get('EGGPRO_ARQUIVO_DIR') or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), 'arquivo')
+
+
+def caminho(ano):
+    return os.path.join(pasta(), f"vendas_{ano}.db")
+
+
+def _colunas(conn, esquema='main'):
+    return [(r['name'], r['type']) for r in conn.execute(f"PRAGMA {esquema}.table_info(vendas)")]
+
+
+def anos(conn, inicio=None, fim=None):
+    """Anos arquivados que têm vendas entre inicio e fim (dias 'YYYY-mm-dd', ambos opcionais)."""
+    return conn.execute('''SELECT * FROM vendas_arquivo
+                           WHERE (? IS NULL OR ultimo_dia >= ?) AND (? IS NULL OR primeiro_dia <= ?)
+                           ORDER BY ano''', (inicio, inicio, fim, fim)).fetchall()
+
+
+@contextmanager
+def historico(conn, inicio=None, fim=None):
+    """Devolve o que usar no FROM para ler vendas entre inicio e fim.
+
+    Sem arquivo no período é só 'vendas'. Caso contrário os anos necessários são
+    anexados e o resultado é uma subconsulta UNION ALL com o alias vendas, então as
+    consultas não mudam e os filtros descem para cada parte (e seus índices). Não é
+    uma view temporária porque as conexões só-leitura dos relatórios não podem criá-la.
+
+    Linhas que estão no arquivo e ainda em main.vendas contam só uma vez, pela parte
+    quente: acontece com um snapshot feito antes de arquivar mais meses no mesmo ano
+    (a cópia anexa o arquivo vivo) e com um arquivar interrompido.
+    """
+    necessarios = [a for a in anos(conn, inicio, fim) if os.path.exists(caminho(a['ano']))]
+    if not necessarios:
+        yield 'vendas'
+        return
+    colunas = [nome for nome, _ in _colunas(conn)]
+    anexados, partes = [], ["SELECT " + ", ".join(colunas) + " FROM main.vendas"]
+    try:
+        for a in necessarios:
+            esquema = f"arq_{a['ano']}"
+            conn.execute(f"ATTACH DATABASE ? AS {esquema}", (caminho(a['ano']),))
+            anexados.append(esquema)
+            existentes = {nome for nome, _ in _colunas(conn, esquema)}
+            # Arquivos antigos podem não ter colunas criadas depois: entram como NULL.
+            partes.append("SELECT " + ", ".join(c if c in existentes else f"NULL AS {c}" for c in colunas) + f" FROM {esquema}.vendas"
+                          # Só os ids quentes até o maior do arquivo entram na lista: em geral poucos (pendentes antigos).
+                          f" WHERE id NOT IN (SELECT id FROM main.vendas WHERE id <= (SELECT MAX(id) FROM {esquema}.vendas))")
+        yield "(" + " UNION ALL ".join(partes) + ") AS vendas"
+    finally:
+        for esquema in anexados:
+            conn.execute(f"DETACH DATABASE {esquema}")
+
+
+def max_id(conn, inicio=None, fim=None):
+    """Maior id arquivado no período (None sem arquivo): abaixo dele a paginação precisa da união."""
+    ids = [a['max_id'] for a in anos(conn, inicio, fim)]
+    return max(ids) if ids else None
+
+
+def corte_padrao(hoje=None):
+    hoje = hoje or datetime.now()
+    return (hoje - timedelta(days=30 * MESES_QUENTES)).strftime("%Y-%m-%d")
+
+
+def _preparar(conn, esquema, colunas):
+    definicao = ", ".join("id INTEGER PRIMARY KEY" if nome == 'id' else f"{nome} {tipo}".strip() for nome, tipo in colunas)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {esquema}.vendas ({definicao})")
+    existentes = {nome for nome, _ in _colunas(conn, esquema)}
+    for nome, tipo in colunas:
+        if nome not in existentes:
+            conn.execute(f"ALTER TABLE {esquema}.vendas ADD COLUMN {nome} {tipo}")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {esquema}.idx_vendas_dia ON vendas(dia)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {esquema}.idx_vendas_cli_dia ON vendas(cli_id, dia)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {esquema}.idx_vendas_prod ON vendas(prod)")
+
+
+def arquivar(conn, corte=None, ao_mover=None):
+    """Move vendas quitadas (pendente <= 0) com dia < corte para os arquivos anuais.
+
+    Um mês por transação. Com WAL a transação não é atômica entre os dois arquivos:
+    se o processo cair entre um commit e outro, a linha fica nos dois lugares até a
+    próxima execução, que copia com INSERT OR IGNORE e termina de apagar.
+    O resumo diário (vendas_diarias) continua cobrindo o histórico inteiro.
+    Devolve o total de vendas movidas.
+    """
+    corte = corte or corte_padrao()
+    colunas = _colunas(conn)
+    nomes = ", ".join(nome for nome, _ in colunas)
+    meses = [r[0] for r in conn.execute('''SELECT DISTINCT substr(dia, 1, 7) FROM vendas
+                                            WHERE dia < ? AND pendente <= 0 ORDER BY 1''', (corte,))]
+    os.makedirs(pasta(), exist_ok=True)
+    total = 0
+    for mes in meses:
+        ano = mes[:4]
+        conn.execute("ATTACH DATABASE ? AS destino", (caminho(ano),))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                _preparar(conn, 'destino', colunas)
+                filtro = "dia >= ? AND dia < ? AND dia < ? AND pendente <= 0"
+                params = (mes + '-01', mes + '-32', corte)
+                conn.execute(f"INSERT OR IGNORE INTO destino.vendas ({nomes}) SELECT {nomes} FROM main.vendas WHERE {filtro}", params)
+                resumo = conn.execute(f'''SELECT dia, COALESCE(prod, ''), COUNT(*), TOTAL(qtd), TOTAL(total),
+                                                 TOTAL(pago_pix) + TOTAL(pago_dinheiro), TOTAL(pendente)
+                                          FROM main.vendas WHERE {filtro} GROUP BY dia, COALESCE(prod, '')''', params).fetchall()
+                n = conn.execute(f"DELETE FROM main.vendas WHERE {filtro}", params).rowcount
+                # O DELETE passou pelos gatilhos do resumo; as vendas continuam existindo (no arquivo), então voltam ao resumo.
+                conn.executemany('''INSERT INTO vendas_diarias (dia, prod, vendas, qtd, vendido, recebido, pendente) VALUES (?,?,?,?,?,?,?)
+                                    ON CONFLICT(dia, prod) DO UPDATE SET vendas = vendas + excluded.vendas, qtd = qtd + excluded.qtd,
+                                        vendido = vendido + excluded.vendido, recebido = recebido + excluded.recebido,
+                                        pendente = pendente + excluded.pendente''', [tuple(r) for r in resumo])
+                faixa = conn.execute("SELECT COUNT(*), MIN(dia), MAX(dia), MAX(id) FROM destino.vendas").fetchone()
+                conn.execute('''INSERT INTO vendas_arquivo (ano, vendas, primeiro_dia, ultimo_dia, max_id, atualizado_em) VALUES (?,?,?,?,?,?)
+                                ON CONFLICT(ano) DO UPDATE SET vendas = excluded.vendas, primeiro_dia = excluded.primeiro_dia,
+                                    ultimo_dia = excluded.ultimo_dia, max_id = excluded.max_id, atualizado_em = excluded.atualizado_em''',
+                             (ano, *faixa, datetime.now().isoformat(timespec='seconds')))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            conn.execute("DETACH DATABASE destino")
+        total += n
+        if ao_mover:
+            ao_mover(mes, n)
+    return total
@@ -0,0 +1,66 @@
+// Gera static/dist: um CSS minificado (Tailwind + DaisyUI) e um JS com ApexCharts e
+// só os ícones Lucide usados nos templates, com hash no nome e variantes .gz/.br.
+//
+//     npm ci && npm run build
+import { build } from 'esbuild';
+import { execFileSync } from 'node:child_process';
+import { createHash } from 'node:crypto';
+import { mkdirSync, readFileSync, readdirSync, rmSync, writeFileSync } from 'node:fs';
+import path from 'node:path';
+import { fileURLToPath } from 'node:url';
+import { brotliCompressSync, constants, gzipSync } from 'node:zlib';
+
+const raiz = path.resolve(path.dirname(fileURLToPath(import.meta.url)), '..');
+const destino = path.join(raiz, 'static', 'dist');
+
+const fontes = readdirSync(raiz).filter(f => f.endsWith('.py')).map(f => readFileSync(path.join(raiz, f), 'utf8')).join('\n');
+const icones = [...new Set([...fontes.matchAll(/data-lucide="([a-z0-9-]+)"/g)].map(m => m[1]))].sort();
+const pascal = nome => nome.split('-').map(p => p[0].toUpperCase() + p.slice(1)).join('');
+
+async function gerarJs() {
+  const nomes = icones.map(pascal);
+  const entrada = `
+    import ApexCharts from 'apexcharts';
+    import { createIcons, ${nomes.join(', ')} } from 'lucide';
+    const icons = { ${nomes.join(', ')} };
+    window.ApexCharts = ApexCharts;
+    window.lucide = { createIcons: (opts = {}) => createIcons({ icons, ...opts }) };
+  `;
+  const saida = await build({
+    stdin: { contents: entrada, resolveDir: raiz, loader: 'js' },
+    bundle: true, minify: true, format: 'iife', target: 'es2018', legalComments: 'none', write: false,
+  });
+  return saida.outputFiles[0].contents;
+}
+
+function gerarCss() {
+  const tmp = path.join(destino, '.app.css');
+  execFileSync(path.join(raiz, 'node_modules', '.bin', 'tailwindcss'),
+    ['-c', path.join(raiz, 'tailwind.config.js'), '-i', path.join(raiz, 'assets', 'app.css'), '-o', tmp, '--minify'],
+    { stdio: 'inherit', cwd: raiz });
+  const css = readFileSync(tmp);
+  rmSync(tmp);
+  return css;
+}
+
+function gravar(nomeLogico, conteudo) {
+  const hash = createHash('sha256').update(conteudo).digest('hex').slice(0, 10);
+  const ext = path.extname(nomeLogico);
+  const nome = `${path.basename(nomeLogico, ext)}.${hash}${ext}`;
+  writeFileSync(path.join(destino, nome), conteudo);
+  writeFileSync(path.join(destino, nome + '.gz'), gzipSync(conteudo, { level: 9 }));
+  writeFileSync(path.join(destino, nome + '.br'), brotliCompressSync(conteudo, {
+    params: { [constants.BROTLI_PARAM_QUALITY]: 11, [constants.BROTLI_PARAM_SIZE_HINT]: conteudo.length },
+  }));
+  console.log(`${nomeLogico} -> ${nome} (${conteudo.length} bytes)`);
+  return nome;
+}
+
+rmSync(destino, { recursive: true, force: true });
+mkdirSync(destino, { recursive: true });
+const manifesto = {
+  'app.css': gravar('app.css', gerarCss()),
+  'app.js': gravar('app.js', await gerarJs()),
+};
+writeFileSync(path.join(destino, 'manifest.json'), JSON.stringify(manifesto, null, 2) + '\n');
+console.log(`${icones.length} ícones: ${icones.join(' ')}`);
@@ -0,0 +1,213 @@
+// Service worker do EggPro: quando um POST de venda ou recebimento falha por falta de
+// sinal, o formulário vira um item na fila (IndexedDB) com uma chave gerada aqui. A fila
+// vai inteira para /api/sync quando a conexão volta; o servidor ignora chaves repetidas,
+// então reenviar depois de uma resposta perdida é seguro.
+// O cache guarda só a casca do app (SHELL), os assets, as respostas de /cep/ e a lista
+// compacta de clientes (CLIENTES, para a busca funcionar sem sinal), pelo caminho sem
+// query string; sair do sistema ou perder a sessão apaga tudo. Sem cliente escolhido
+// o formulário não entra na fila; itens recusados pelo servidor ficam marcados com o
+// erro e podem ser corrigidos ou descartados em /fila.
+const CACHE = 'eggpro-v3';
+const FILA = 'eggpro-sync';
+const LOTE = 200;
+const SHELL = ['/', '/vender', '/financeiro', '/fila'];
+const CLIENTES = '/clientes/offline';
+
+const formularios = {
+  '/vender': f => ({
+    tipo: 'venda', cliente_id: f.get('cliente_id'), pago_pix: f.get('pago_pix'), pago_dinheiro: f.get('pago_dinheiro'),
+    itens: f.getAll('produto').map((produto, i) => ({ produto, qtd: f.getAll('qtd')[i], valor_unit: f.getAll('valor_unit')[i] }))
+      .filter(i => i.produto && i.qtd),
+  }),
+  '/financeiro/receber': f => ({ tipo: 'pagamento', cliente_id: f.get('cliente_id'), valor: f.get('valor_pago'), forma: f.get('forma') }),
+  '/vendas/dar_baixa': f => ({ tipo: 'pagamento', venda_id: f.get('venda_id'), valor: f.get('valor_pago'), forma: f.get('forma') }),
+};
+
+// --- FILA (IndexedDB) ---
+function abrir() {
+  return new Promise((ok, falha) => {
+    const req = indexedDB.open(FILA, 1);
+    req.onupgradeneeded = () => req.result.createObjectStore('fila', { keyPath: 'chave' });
+    req.onsuccess = () => ok(req.result);
+    req.onerror = () => falha(req.error);
+  });
+}
+
+async function operar(modo, fn) {
+  const db = await abrir();
+  return new Promise((ok, falha) => {
+    const tx = db.transaction('fila', modo);
+    const req = fn(tx.objectStore('fila'));
+    tx.oncomplete = () => ok(req && req.result);
+    tx.onerror = () => falha(tx.error);
+  });
+}
+
+const guardar = itens => operar('readwrite', s => { itens.forEach(i => s.put(i)); });
+const remover = chaves => operar('readwrite', s => { chaves.forEach(c => s.delete(c)); });
+const listar = () => operar('readonly', s => s.getAll());
+
+async function avisar() {
+  const itens = await listar();
+  const estado = { fila: itens.length, erros: itens.filter(i => i.erro).length };
+  (await self.clients.matchAll()).forEach(c => c.postMessage(estado));
+}
+
+// Horário local do aparelho, no mesmo formato que o servidor grava.
+function agoraLocal() {
+  const d = new Date();
+  return new Date(d - d.getTimezoneOffset() * 60000).toISOString().slice(0, 19);
+}
+
+// --- ENVIO ---
+let enviando = null;
+
+function sincronizar() {
+  enviando = enviando || enviar().finally(() => { enviando = null; });
+  return enviando;
+}
+
+async function enviar() {
+  const itens = (await listar()).filter(i => !i.erro);  // recusados esperam correção em /fila
+  for (let i = 0; i < itens.length; i += LOTE) {
+    const lote = itens.slice(i, i + LOTE).map(({ erro, ...item }) => item);
+    const resp = await fetch('/api/sync', {
+      method: 'POST', credentials: 'same-origin',
+      headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ itens: lote }),
+    });
+    if (resp.status === 401) await limparCache();
+    if (!resp.ok) break;  // sem sessão ou servidor fora: tenta de novo na próxima volta da conexão
+    const { resultados } = await resp.json();
+    // ok e duplicado saem da fila; erro fica guardado com a mensagem até ser corrigido ou descartado
+    await remover(resultados.filter(r => r.status !== 'erro').map(r => r.chave));
+    const erros = Object.fromEntries(resultados.filter(r => r.status === 'erro' && r.chave).map(r => [r.chave, r.erro]));
+    await guardar(lote.filter(item => item.chave in erros).map(item => ({ ...item, erro: erros[item.chave] })));
+  }
+  await avisar();
+}
+
+// O que o servidor recusaria de cara não entra na fila (ficaria lá para sempre).
+function incompleto(item) {
+  if (item.tipo === 'venda') {
+    if (!item.cliente_id) return 'Escolha o cliente na lista de sugestões.';
+    if (!item.itens.length) return 'O carrinho está vazio.';
+  } else {
+    if (!item.cliente_id && !item.venda_id) return 'Escolha o cliente na lista de sugestões.';
+    if (!item.valor) return 'Informe o valor.';
+  }
+  return null;
+}
+
+function pagina(titulo, texto) {
+  return new Response(
+    '<!DOCTYPE html><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">' +
+    '<body style="font-family:sans-serif;padding:2em;background:#1d232a;color:#fff">' +
+    `<h2>${titulo}</h2><p>${texto}</p>` +
+    '<p><a href="javascript:history.back()" style="color:#a78bfa">Voltar</a></p></body>',
+    { headers: { 'Content-Type': 'text/html; charset=utf-8' } });
+}
+
+async function postarOuGuardar(req, montar) {
+  const copia = req.clone();
+  try {
+    return await fetch(req);
+  } catch (e) {
+    const item = { ...montar(await copia.formData()), chave: crypto.randomUUID(), quando: agoraLocal() };
+    const falta = incompleto(item);
+    if (falta) return pagina('Sem conexão', 'O registro <b>não</b> foi guardado. ' + falta);
+    await guardar([item]);
+    await avisar();
+    if (self.registration.sync) self.registration.sync.register(FILA).catch(() => {});
+    return pagina('Sem conexão', 'Registro guardado no aparelho. Ele será enviado quando a conexão voltar.');
+  }
+}
+
+// --- EDIÇÃO DA FILA (página /fila) ---
+async function corrigir(chave, mudancas) {
+  const item = (await listar()).find(i => i.chave === chave);
+  if (!item) return;
+  const { erro, ...resto } = { ...item, ...mudancas };
+  await guardar([resto]);
+}
+
+const acoes = {
+  listar: () => listar(),
+  descartar: ({ chave }) => remover([chave]),
+  reenviar: async ({ chave }) => { await corrigir(chave, {}); await sincronizar(); },
+  corrigir: async ({ chave, cliente_id }) => { await corrigir(chave, { cliente_id }); await sincronizar(); },
+};
+
+// --- CACHE ---
+const limparCache = () => caches.keys().then(nomes => Promise.all(nomes.filter(n => n.startsWith('eggpro-')).map(n => caches.delete(n))));
+
+// Páginas da casca sem sessão voltam como redirect para /login; /cep/ sem sessão, 401.
+const semSessao = resp => resp.type === 'opaqueredirect' || resp.redirected || resp.status === 401;
+
+// Casca, CEPs e assets: rede primeiro, cópia guardada se não houver sinal.
+async function redeOuCache(req, chave) {
+  try {
+    const resp = await fetch(req);
+    if (semSessao(resp)) await limparCache();
+    else if (resp.ok) await (await caches.open(CACHE)).put(chave, resp.clone());
+    return resp;
+  } catch (e) {
+    return (await caches.match(chave)) || new Response('Sem conexão', { status: 503 });
+  }
+}
+
+// Busca de clientes sem sinal: filtra a lista guardada, como /clientes/buscar faria.
+const semAcento = t => String(t || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+
+async function atualizarClientes() {
+  try {
+    const resp = await fetch(CLIENTES, { credentials: 'same-origin' });
+    if (semSessao(resp)) await limparCache();
+    else if (resp.ok) await (await caches.open(CACHE)).put(CLIENTES, resp);
+  } catch (e) { /* sem sinal: fica a lista anterior */ }
+}
+
+async function buscarClientes(req, url) {
+  try {
+    return await fetch(req);
+  } catch (e) {
+    const guardada = await caches.match(CLIENTES);
+    const termos = semAcento(url.searchParams.get('q')).split(/\s+/).filter(Boolean);
+    const achados = (guardada ? await guardada.json() : [])
+      .filter(([, ...campos]) => { const texto = semAcento(campos.join(' ')); return termos.every(t => texto.includes(t)); })
+      .slice(0, 20).map(([id, nome, tel, bairro]) => ({ id, nome, tel, bairro }));
+    return new Response(JSON.stringify(achados), { headers: { 'Content-Type': 'application/json' } });
+  }
+}
+
+async function sair(req) {
+  await limparCache();
+  return fetch(req);
+}
+
+// --- EVENTOS ---
+self.addEventListener('install', () => self.skipWaiting());
+self.addEventListener('activate', ev => ev.waitUntil(
+  caches.keys().then(nomes => Promise.all(nomes.filter(n => n.startsWith('eggpro-') && n !== CACHE).map(n => caches.delete(n)))).then(() => self.clients.claim())));
+self.addEventListener('sync', ev => { if (ev.tag === FILA) ev.waitUntil(sincronizar()); });
+self.addEventListener('message', ev => {
+  if (ev.data === 'sincronizar') {
+    ev.waitUntil(Promise.all([sincronizar(), atualizarClientes()]));
+  } else if (ev.data && acoes[ev.data.acao]) {
+    // Pedidos da página /fila: a resposta volta pela porta do MessageChannel.
+    ev.waitUntil(acoes[ev.data.acao](ev.data).then(async r => { await avisar(); ev.ports[0].postMessage(r || null); }));
+  }
+});
+
+self.addEventListener('fetch', ev => {
+  const req = ev.request, url = new URL(req.url);
+  if (url.origin !== self.location.origin) return;
+  if (req.method === 'POST' && formularios[url.pathname]) {
+    ev.respondWith(postarOuGuardar(req, formularios[url.pathname]));
+  } else if (req.method === 'GET' && url.pathname === '/clientes/buscar') {
+    ev.respondWith(buscarClientes(req, url));
+  } else if (req.method === 'GET' && url.pathname === '/logout') {
+    ev.respondWith(sair(req));
+  } else if (req.method === 'GET' && ((req.mode === 'navigate' && SHELL.includes(url.pathname)) || url.pathname.startsWith('/cep/') || url.pathname.startsWith('/assets/'))) {
+    ev.respondWith(redeOuCache(req, url.pathname));
+  }
+});
@@ -0,0 +1,249 @@
+"""Benchmark reprodutível das rotas do EggPro.
+
+Cria um banco temporário com dados sintéticos, dispara cada rota pelo test client
+do Flask e imprime latências (p50/p95/p99), vazão e pico de memória em JSON.
+
+    python benchmark.py --clientes 5000 --vendas 1000000 --anos 3 --saida bench.json
+
+Mesma --seed gera o mesmo banco e a mesma sequência de requisições, então dois
+resultados podem ser comparados entre commits. CEP e geocodificação usam as fontes
+'stub' (sem rede), e os clientes já entram geocodificados.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+NOMES = ["Ana", "João", "Maria", "José", "Antônio", "Francisca", "Carlos", "Paulo", "Lúcia", "Pedro",
+         "Luiz", "Marcos", "Raimunda", "Sebastião", "Conceição", "Rita", "Jorge", "Márcia", "Tereza", "Fábio"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira", "Lima",
+              "Gomes", "Costa", "Ribeiro", "Martins", "Carvalho", "Araújo", "Melo", "Barbosa", "Cardoso"]
+BAIRROS = ["Centro", "Vila Nova", "Jardim América", "São José", "Santa Luzia", "Boa Vista", "Industrial",
+           "Zona Rural", "Parque das Flores", "Cohab"]
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def pico_rss_mb():
+    # ru_maxrss vem em KB no Linux e em bytes no macOS.
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def semear(path, clientes, vendas, anos, pendentes, seed):
+    import reposicao
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    produtos = conn.execute("SELECT produto, preco_sugerido FROM estoque").fetchall()
+    conn.executemany("INSERT INTO clientes (nome, tel, cep, rua, bairro, cidade, estado, numero) VALUES (?,?,?,?,?,?,?,?)",
+                     ((f"{rnd.choice(NOMES)} {rnd.choice(SOBRENOMES)} {rnd.choice(SOBRENOMES)}",
+                       f"(11) 9{rnd.randrange(10**8):08d}", f"{rnd.randrange(10**8):08d}",
+                       f"Rua {rnd.choice(SOBRENOMES)}", rnd.choice(BAIRROS), "Cidade", "SP", str(rnd.randrange(1, 2000)))
+                      for _ in range(clientes)))
+    nomes = dict(conn.execute("SELECT id, nome FROM clientes").fetchall())
+    ids = list(nomes)
+
+    fim = datetime.now()
+    inicio = fim - timedelta(days=365 * anos)
+    passo = (fim - inicio) / max(vendas, 1)
+
+    def linhas():
+        # Em ordem cronológica, como no uso real: id crescente acompanha o timestamp.
+        for i in range(vendas):
+            ts = inicio + passo * i
+            cli = rnd.choice(ids)
+            prod, preco = rnd.choice(produtos)
+            qtd = rnd.randint(1, 10)
+            total = qtd * preco
+            pago = 0.0 if rnd.random() < pendentes else total
+            pix = round(pago * rnd.random(), 2)
+            yield (cli, nomes[cli], ts.strftime("%d/%m/%Y"), ts.strftime("%Y-%m-%d"), ts.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                   prod, qtd, preco, total, pix, pago - pix, total - pago)
+
+    # O estoque entra pela razão, como no uso real: uma entrada grande no início do período,
+    # uma saída por venda, e estoque.qtd igual à soma dos movimentos.
+    ultimo = conn.execute("SELECT COALESCE(MAX(id), 0) FROM vendas").fetchone()[0]
+    for prod, _ in produtos:
+        reposicao.movimentar(conn, prod, 1000000000, 'entrada', quando=inicio)
+    conn.executemany("INSERT INTO vendas (cli_id, cli_nome, data, dia, timestamp, prod, qtd, valor_unit, total, pago_pix, pago_dinheiro, pendente) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                     linhas())
+    reposicao.movimentar_vendas(conn, ultimo)
+    conn.execute("UPDATE estoque SET qtd = (SELECT TOTAL(m.qtd) FROM estoque_movimentos m WHERE m.produto = estoque.produto)")
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def rotas(rnd, conn):
+    max_id = conn.execute("SELECT MAX(id) FROM vendas").fetchone()[0] or 1
+    pendentes = [r[0] for r in conn.execute("SELECT id FROM vendas WHERE pendente > 0 ORDER BY id DESC LIMIT 5000")]
+    clientes = [r[0] for r in conn.execute("SELECT id FROM clientes")]
+    devedores = [r[0] for r in conn.execute("SELECT DISTINCT cli_id FROM vendas WHERE pendente > 0 LIMIT 5000")]
+    ceps = [r[0] for r in conn.execute("SELECT cep FROM clientes ORDER BY id LIMIT 200")]
+    produtos = [r[0] for r in conn.execute("SELECT produto FROM estoque")]
+    hoje = datetime.now()
+
+    def venda():
+        return {'cliente_id': str(rnd.choice(clientes)), 'produto': rnd.choice(produtos), 'qtd': str(rnd.randint(1, 5)),
+                'valor_unit': '16', 'pago_pix': '10', 'pago_dinheiro': ''}
+
+    def baixa():
+        return {'venda_id': str(rnd.choice(pendentes) if pendentes else 1), 'valor_pago': '1', 'forma': rnd.choice(['pix', 'dinheiro'])}
+
+    def receber():
+        return {'cliente_id': str(rnd.choice(devedores) if devedores else 1), 'valor_pago': '5', 'forma': rnd.choice(['pix', 'dinheiro'])}
+
+    def sync():
+        # Lote como o do service worker: vendas e pagamentos com chave nova cada um.
+        itens = []
+        for _ in range(10):
+            v = venda()
+            itens.append({'tipo': 'venda', 'chave': f"bench-{rnd.getrandbits(64):016x}", 'cliente_id': v['cliente_id'],
+                          'pago_pix': v['pago_pix'], 'itens': [{'produto': v['produto'], 'qtd': v['qtd'], 'valor_unit': v['valor_unit']}]})
+        itens.append({'tipo': 'pagamento', 'chave': f"bench-{rnd.getrandbits(64):016x}", **receber(), 'valor': '1'})
+        return {'itens': itens}
+
+    # nome -> (método, gerador de (url, dados))
+    return {
+        'dashboard': ('GET', lambda: ('/', None)),
+        'vendas_log': ('GET', lambda: ('/vendas_log', None)),
+        'vendas_log_pagina_funda': ('GET', lambda: (f'/vendas_log?antes={rnd.randrange(1, max_id + 1)}', None)),
+        'vendas_log_filtro_cliente': ('GET', lambda: (f'/vendas_log?cliente={rnd.choice(clientes)}&status=pendente', None)),
+        'relatorio_diario': ('GET', lambda: ('/relatorio/diario', None)),
+        'relatorio_semanal': ('GET', lambda: ('/relatorio/semanal', None)),
+        'relatorio_mensal': ('GET', lambda: ('/relatorio/mensal', None)),
+        'relatorio_intervalo_xlsx': ('GET', lambda: ('/relatorio/filtro?formato=xlsx&inicio=' + (hoje - timedelta(days=90)).strftime('%Y-%m-%d'), None)),
+        'financeiro': ('GET', lambda: ('/financeiro', None)),
+        'financeiro_pagina_funda': ('GET', lambda: (f'/financeiro?pagina={rnd.randint(1, max(len(devedores) // 50, 1))}', None)),
+        'analises': ('GET', lambda: (f'/analises?dias={rnd.choice([30, 90, 365])}', None)),
+        'rotas': ('GET', lambda: ('/rotas', None)),
+        'cep': ('GET', lambda: (f'/cep/{rnd.choice(ceps)}', None)),
+        'estoque': ('GET', lambda: ('/estoque', None)),
+        'clientes': ('GET', lambda: ('/clientes', None)),
+        'clientes_buscar': ('GET', lambda: ('/clientes/buscar?q=' + rnd.choice(NOMES)[:3], None)),
+        'vender_post': ('POST', lambda: ('/vender', venda())),
+        'dar_baixa_post': ('POST', lambda: ('/vendas/dar_baixa', baixa())),
+        'financeiro_receber_post': ('POST', lambda: ('/financeiro/receber', receber())),
+        'api_sync': ('JSON', lambda: ('/api/sync', sync())),
+    }
+
+
+def abrir(client, metodo, url, dados):
+    if metodo == 'JSON':
+        return client.post(url, json=dados)
+    return client.open(url, method=metodo, data=dados)
+
+
+def medir(client, metodo, gerar, n, aquecimento):
+    for _ in range(aquecimento):
+        url, dados = gerar()
+        abrir(client, metodo, url, dados).close()
+    tempos, bytes_, erros = [], 0, 0
+    inicio = time.perf_counter()
+    for _ in range(n):
+        url, dados = gerar()
+        t0 = time.perf_counter()
+        r = abrir(client, metodo, url, dados)
+        corpo = r.get_data()  # consome respostas em streaming até o fim
+        tempos.append(time.perf_counter() - t0)
+        bytes_ += len(corpo)
+        erros += r.status_code >= 400
+        r.close()
+    total = time.perf_counter() - inicio
+    tempos.sort()
+    return {
+        'requisicoes': n,
+        'erros': erros,
+        'p50_ms': round(percentil(tempos, 50) * 1000, 3),
+        'p95_ms': round(percentil(tempos, 95) * 1000, 3),
+        'p99_ms': round(percentil(tempos, 99) * 1000, 3),
+        'max_ms': round(tempos[-1] * 1000, 3) if tempos else 0.0,
+        'vazao_rps': round(n / total, 2) if total else 0.0,
+        'bytes_medios': bytes_ // max(n, 1),
+        'pico_rss_mb': pico_rss_mb(),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--clientes', type=int, default=5000)
+    ap.add_argument('--vendas', type=int, default=100000)
+    ap.add_argument('--anos', type=int, default=3)
+    ap.add_argument('--pendentes', type=float, default=0.05, help='fração das vendas com saldo em aberto')
+    ap.add_argument('--requisicoes', type=int, default=50, help='requisições medidas por rota')
+    ap.add_argument('--aquecimento', type=int, default=3)
+    ap.add_argument('--rotas', help='nomes separados por vírgula (padrão: todas)')
+    ap.add_argument('--seed', type=int, default=42)
+    ap.add_argument('--db', help='reaproveita/gera o banco neste caminho em vez de um temporário')
+    ap.add_argument('--saida', help='grava o JSON neste arquivo além de imprimir')
+    args = ap.parse_args(argv)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='eggpro_bench_'), 'bench.db')
+    novo = not os.path.exists(path)
+    os.environ['EGGPRO_DB'] = path
+    os.environ.setdefault('EGGPRO_CEP_FONTE', 'stub')
+    os.environ.setdefault('EGGPRO_GEO_FONTE', 'stub')
+    import logging
+    logging.getLogger('eggpro.sql').setLevel(logging.ERROR)
+    import db
+    db.configurar(path)
+    from app import app, init_db
+    init_db()
+
+    t0 = time.perf_counter()
+    if novo:
+        semear(path, args.clientes, args.vendas, args.anos, args.pendentes, args.seed)
+        import reposicao
+        import rotas as geo
+        with db.get_db() as conn:
+            geo.geocodificar(conn, conn.execute("SELECT * FROM clientes").fetchall())
+            reposicao.atualizar(conn, completo=True)
+    carga = time.perf_counter() - t0
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': '123'})
+    rnd = random.Random(args.seed)
+    with sqlite3.connect(path) as conn:
+        plano = rotas(rnd, conn)
+        tamanho = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ('clientes', 'vendas')}
+    escolhidas = args.rotas.split(',') if args.rotas else list(plano)
+
+    resultado = {
+        'quando': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': args.seed,
+        'banco': {'caminho': path, 'bytes': os.path.getsize(path), 'carga_s': round(carga, 2), **tamanho},
+        'rotas': {},
+    }
+    for nome in escolhidas:
+        metodo, gerar = plano[nome]
+        resultado['rotas'][nome] = medir(client, metodo, gerar, args.requisicoes, args.aquecimento)
+        print(f"{nome:28s} p50={resultado['rotas'][nome]['p50_ms']:9.2f}ms p95={resultado['rotas'][nome]['p95_ms']:9.2f}ms",
+              file=sys.stderr)
+    resultado['pico_rss_mb'] = pico_rss_mb()
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    print(texto)
+    return resultado
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import csv
+import io
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, TimeoutError as FuturoExpirado
+from datetime import datetime, timedelta
+
+import db
+
+# --- CEP (CACHE LOCAL) ---
+# O preenchimento de endereço consulta /cep/<cep> no servidor, não o ViaCEP direto do
+# navegador. A resposta fica em cep_cache com validade; CEPs inexistentes também são
+# guardados (por menos tempo) para não repetir a consulta. Pedidos simultâneos do mesmo
+# CEP esperam uma única ida à fonte. Sem fonte disponível vale o cache, mesmo vencido.
+VALIDADE = timedelta(days=float(os.environ.get('EGGPRO_CEP_VALIDADE_DIAS', '180')))
+VALIDADE_NAO_ENCONTRADO = timedelta(days=float(os.environ.get('EGGPRO_CEP_VALIDADE_404_DIAS', '1')))
+TIMEOUT = float(os.environ.get('EGGPRO_CEP_TIMEOUT_S', '5'))
+CAMPOS = ('logradouro', 'bairro', 'cidade', 'uf')
+
+# Nomes de coluna aceitos na importação de CSV (bases dos Correios/ViaCEP usam nomes diferentes).
+COLUNAS_CSV = {
+    'cep': 'cep',
+    'logradouro': 'logradouro', 'rua': 'logradouro', 'endereco': 'logradouro',
+    'bairro': 'bairro',
+    'cidade': 'cidade', 'localidade': 'cidade', 'municipio': 'cidade',
+    'uf': 'uf', 'estado': 'uf',
+}
+
+_lock = threading.Lock()
+_em_voo = {}
+_stats = {'cache': 0, 'fonte': 0, 'esperas': 0, 'falhas': 0}
+
+
+class FonteIndisponivel(Exception):
+    pass
+
+
+def normalizar(cep):
+    cep = ''.join(c for c in str(cep or '') if c.isdigit())
+    if len(cep) != 8:
+        raise ValueError("CEP deve ter 8 dígitos.")
+    return cep
+
+
+# --- FONTES ---
+# Uma fonte recebe o CEP (8 dígitos) e devolve dict com CAMPOS, None se o CEP não
+# existe, ou levanta FonteIndisponivel. EGGPRO_CEP_FONTE escolhe entre FONTES.
+def viacep(cep):
+    try:
+        with urllib.request.urlopen(f"https://viacep.com.br/ws/{cep}/json/", timeout=TIMEOUT) as resp:
+            d = json.load(resp)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise FonteIndisponivel(str(e)) from e
+    if d.get('erro'):
+        return None
+    return {'logradouro': d.get('logradouro', ''), 'bairro': d.get('bairro', ''),
+            'cidade': d.get('localidade', ''), 'uf': d.get('uf', '')}
+
+
+def stub(cep):
+    """Fonte local e determinística, para testes e para rodar sem internet."""
+    if cep.startswith('00'):
+        return None
+    return {'logradouro': f"Rua {cep[:5]}", 'bairro': 'Centro', 'cidade': 'Cidade Teste', 'uf': 'SP'}
+
+
+def desligada(cep):
+    raise FonteIndisponivel("consulta externa desligada")
+
+
+FONTES = {'viacep': viacep, 'stub': stub, 'off': desligada}
+fonte = FONTES[os.environ.get('EGGPRO_CEP_FONTE', 'viacep')]
+
+
+def usar_fonte(nova):
+    """Troca a fonte (função ou nome em FONTES); devolve a anterior."""
+    global fonte
+    anterior, fonte = fonte, FONTES[nova] if isinstance(nova, str) else nova
+    return anterior
+
+
+# --- CONSULTA ---
+def _agora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _resposta(linha, origem):
+    if not linha['encontrado']:
+        return None
+    return {'cep': linha['cep'], **{c: linha[c] or '' for c in CAMPOS}, 'origem': origem}
+
+
+def _vencida(linha, agora):
+    validade = VALIDADE if linha['encontrado'] else VALIDADE_NAO_ENCONTRADO
+    return datetime.fromisoformat(linha['atualizado_em']) + validade < agora
+
+
+def _guardar(conn, cep, endereco, origem):
+    conn.execute('''INSERT INTO cep_cache (cep, logradouro, bairro, cidade, uf, encontrado, origem, atualizado_em)
+                    VALUES (?,?,?,?,?,?,?,?)
+                    ON CONFLICT(cep) DO UPDATE SET logradouro = excluded.logradouro, bairro = excluded.bairro,
+                        cidade = excluded.cidade, uf = excluded.uf, encontrado = excluded.encontrado,
+                        origem = excluded.origem, atualizado_em = excluded.atualizado_em''',
+                 (cep, *[(endereco or {}).get(c, '') for c in CAMPOS], int(endereco is not None), origem, _agora()))
+
+
+def _consultar_fonte(cep):
+    # Só um pedido por CEP vai à fonte; os outros esperam o mesmo Future.
+    with _lock:
+        futuro = _em_voo.get(cep)
+        dono = futuro is None
+        if dono:
+            futuro = _em_voo[cep] = Future()
+        else:
+            _stats['esperas'] += 1
+    if not dono:
+        try:
+            return futuro.result(timeout=TIMEOUT * 2)
+        except FuturoExpirado:
+            # Quem foi à fonte travou: para quem espera vale como fonte fora do ar (cache vencido ou 503).
+            raise FonteIndisponivel("consulta ao CEP demorou demais") from None
+    try:
+        endereco = fonte(cep)
+        with db.get_db() as conn:
+            _guardar(conn, cep, endereco, 'fonte')
+            conn.commit()
+        with _lock:
+            _stats['fonte'] += 1
+        futuro.set_result(endereco)
+        return endereco
+    except BaseException as e:
+        with _lock:
+            _stats['falhas'] += 1
+        futuro.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            del _em_voo[cep]
+
+
+def buscar(cep):
+    """Endereço do CEP: dict com cep, CAMPOS e origem ('cache', 'fonte' ou 'vencido'); None se não existe.
+
+    Levanta ValueError para CEP malformado e FonteIndisponivel sem fonte e sem cache.
+    """
+    cep = normalizar(cep)
+    with db.get_db() as conn:
+        linha = conn.execute("SELECT * FROM cep_cache WHERE cep = ?", (cep,)).fetchone()
+    if linha and not _vencida(linha, datetime.now()):
+        with _lock:
+            _stats['cache'] += 1
+        return _resposta(linha, 'cache')
+    try:
+        endereco = _consultar_fonte(cep)
+    except FonteIndisponivel:
+        if linha:
+            return _resposta(linha, 'vencido')
+        raise
+    return {'cep': cep, **endereco, 'origem': 'fonte'} if endereco else None
+
+
+# --- CARGA EM LOTE ---
+def importar_csv(conn, texto, lote=5000):
+    """Carrega um dump CSV (',' ou ';', com cabeçalho) em cep_cache; devolve (importados, ignorados).
+
+    Linhas importadas contam como consultadas agora, então valem por VALIDADE.
+    """
+    amostra = texto[:4096]
+    dialeto = csv.Sniffer().sniff(amostra, delimiters=',;\t') if amostra else csv.excel
+    leitor = csv.reader(io.StringIO(texto), dialeto)
+    cabecalho = [COLUNAS_CSV.get(c.strip().lower()) for c in next(leitor, [])]
+    if 'cep' not in cabecalho:
+        raise ValueError("O CSV precisa de uma coluna 'cep'.")
+    agora, importados, ignorados, linhas = _agora(), 0, 0, []
+
+    def gravar():
+        conn.executemany('''INSERT INTO cep_cache (cep, logradouro, bairro, cidade, uf, encontrado, origem, atualizado_em)
+                            VALUES (?,?,?,?,?,1,'csv',?)
+                            ON CONFLICT(cep) DO UPDATE SET logradouro = excluded.logradouro, bairro = excluded.bairro,
+                                cidade = excluded.cidade, uf = excluded.uf, encontrado = 1,
+                                origem = excluded.origem, atualizado_em = excluded.atualizado_em''', linhas)
+        linhas.clear()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for registro in leitor:
+            d = {nome: valor.strip() for nome, valor in zip(cabecalho, registro) if nome}
+            try:
+                cep = normalizar(d.get('cep'))
+            except ValueError:
+                ignorados += 1
+                continue
+            linhas.append((cep, *[d.get(c, '') for c in CAMPOS], agora))
+            importados += 1
+            if len(linhas) >= lote:
+                gravar()
+        if linhas:
+            gravar()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return importados, ignorados
+
+
+def stats():
+    with _lock:
+        return {**_stats, 'em_voo': len(_em_voo)}
@@ -0,0 +1,509 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metricas
+
+# --- CONFIGURAÇÃO DO BANCO ---
+DB_PATH = os.environ.get('EGGPRO_DB', 'eggpro_v10.db')
+POOL_SIZE = int(os.environ.get('EGGPRO_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('EGGPRO_POOL_TIMEOUT', '10'))
+
+# Aplicados em toda conexão nova. journal_mode=WAL é persistente no arquivo,
+# mas repetir é barato e garante o modo mesmo em bancos recém-criados.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',      # seguro em WAL: só o último commit pode se perder numa queda de energia
+    'cache_size': -16000,         # ~16 MB de cache de páginas por conexão
+    'mmap_size': 134217728,       # 128 MB mapeados em memória para leituras
+    'busy_timeout': 5000,         # espera o writer em vez de "database is locked"
+    'temp_store': 'MEMORY',
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class CursorMedido(sqlite3.Cursor):
+    # Soma ao tempo da consulta também os fetch*, onde o SQLite faz boa parte do trabalho.
+    # Iterar o cursor diretamente (for linha in cur) não é cronometrado.
+    _sql, _gasto = '', 0.0
+
+    def _medir(self, metodo, *args):
+        inicio = time.perf_counter()
+        try:
+            return metodo(*args)
+        finally:
+            dur = time.perf_counter() - inicio
+            metricas.registrar_sql(self._sql, dur, nova=False, ja_gasto=self._gasto)
+            self._gasto += dur
+
+    def fetchone(self):
+        return self._medir(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._medir(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._medir(super().fetchall)
+
+
+class ConexaoMedida(sqlite3.Connection):
+    def _medir(self, metodo, sql, params):
+        cur = self.cursor(CursorMedido)
+        cur._sql = sql
+        inicio = time.perf_counter()
+        try:
+            getattr(sqlite3.Cursor, metodo)(cur, sql, params)
+        finally:
+            cur._gasto = time.perf_counter() - inicio
+            metricas.registrar_sql(sql, cur._gasto)
+        return cur
+
+    def execute(self, sql, params=()):
+        return self._medir('execute', sql, params)
+
+    def executemany(self, sql, params):
+        return self._medir('executemany', sql, params)
+
+
+class ConnectionPool:
+    """Reaproveita conexões SQLite entre requisições e threads do mesmo processo."""
+
+    def __init__(self, path, tamanho=POOL_SIZE, timeout=POOL_TIMEOUT, pragmas=None):
+        self.path = path
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Conexões não sobrevivem a fork: cada processo monta o seu pool.
+        self._pid = os.getpid()
+        self._livres = queue.LifoQueue()
+        self._criadas = 0
+        self._stats = {'aquisicoes': 0, 'esperas': 0, 'espera_total': 0.0, 'espera_max': 0.0, 'timeouts': 0}
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=ConexaoMedida)
+        conn.row_factory = sqlite3.Row
+        for nome, valor in self.pragmas.items():
+            conn.execute(f"PRAGMA {nome} = {valor}")
+        return conn
+
+    def acquire(self):
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._reset()
+        try:
+            conn = self._livres.get_nowait()
+            espera = 0.0
+        except queue.Empty:
+            with self._lock:
+                criar = self._criadas < self.tamanho
+                if criar:
+                    self._criadas += 1
+            if criar:
+                try:
+                    conn = self._conectar()
+                except Exception:
+                    with self._lock:
+                        self._criadas -= 1
+                    raise
+                espera = 0.0
+            else:
+                inicio = time.perf_counter()
+                try:
+                    conn = self._livres.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"nenhuma conexão livre em {self.timeout}s (pool={self.tamanho})")
+                espera = time.perf_counter() - inicio
+        with self._lock:
+            s = self._stats
+            s['aquisicoes'] += 1
+            if espera:
+                s['esperas'] += 1
+                s['espera_total'] += espera
+                s['espera_max'] = max(s['espera_max'], espera)
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._livres.put(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._criadas -= 1
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._livres.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s.update(tamanho=self.tamanho, abertas=self._criadas, livres=self._livres.qsize(),
+                     em_uso=self._criadas - self._livres.qsize())
+        s['espera_media'] = s['espera_total'] / s['esperas'] if s['esperas'] else 0.0
+        return s
+
+
+pool = ConnectionPool(DB_PATH)
+
+
+def configurar(path=None, tamanho=None):
+    """Troca o arquivo ou o tamanho do pool (testes, benchmarks, deploy)."""
+    global DB_PATH
+    pool.close()
+    if path is not None:
+        DB_PATH = pool.path = path
+    if tamanho is not None:
+        pool.tamanho = tamanho
+
+
+@contextmanager
+def get_db():
+    conn = pool.acquire()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        try:
+            pool.release(conn)
+        except sqlite3.Error:
+            pool.discard(conn)
+        raise
+    else:
+        pool.release(conn)
+
+
+@contextmanager
+def transacao(conn):
+    """Transação de escrita: BEGIN IMMEDIATE ... COMMIT, ou um SAVEPOINT se já houver
+    uma aberta (lote da fila de escrita), para a operação poder ser desfeita sozinha."""
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT transacao")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO transacao")
+            conn.execute("RELEASE transacao")
+            raise
+        conn.execute("RELEASE transacao")
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def conexao_leitura(path=None, imutavel=False):
+    """Conexão só-leitura fora do pool, para trabalhos longos (relatórios em segundo plano).
+
+    `imutavel` só para arquivos que nunca mudam enquanto abertos (o snapshot): dispensa locks.
+    """
+    uri = f"file:{path or DB_PATH}?mode=ro" + ("&immutable=1" if imutavel else "")
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=ConexaoMedida)
+    conn.row_factory = sqlite3.Row
+    for nome, valor in pool.pragmas.items():
+        if nome != 'journal_mode':
+            conn.execute(f"PRAGMA {nome} = {valor}")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def pool_stats():
+    return pool.stats()
+
+
+# --- MIGRAÇÕES ---
+# Cada migração roda uma única vez, na ordem, dentro de sua própria transação.
+# Para mudar o schema, acrescente uma função nova ao final de MIGRACOES;
+# nunca edite uma migração que já foi aplicada em produção.
+def _m001_schema_inicial(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS usuarios (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE, password TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS clientes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nome TEXT, tel TEXT, cep TEXT, rua TEXT, bairro TEXT, cidade TEXT, estado TEXT, numero TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS estoque (
+                    produto TEXT PRIMARY KEY, qtd INTEGER, preco_custo REAL, preco_sugerido REAL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS vendas (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cli_id INTEGER, cli_nome TEXT, data TEXT, timestamp DATETIME,
+                    prod TEXT, qtd INTEGER, valor_unit REAL, total REAL,
+                    pago_pix REAL, pago_dinheiro REAL, pendente REAL)''')
+
+
+def _m002_vendas_dia_e_indices(conn):
+    # `data` (dd/mm/YYYY) continua existindo para exibição; `dia` (YYYY-mm-dd) ordena e filtra.
+    conn.execute("ALTER TABLE vendas ADD COLUMN dia TEXT")
+    conn.execute("""UPDATE vendas SET dia = substr(data, 7, 4) || '-' || substr(data, 4, 2) || '-' || substr(data, 1, 2)
+                    WHERE data LIKE '__/__/____'""")
+    conn.execute("UPDATE vendas SET dia = date(timestamp) WHERE dia IS NULL")
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS vendas_dia_padrao AFTER INSERT ON vendas
+                    WHEN NEW.dia IS NULL BEGIN
+                        UPDATE vendas SET dia = COALESCE(date(NEW.timestamp), date('now', 'localtime')) WHERE id = NEW.id;
+                    END''')
+    # Cobre as somas do painel sem tocar na tabela.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_dia ON vendas(dia, total, pago_pix, pago_dinheiro, pendente)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_timestamp ON vendas(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_cli_dia ON vendas(cli_id, dia)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_pendentes ON vendas(cli_id, dia) WHERE pendente > 0")
+    # Sem estatísticas o planner não sabe que pendentes são raros e ignora o índice parcial.
+    conn.execute("ANALYZE")
+
+
+def _m003_indices_historico(conn):
+    # Todo índice SQLite termina no rowid: igualdade em cli_id/prod já sai ordenada por id,
+    # que é o que a paginação por chave do histórico precisa.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_cli ON vendas(cli_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_prod ON vendas(prod)")
+    conn.execute("ANALYZE")
+
+
+def _m004_resumo_diario(conn):
+    # Agregado por dia e produto mantido por triggers, dentro da mesma transação de
+    # quem escreve em vendas. A margem é derivada na leitura com estoque.preco_custo.
+    conn.execute('''CREATE TABLE IF NOT EXISTS vendas_diarias (
+                    dia TEXT NOT NULL, prod TEXT NOT NULL,
+                    vendas INTEGER NOT NULL DEFAULT 0, qtd INTEGER NOT NULL DEFAULT 0,
+                    vendido REAL NOT NULL DEFAULT 0, recebido REAL NOT NULL DEFAULT 0, pendente REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (dia, prod)) WITHOUT ROWID''')
+    soma_nova = '''INSERT INTO vendas_diarias (dia, prod, vendas, qtd, vendido, recebido, pendente)
+                   SELECT NEW.dia, COALESCE(NEW.prod, ''), 1, COALESCE(NEW.qtd, 0), COALESCE(NEW.total, 0),
+                          COALESCE(NEW.pago_pix, 0) + COALESCE(NEW.pago_dinheiro, 0), COALESCE(NEW.pendente, 0)
+                   WHERE NEW.dia IS NOT NULL
+                   ON CONFLICT (dia, prod) DO UPDATE SET
+                       vendas = vendas + 1, qtd = qtd + excluded.qtd, vendido = vendido + excluded.vendido,
+                       recebido = recebido + excluded.recebido, pendente = pendente + excluded.pendente;'''
+    tira_antiga = '''UPDATE vendas_diarias SET
+                         vendas = vendas - 1, qtd = qtd - COALESCE(OLD.qtd, 0), vendido = vendido - COALESCE(OLD.total, 0),
+                         recebido = recebido - (COALESCE(OLD.pago_pix, 0) + COALESCE(OLD.pago_dinheiro, 0)),
+                         pendente = pendente - COALESCE(OLD.pendente, 0)
+                     WHERE dia = OLD.dia AND prod = COALESCE(OLD.prod, '');
+                     DELETE FROM vendas_diarias WHERE dia = OLD.dia AND prod = COALESCE(OLD.prod, '') AND vendas <= 0;'''
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS vendas_diarias_ins AFTER INSERT ON vendas BEGIN {soma_nova} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS vendas_diarias_del AFTER DELETE ON vendas BEGIN {tira_antiga} END")
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS vendas_diarias_upd
+                     AFTER UPDATE OF dia, prod, qtd, total, pago_pix, pago_dinheiro, pendente ON vendas
+                     BEGIN {tira_antiga} {soma_nova} END''')
+    reconstruir_resumo(conn)
+
+
+def _m005_busca_clientes(conn):
+    # Índice FTS5 de conteúdo externo: guarda só os tokens, o texto continua em clientes.
+    # remove_diacritics deixa "joao" achar "João".
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS clientes_fts USING fts5(
+                    nome, tel, bairro, rua, content='clientes', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2')''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS clientes_fts_ins AFTER INSERT ON clientes BEGIN
+                        INSERT INTO clientes_fts (rowid, nome, tel, bairro, rua) VALUES (NEW.id, NEW.nome, NEW.tel, NEW.bairro, NEW.rua);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS clientes_fts_del AFTER DELETE ON clientes BEGIN
+                        INSERT INTO clientes_fts (clientes_fts, rowid, nome, tel, bairro, rua) VALUES ('delete', OLD.id, OLD.nome, OLD.tel, OLD.bairro, OLD.rua);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS clientes_fts_upd AFTER UPDATE OF nome, tel, bairro, rua ON clientes BEGIN
+                        INSERT INTO clientes_fts (clientes_fts, rowid, nome, tel, bairro, rua) VALUES ('delete', OLD.id, OLD.nome, OLD.tel, OLD.bairro, OLD.rua);
+                        INSERT INTO clientes_fts (rowid, nome, tel, bairro, rua) VALUES (NEW.id, NEW.nome, NEW.tel, NEW.bairro, NEW.rua);
+                    END''')
+    conn.execute("INSERT INTO clientes_fts (clientes_fts) VALUES ('rebuild')")
+    # Paginação da lista de clientes por (nome, id).
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clientes_nome ON clientes(nome)")
+
+
+def _m006_versao_dados(conn):
+    # Um contador por tabela, incrementado por trigger a cada escrita. As páginas
+    # usam esses números como ETag para responder 304 sem rodar suas consultas.
+    conn.execute("CREATE TABLE IF NOT EXISTS versao_dados (tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID")
+    for tabela in TABELAS_VERSIONADAS:
+        conn.execute("INSERT OR IGNORE INTO versao_dados (tabela, versao) VALUES (?, 0)", (tabela,))
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS versao_{tabela}_{evento.lower()} AFTER {evento} ON {tabela} BEGIN
+                                 UPDATE versao_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+                             END''')
+
+
+def _m007_relatorio_jobs(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS relatorio_jobs (
+                    id TEXT PRIMARY KEY, usuario TEXT, periodo TEXT, formato TEXT, parametros TEXT,
+                    status TEXT NOT NULL, criado_em TEXT, iniciado_em TEXT, concluido_em TEXT,
+                    arquivo TEXT, nome TEXT, bytes INTEGER, erro TEXT)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_relatorio_jobs_usuario ON relatorio_jobs(usuario, criado_em)")
+
+
+def _m008_recebiveis(conn):
+    # Índice parcial cobrindo o que o contas a receber lê (cliente, dia, saldo): a
+    # agregação por devedor e a baixa FIFO não precisam visitar a tabela.
+    conn.execute("DROP INDEX IF EXISTS idx_vendas_pendentes")
+    conn.execute("CREATE INDEX idx_vendas_pendentes ON vendas(cli_id, dia, pendente) WHERE pendente > 0")
+    conn.execute("ANALYZE vendas")
+
+
+def _m009_sincronizacao(conn):
+    # Chaves de idempotência da sincronização offline e o resultado já devolvido para cada uma.
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_chaves (
+                    chave TEXT PRIMARY KEY, usuario TEXT, tipo TEXT, resultado TEXT, criado_em TEXT) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_chaves_criado ON sync_chaves(criado_em)")
+
+
+def _m010_arquivo(conn):
+    # Um registro por ano arquivado (arquivo/vendas_AAAA.db): intervalo de dias e maior id, para
+    # as consultas saberem sem abrir o arquivo se precisam anexá-lo.
+    conn.execute('''CREATE TABLE IF NOT EXISTS vendas_arquivo (
+                    ano TEXT PRIMARY KEY, vendas INTEGER, primeiro_dia TEXT, ultimo_dia TEXT,
+                    max_id INTEGER, atualizado_em TEXT)''')
+
+
+def _m011_cep_cache(conn):
+    # Endereços por CEP (cep.py). encontrado = 0 guarda também os CEPs que não existem.
+    conn.execute('''CREATE TABLE IF NOT EXISTS cep_cache (
+                    cep TEXT PRIMARY KEY, logradouro TEXT, bairro TEXT, cidade TEXT, uf TEXT,
+                    encontrado INTEGER NOT NULL DEFAULT 1, origem TEXT, atualizado_em TEXT) WITHOUT ROWID''')
+
+
+def _m012_clientes_geo(conn):
+    # Coordenadas de cada cliente (rotas.py) e o endereço que as gerou, para saber quando refazer.
+    conn.execute('''CREATE TABLE IF NOT EXISTS clientes_geo (
+                    cli_id INTEGER PRIMARY KEY, chave TEXT, lat REAL, lon REAL,
+                    encontrado INTEGER NOT NULL DEFAULT 1, origem TEXT, atualizado_em TEXT)''')
+
+
+def _m013_reposicao(conn):
+    # Razão do estoque (reposicao.py): cada mudança de saldo com tipo e, quando houver, a venda.
+    conn.execute('''CREATE TABLE IF NOT EXISTS estoque_movimentos (
+                    id INTEGER PRIMARY KEY, produto TEXT NOT NULL, dia TEXT NOT NULL, quando TEXT,
+                    tipo TEXT NOT NULL, qtd INTEGER NOT NULL, venda_id INTEGER)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_estoque_movimentos_produto ON estoque_movimentos(produto, dia)")
+    # O saldo de hoje vira o movimento inicial: daqui em diante a soma dos movimentos é o estoque.
+    conn.execute('''INSERT INTO estoque_movimentos (produto, dia, quando, tipo, qtd)
+                    SELECT produto, date('now', 'localtime'), datetime('now', 'localtime'), 'inicial', qtd
+                    FROM estoque WHERE qtd != 0''')
+    # Previsão pré-calculada por produto e o ponto até onde os movimentos já foram processados.
+    conn.execute('''CREATE TABLE IF NOT EXISTS estoque_previsao (
+                    produto TEXT PRIMARY KEY, taxa_curta REAL, taxa_longa REAL, taxa REAL,
+                    seguranca REAL, ponto_pedido REAL, calculado_em TEXT) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS estoque_previsao_estado (
+                    id INTEGER PRIMARY KEY CHECK (id = 1), ultimo_movimento INTEGER NOT NULL DEFAULT 0, dia_base TEXT)''')
+    conn.execute("INSERT OR IGNORE INTO estoque_previsao_estado (id, ultimo_movimento) VALUES (1, 0)")
+
+
+def _m014_versao_previsao(conn):
+    # estoque_previsao muda fora da requisição (thread de reposicao.agendar); com contador
+    # próprio, as páginas que mostram a previsão deixam de responder 304 com ela velha.
+    conn.execute("INSERT OR IGNORE INTO versao_dados (tabela, versao) VALUES ('estoque_previsao', 0)")
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS versao_estoque_previsao_{evento.lower()} AFTER {evento} ON estoque_previsao BEGIN
+                             UPDATE versao_dados SET versao = versao + 1 WHERE tabela = 'estoque_previsao';
+                         END''')
+
+
+def _m015_jobs_processo(conn):
+    # Quem pegou o job (host:pid): um worker que morreu deixa 'fila'/'rodando' para trás (jobs.recuperar_orfaos).
+    conn.execute("ALTER TABLE relatorio_jobs ADD COLUMN processo TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_relatorio_jobs_status ON relatorio_jobs(status)")
+
+
+TABELAS_VERSIONADAS = ('vendas', 'clientes', 'estoque', 'usuarios')
+
+MIGRACOES = [
+    _m001_schema_inicial,
+    _m002_vendas_dia_e_indices,
+    _m003_indices_historico,
+    _m004_resumo_diario,
+    _m005_busca_clientes,
+    _m006_versao_dados,
+    _m007_relatorio_jobs,
+    _m008_recebiveis,
+    _m009_sincronizacao,
+    _m010_arquivo,
+    _m011_cep_cache,
+    _m012_clientes_geo,
+    _m013_reposicao,
+    _m014_versao_previsao,
+    _m015_jobs_processo,
+]
+
+
+def reconstruir_resumo(conn, inicio=None, fim=None, tabela='vendas'):
+    """Refaz vendas_diarias a partir de vendas (carga inicial ou reparo), opcionalmente só entre dois dias.
+
+    `tabela` é o FROM a usar; com dias arquivados, passe a união de arquivo.historico().
+    """
+    where, params = ["dia IS NOT NULL"], []
+    if inicio:
+        where.append("dia >= ?"); params.append(inicio)
+    if fim:
+        where.append("dia <= ?"); params.append(fim)
+    where = " AND ".join(where)
+    conn.execute(f"DELETE FROM vendas_diarias WHERE {where}", params)
+    cur = conn.execute(f'''INSERT INTO vendas_diarias (dia, prod, vendas, qtd, vendido, recebido, pendente)
+                           SELECT dia, COALESCE(prod, ''), COUNT(*), TOTAL(qtd), TOTAL(total),
+                                  TOTAL(pago_pix) + TOTAL(pago_dinheiro), TOTAL(pendente)
+                           FROM {tabela} WHERE {where} GROUP BY dia, COALESCE(prod, '')''', params)
+    return cur.rowcount
+
+
+def versoes_dados(conn, tabelas=TABELAS_VERSIONADAS):
+    marcas = ",".join("?" * len(tabelas))
+    return dict(conn.execute(f"SELECT tabela, versao FROM versao_dados WHERE tabela IN ({marcas})", tabelas).fetchall())
+
+
+def versao_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                    versao INTEGER PRIMARY KEY, nome TEXT, aplicada_em TEXT)''')
+    if conn.in_transaction:
+        conn.commit()
+    return conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+
+
+def versao_aplicada(conn):
+    """Como versao_schema, mas só lê: sem schema_version ainda, a versão é 0."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone():
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+
+
+def migrar(conn):
+    """Aplica as migrações pendentes e devolve a lista das que rodaram."""
+    aplicadas = []
+    for versao, migracao in enumerate(MIGRACOES, start=1):
+        if versao <= versao_schema(conn):
+            continue
+        # IMMEDIATE pega o lock de escrita antes de reler a versão: dois processos
+        # subindo juntos não aplicam a mesma migração duas vezes.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            atual = conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+            if versao > atual:
+                migracao(conn)
+                conn.execute("INSERT INTO schema_version (versao, nome, aplicada_em) VALUES (?, ?, datetime('now'))",
+                             (versao, migracao.__name__.lstrip('_')))
+                aplicadas.append(versao)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return aplicadas
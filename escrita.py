@@ -0,0 +1,129 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturoExpirado
+
+import db
+
+# --- FILA DE ESCRITA (GROUP COMMIT) ---
+# Opcional (EGGPRO_GRUPO_COMMIT=1). As gravações vão para uma única thread que junta
+# o que chegar dentro de JANELA num só BEGIN IMMEDIATE ... COMMIT: um fsync por lote
+# em vez de um por requisição. Cada operação roda no seu SAVEPOINT, então a falha de
+# uma não desfaz as outras, e quem chamou só recebe a resposta depois do COMMIT.
+ATIVO = os.environ.get('EGGPRO_GRUPO_COMMIT', '') not in ('', '0')
+JANELA = float(os.environ.get('EGGPRO_GRUPO_JANELA_MS', '3')) / 1000
+MAX_LOTE = int(os.environ.get('EGGPRO_GRUPO_MAX', '64'))
+TIMEOUT = float(os.environ.get('EGGPRO_GRUPO_TIMEOUT_S', '30'))
+
+_lock = threading.Lock()
+_fila = None
+_pid = None
+_thread = None
+_stats = {'lotes': 0, 'operacoes': 0, 'falhas': 0, 'maior_lote': 0, 'commits_falhos': 0,
+          'expiradas': 0, 'reinicios': 0}
+
+
+class Ocupada(Exception):
+    """A fila não respondeu em TIMEOUT; a requisição vira 503."""
+
+
+def _iniciar():
+    # Uma thread escritora por processo, recriada depois de um fork ou se tiver morrido
+    # (nesse caso a fila é a mesma: o que estava esperando ainda é gravado).
+    global _fila, _pid, _thread
+    with _lock:
+        if _fila is None or _pid != os.getpid():
+            _fila = queue.Queue()
+            _pid = os.getpid()
+        elif not _thread.is_alive():
+            _stats['reinicios'] += 1
+        else:
+            return _fila
+        _thread = threading.Thread(target=_escritor, args=(_fila,), name='eggpro-escrita', daemon=True)
+        _thread.start()
+        return _fila
+
+
+def executar(operacao, *args):
+    """Roda operacao(conn, *args) numa transação de escrita e devolve o resultado dela.
+
+    Com a fila desligada é só get_db() na thread atual. A operação deve usar
+    db.transacao() e não chamar commit(): no modo em lote quem confirma é a fila.
+    Levanta Ocupada se a fila não responder em TIMEOUT segundos.
+    """
+    if not ATIVO:
+        with db.get_db() as conn:
+            return operacao(conn, *args)
+    futuro = Future()
+    _iniciar().put((operacao, args, futuro))
+    try:
+        return futuro.result(timeout=TIMEOUT)
+    except FuturoExpirado:
+        with _lock:
+            _stats['expiradas'] += 1
+        # Ainda na fila: cancelada, a escritora pula. Já no lote: pode acabar gravada.
+        if futuro.cancel():
+            raise Ocupada("Gravação demorou demais e foi cancelada; tente de novo.") from None
+        raise Ocupada("Gravação demorou demais; confira se ela foi registrada antes de repetir.") from None
+
+
+def _coletar(fila):
+    lote = [fila.get()]
+    prazo = time.perf_counter() + JANELA
+    while len(lote) < MAX_LOTE:
+        resta = prazo - time.perf_counter()
+        if resta <= 0:
+            break
+        try:
+            lote.append(fila.get(timeout=resta))
+        except queue.Empty:
+            break
+    return lote
+
+
+def _aplicar(lote):
+    resultados = []
+    with db.get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for operacao, args, _ in lote:
+            conn.execute("SAVEPOINT operacao")
+            try:
+                resultados.append((operacao(conn, *args), None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO operacao")
+                resultados.append((None, e))
+            conn.execute("RELEASE operacao")
+        conn.commit()
+    return resultados
+
+
+def _escritor(fila):
+    while True:
+        lote = [item for item in _coletar(fila) if item[2].set_running_or_notify_cancel()]
+        if not lote:
+            continue
+        try:
+            resultados = _aplicar(lote)
+        except Exception as e:
+            # BEGIN ou COMMIT falhou: nada do lote foi gravado, todos recebem o erro.
+            resultados = [(None, e)] * len(lote)
+            with _lock:
+                _stats['commits_falhos'] += 1
+        with _lock:
+            _stats['lotes'] += 1
+            _stats['operacoes'] += len(lote)
+            _stats['falhas'] += sum(1 for _, erro in resultados if erro)
+            _stats['maior_lote'] = max(_stats['maior_lote'], len(lote))
+        for (_, _, futuro), (valor, erro) in zip(lote, resultados):
+            if erro:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(valor)
+
+
+def stats():
+    with _lock:
+        s = dict(_stats, ativo=int(ATIVO), na_fila=_fila.qsize() if _fila else 0)
+    s['lote_medio'] = s['operacoes'] / s['lotes'] if s['lotes'] else 0.0
+    return s
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from werkzeug.datastructures import MultiDict
+
+import arquivo
+import db
+import relatorios
+import snapshot
+
+# --- RELATÓRIOS EM SEGUNDO PLANO ---
+# O pedido vira uma linha em relatorio_jobs e roda num pool de threads lendo a cópia
+# de leitura (snapshot.py); o arquivo fica em disco até expirar. A tabela é a fonte da verdade,
+# então qualquer worker consegue listar e entregar o resultado. Cada job guarda o processo
+# que o pegou: se ele morrer (crash, reinício, max_requests) o job vira erro em vez de
+# ocupar a fila até vencer.
+WORKERS = int(os.environ.get('EGGPRO_JOBS_WORKERS', '2'))
+MAX_NA_FILA = int(os.environ.get('EGGPRO_JOBS_FILA', '10'))
+VALIDADE = timedelta(hours=float(os.environ.get('EGGPRO_JOBS_VALIDADE_H', '24')))
+MAX_DURACAO = timedelta(minutes=float(os.environ.get('EGGPRO_JOBS_MAX_MIN', '30')))  # 'fila'/'rodando' além disso é órfão
+INTERVALO_LIMPEZA = 60  # segundos entre limpezas disparadas por listar/obter
+
+FORMATOS = {
+    'csv': ('text/csv', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'pdf': ('application/pdf', 'pdf'),
+}
+
+log = logging.getLogger('eggpro.jobs')
+_lock = threading.Lock()
+_executor = None
+_pid = None
+_ultima_limpeza = 0.0
+
+
+def pasta():
+    return os.environ.get('EGGPRO_JOBS_DIR') or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), 'relatorios_gerados')
+
+
+class FilaCheia(Exception):
+    pass
+
+
+def _pool():
+    # Criado sob demanda e recriado depois de um fork: threads não atravessam processos.
+    global _executor, _pid
+    with _lock:
+        if _executor is None or _pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='eggpro-job')
+            _pid = os.getpid()
+        return _executor
+
+
+def _agora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _processo():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _vivo(processo):
+    """True/False para processos desta máquina; None quando não dá para saber (outro host, job antigo)."""
+    host, _, pid = (processo or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def enviar(usuario, periodo, formato, args):
+    """Registra o job e agenda a execução; devolve o id."""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato desconhecido: {formato}")
+    limpar(forcar=True)
+    job_id = uuid.uuid4().hex
+    parametros = json.dumps([(k, v) for k, v in args.items(multi=True) if k not in ('periodo', 'formato')])
+    with db.get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        ativos = conn.execute("SELECT COUNT(*) FROM relatorio_jobs WHERE status IN ('fila', 'rodando')").fetchone()[0]
+        if ativos >= MAX_NA_FILA:
+            raise FilaCheia(f"Já existem {ativos} relatórios na fila; tente de novo em instantes.")
+        conn.execute("INSERT INTO relatorio_jobs (id, usuario, periodo, formato, parametros, status, criado_em, processo) VALUES (?,?,?,?,?,'fila',?,?)",
+                     (job_id, usuario, periodo, formato, parametros, _agora(), _processo()))
+    _pool().submit(_executar, job_id)
+    return job_id
+
+
+def _executar(job_id):
+    with db.get_db() as conn:
+        job = conn.execute("SELECT * FROM relatorio_jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.execute("UPDATE relatorio_jobs SET status = 'rodando', iniciado_em = ? WHERE id = ?", (_agora(), job_id))
+    _, ext = FORMATOS[job['formato']]
+    os.makedirs(pasta(), exist_ok=True)
+    destino = os.path.join(pasta(), f"{job_id}.{ext}")
+    tmp = destino + '.tmp'
+    try:
+        args = MultiDict(json.loads(job['parametros']))
+        leitura = snapshot.conexao()
+        try:
+            with arquivo.historico(leitura, *relatorios.intervalo(job['periodo'], args)) as tabela:
+                query, params, nome = relatorios.consulta_relatorio(job['periodo'], args, tabela=tabela)
+                cur = leitura.execute(query, params)
+                try:
+                    with open(tmp, 'wb') as f:
+                        if job['formato'] == 'pdf':
+                            f.write(relatorios.pdf_bytes(cur, f"EggPro - {nome.replace('_', ' ')}"))
+                        else:
+                            for parte in relatorios.FORMATOS[job['formato']][0](cur):
+                                f.write(parte)
+                finally:
+                    cur.close()
+        finally:
+            leitura.close()
+        os.replace(tmp, destino)
+        with db.get_db() as conn:
+            conn.execute("UPDATE relatorio_jobs SET status = 'pronto', concluido_em = ?, arquivo = ?, nome = ?, bytes = ? WHERE id = ?",
+                         (_agora(), destino, f"{nome}.{ext}", os.path.getsize(destino), job_id))
+    except Exception as e:
+        log.exception("relatório %s falhou", job_id)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        with db.get_db() as conn:
+            conn.execute("UPDATE relatorio_jobs SET status = 'erro', concluido_em = ?, erro = ? WHERE id = ?", (_agora(), str(e)[:500], job_id))
+
+
+def obter(job_id, usuario):
+    limpar()
+    with db.get_db() as conn:
+        return conn.execute("SELECT * FROM relatorio_jobs WHERE id = ? AND usuario = ?", (job_id, usuario)).fetchone()
+
+
+def listar(usuario, limite=30):
+    limpar()
+    with db.get_db() as conn:
+        return conn.execute("SELECT * FROM relatorio_jobs WHERE usuario = ? ORDER BY criado_em DESC LIMIT ?", (usuario, limite)).fetchall()
+
+
+def recuperar_orfaos(conn):
+    """Marca como erro os jobs 'fila'/'rodando' cujo processo morreu ou que passaram de MAX_DURACAO.
+
+    Roda na subida (init_db) e nas limpezas; jobs de processos vivos não são tocados.
+    """
+    limite = (datetime.now() - MAX_DURACAO).isoformat(timespec='seconds')
+    ativos = conn.execute("SELECT id, processo, criado_em FROM relatorio_jobs WHERE status IN ('fila', 'rodando')").fetchall()
+    orfaos = [(_agora(), j['id']) for j in ativos if j['criado_em'] < limite or _vivo(j['processo']) is False]
+    if orfaos:
+        conn.executemany('''UPDATE relatorio_jobs SET status = 'erro', concluido_em = ?,
+                                erro = 'Interrompido (servidor reiniciou ou demorou demais); peça de novo.'
+                            WHERE id = ? AND status IN ('fila', 'rodando')''', orfaos)
+        conn.commit()
+    return len(orfaos)
+
+
+def limpar(forcar=False):
+    """Órfãos e expirados; sem forcar, no máximo uma vez por INTERVALO_LIMPEZA neste processo."""
+    global _ultima_limpeza
+    with _lock:
+        if not forcar and time.monotonic() - _ultima_limpeza < INTERVALO_LIMPEZA:
+            return
+        _ultima_limpeza = time.monotonic()
+    with db.get_db() as conn:
+        recuperar_orfaos(conn)
+    limpar_expirados()
+
+
+def limpar_expirados():
+    """Apaga arquivos vencidos e marca os jobs como expirados."""
+    limite = (datetime.now() - VALIDADE).isoformat(timespec='seconds')
+    with db.get_db() as conn:
+        vencidos = conn.execute("SELECT id, arquivo FROM relatorio_jobs WHERE status != 'expirado' AND criado_em < ?", (limite,)).fetchall()
+        for job in vencidos:
+            if job['arquivo'] and os.path.exists(job['arquivo']):
+                os.remove(job['arquivo'])
+        conn.executemany("UPDATE relatorio_jobs SET status = 'expirado', arquivo = NULL WHERE id = ?", [(j['id'],) for j in vencidos])
+    return len(vencidos)
@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+# --- MÉTRICAS ---
+# Latência por rota e tempo de SQL por requisição, expostos em texto Prometheus.
+# Os números são por processo: com vários workers, cada um responde pelos seus.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_LENTO = float(os.environ.get('EGGPRO_SQL_LENTO_MS', '200')) / 1000
+FORA = '(fora de requisição)'
+
+log_sql = logging.getLogger('eggpro.sql')
+
+
+class Histograma:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.contagens = [0] * len(buckets)
+        self.soma = 0.0
+        self.n = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+        self.soma += valor
+        self.n += 1
+
+    def acumulado(self):
+        total = 0
+        for limite, qtd in zip(self.buckets, self.contagens):
+            total += qtd
+            yield limite, total
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_latencia = defaultdict(Histograma)          # endpoint -> duração da requisição
+_sql_por_req = defaultdict(Histograma)       # endpoint -> tempo de SQL por requisição
+_respostas = defaultdict(int)                # (endpoint, método, status) -> total
+_sql_total = defaultdict(lambda: [0, 0.0])   # endpoint -> [consultas, segundos]
+_sql_lentas = defaultdict(int)               # endpoint -> consultas acima do limite
+
+
+def inicio_requisicao(endpoint):
+    _local.endpoint = endpoint or FORA
+    _local.inicio = time.perf_counter()
+    _local.sql_n = 0
+    _local.sql_t = 0.0
+
+
+def fim_requisicao(metodo, status):
+    endpoint = getattr(_local, 'endpoint', None)
+    if endpoint is None:
+        return None
+    duracao = time.perf_counter() - _local.inicio
+    with _lock:
+        _latencia[endpoint].observar(duracao)
+        _sql_por_req[endpoint].observar(_local.sql_t)
+        _respostas[(endpoint, metodo, status)] += 1
+    resumo = (duracao, _local.sql_n, _local.sql_t)
+    _local.endpoint = None
+    return resumo
+
+
+def registrar_sql(sql, segundos, nova=True, ja_gasto=0.0):
+    """Chamado pela camada de conexão a cada execute/fetch; `nova` conta uma consulta."""
+    endpoint = getattr(_local, 'endpoint', None) or FORA
+    if endpoint != FORA:
+        _local.sql_n += nova
+        _local.sql_t += segundos
+    with _lock:
+        total = _sql_total[endpoint]
+        total[0] += nova
+        total[1] += segundos
+        if ja_gasto < SQL_LENTO <= ja_gasto + segundos:
+            _sql_lentas[endpoint] += 1
+    if ja_gasto < SQL_LENTO <= ja_gasto + segundos:
+        log_sql.warning("SQL lento (%.0f ms) em %s: %s", (ja_gasto + segundos) * 1000, endpoint, ' '.join(sql.split())[:500])
+
+
+def _rotulos(**kw):
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in kw.items()) + '}'
+
+
+def texto_prometheus(extras=None):
+    """Monta a página /metrics. `extras` é um dict nome -> valor de gauges avulsos."""
+    linhas = []
+    with _lock:
+        linhas.append('# TYPE eggpro_http_request_duration_seconds histogram')
+        for endpoint, h in sorted(_latencia.items()):
+            for limite, acumulado in h.acumulado():
+                linhas.append(f'eggpro_http_request_duration_seconds_bucket{_rotulos(endpoint=endpoint, le=limite)} {acumulado}')
+            linhas.append(f'eggpro_http_request_duration_seconds_bucket{_rotulos(endpoint=endpoint, le="+Inf")} {h.n}')
+            linhas.append(f'eggpro_http_request_duration_seconds_sum{_rotulos(endpoint=endpoint)} {h.soma:.6f}')
+            linhas.append(f'eggpro_http_request_duration_seconds_count{_rotulos(endpoint=endpoint)} {h.n}')
+        linhas.append('# TYPE eggpro_http_request_sql_seconds histogram')
+        for endpoint, h in sorted(_sql_por_req.items()):
+            for limite, acumulado in h.acumulado():
+                linhas.append(f'eggpro_http_request_sql_seconds_bucket{_rotulos(endpoint=endpoint, le=limite)} {acumulado}')
+            linhas.append(f'eggpro_http_request_sql_seconds_bucket{_rotulos(endpoint=endpoint, le="+Inf")} {h.n}')
+            linhas.append(f'eggpro_http_request_sql_seconds_sum{_rotulos(endpoint=endpoint)} {h.soma:.6f}')
+            linhas.append(f'eggpro_http_request_sql_seconds_count{_rotulos(endpoint=endpoint)} {h.n}')
+        linhas.append('# TYPE eggpro_http_responses_total counter')
+        for (endpoint, metodo, status), n in sorted(_respostas.items()):
+            linhas.append(f'eggpro_http_responses_total{_rotulos(endpoint=endpoint, method=metodo, status=status)} {n}')
+        linhas.append('# TYPE eggpro_sql_queries_total counter')
+        for endpoint, (n, _) in sorted(_sql_total.items()):
+            linhas.append(f'eggpro_sql_queries_total{_rotulos(endpoint=endpoint)} {n}')
+        linhas.append('# TYPE eggpro_sql_seconds_total counter')
+        for endpoint, (_, t) in sorted(_sql_total.items()):
+            linhas.append(f'eggpro_sql_seconds_total{_rotulos(endpoint=endpoint)} {t:.6f}')
+        linhas.append('# TYPE eggpro_sql_slow_queries_total counter')
+        for endpoint, n in sorted(_sql_lentas.items()):
+            linhas.append(f'eggpro_sql_slow_queries_total{_rotulos(endpoint=endpoint)} {n}')
+    for nome, valor in sorted((extras or {}).items()):
+        linhas.append(f'# TYPE {nome} gauge')
+        linhas.append(f'{nome} {valor}')
+    return '\n'.join(linhas) + '\n'
+
+
+def zerar():
+    with _lock:
+        for d in (_latencia, _sql_por_req, _respostas, _sql_total, _sql_lentas):
+            d.clear()
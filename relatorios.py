@@ -0,0 +1,226 @@
+import csv
+import io
+import re
+import zipfile
+import zlib
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+# --- EXPORTAÇÃO DE RELATÓRIOS ---
+# Os geradores recebem um cursor já executado e devolvem bytes aos poucos:
+# a memória fica no tamanho de um lote, qualquer que seja o período.
+LOTE = 1000
+CABECALHO = ['ID', 'Cliente', 'Data', 'Produto', 'Qtd', 'Total', 'Pendente']
+COLUNAS_SQL = "id, cli_nome, data, prod, qtd, total, pendente"
+
+
+def filtros_vendas(args):
+    """Traduz os filtros da querystring (histórico e relatórios) em cláusulas WHERE.
+
+    Todas as condições casam com algum índice de vendas.
+    """
+    filtros, where, params = {}, [], []
+    cliente = args.get('cliente', type=int)
+    if cliente:
+        filtros['cliente'] = cliente
+        where.append("cli_id = ?")
+        params.append(cliente)
+    for campo, condicao in (('produto', "prod = ?"), ('inicio', "dia >= ?"), ('fim', "dia <= ?")):
+        if args.get(campo):
+            filtros[campo] = args[campo]
+            where.append(condicao)
+            params.append(args[campo])
+    if args.get('status') == 'pago':
+        filtros['status'] = 'pago'
+        where.append("pendente <= 0")
+    elif args.get('status') == 'pendente':
+        filtros['status'] = 'pendente'
+        where.append("pendente > 0")
+    return filtros, where, params
+
+
+def intervalo(periodo, args, agora=None):
+    """Primeiro e último dia (ou None) que o relatório pode alcançar, para decidir se o arquivo entra."""
+    agora = agora or datetime.now()
+    if periodo == 'diario':
+        return agora.strftime("%Y-%m-%d"), None
+    if periodo in ('semanal', 'mensal'):
+        return (agora - timedelta(days=7 if periodo == 'semanal' else 30)).strftime("%Y-%m-%d"), None
+    return args.get('inicio') or None, args.get('fim') or None
+
+
+def consulta_relatorio(periodo, args, agora=None, tabela='vendas'):
+    """Monta (query, params, nome do arquivo) para um período fixo mais os filtros do histórico."""
+    agora = agora or datetime.now()
+    filtros, where, params = filtros_vendas(args)
+    if periodo == 'diario':
+        where.append("dia = ?")
+        params.append(agora.strftime("%Y-%m-%d"))
+    elif periodo in ('semanal', 'mensal'):
+        where.append("timestamp >= ?")
+        params.append(agora - timedelta(days=7 if periodo == 'semanal' else 30))
+    query = f"SELECT {COLUNAS_SQL} FROM {tabela}" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id"
+    nome = f"relatorio_{periodo}" + "".join(f"_{filtros[k]}" for k in ('inicio', 'fim') if k in filtros)
+    # Período e datas vêm da URL e vão para o Content-Disposition: só letras, dígitos, _ e -.
+    return query, params, re.sub(r'[^A-Za-z0-9_-]', '', nome)
+
+
+def _lotes(cursor):
+    while True:
+        linhas = cursor.fetchmany(LOTE)
+        if not linhas:
+            return
+        yield linhas
+
+
+def csv_stream(cursor, cabecalho=CABECALHO):
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=';')
+    buf.write('\ufeff')  # Garante acentos no Excel
+    writer.writerow(cabecalho)
+    for linhas in _lotes(cursor):
+        writer.writerows(tuple(v) for v in linhas)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    resto = buf.getvalue()
+    if resto:
+        yield resto.encode('utf-8')
+
+
+def gzip_stream(partes, nivel=6):
+    comp = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # wbits=31: cabeçalho gzip
+    for parte in partes:
+        saida = comp.compress(parte)
+        if saida:
+            yield saida
+    yield comp.flush()
+
+
+# --- XLSX ---
+# Escrito à mão sobre zipfile para não carregar a planilha inteira em memória:
+# o zip aceita destino sem seek e a planilha vai sendo comprimida linha a linha.
+_XLSX_FIXOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Vendas" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+_INVALIDOS_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _Saida(io.RawIOBase):
+    # Destino sem seek: o zipfile grava e o gerador recolhe o que foi escrito.
+    def __init__(self):
+        self.partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.partes.append(bytes(b))
+        return len(b)
+
+    def recolher(self):
+        dados = b''.join(self.partes)
+        self.partes.clear()
+        return dados
+
+
+def _celula(valor):
+    if valor is None or valor == '':
+        return '<c/>'
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_INVALIDOS_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t>{texto}</t></is></c>'
+
+
+def _linha_xml(valores):
+    return '<row>' + ''.join(_celula(v) for v in valores) + '</row>'
+
+
+def xlsx_stream(cursor, cabecalho=CABECALHO):
+    saida = _Saida()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for nome, conteudo in _XLSX_FIXOS.items():
+            zf.writestr(nome, conteudo)
+        yield saida.recolher()
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                            + _linha_xml(cabecalho)).encode('utf-8'))
+            for linhas in _lotes(cursor):
+                planilha.write(''.join(_linha_xml(tuple(v)) for v in linhas).encode('utf-8'))
+                dados = saida.recolher()
+                if dados:
+                    yield dados
+            planilha.write(b'</sheetData></worksheet>')
+    yield saida.recolher()
+
+
+# --- PDF ---
+# O fpdf monta o documento inteiro em memória, então o PDF é limitado a LIMITE_PDF linhas.
+LIMITE_PDF = 20000
+LARGURAS_PDF = (18, 80, 25, 60, 15, 30, 30)
+
+
+def _latin1(valor):
+    return ('' if valor is None else str(valor)).encode('latin-1', 'replace').decode('latin-1')
+
+
+def pdf_bytes(cursor, titulo, cabecalho=CABECALHO):
+    from fpdf import FPDF  # só os jobs em segundo plano geram PDF
+
+    pdf = FPDF(orientation='L', format='A4')
+    pdf.set_auto_page_break(True, margin=10)
+    pdf.add_page()
+    pdf.set_font('Arial', 'B', 12)
+    pdf.cell(0, 8, _latin1(titulo), ln=1)
+    pdf.set_font('Arial', 'B', 8)
+    for largura, nome in zip(LARGURAS_PDF, cabecalho):
+        pdf.cell(largura, 6, _latin1(nome), border=1)
+    pdf.ln()
+    pdf.set_font('Arial', '', 8)
+    n = 0
+    for linhas in _lotes(cursor):
+        for v in linhas:
+            for largura, valor in zip(LARGURAS_PDF, tuple(v)):
+                pdf.cell(largura, 5, _latin1(valor)[:60], border=1)
+            pdf.ln()
+            n += 1
+            if n >= LIMITE_PDF:
+                pdf.set_font('Arial', 'I', 8)
+                pdf.cell(0, 6, f"Limite de {LIMITE_PDF} linhas atingido; use CSV ou Excel para o período completo.", ln=1)
+                break
+        else:
+            continue
+        break
+    dados = pdf.output(dest='S')
+    # fpdf 1.x devolve str latin-1; fpdf2 devolve bytearray.
+    return dados.encode('latin-1') if isinstance(dados, str) else bytes(dados)
+
+
+FORMATOS = {
+    'csv': (csv_stream, 'text/csv', 'csv'),
+    'xlsx': (xlsx_stream, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
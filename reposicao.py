@@ -0,0 +1,165 @@
+import logging
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import db
+
+log = logging.getLogger('eggpro.reposicao')
+# --- REPOSIÇÃO DE ESTOQUE ---
+# Toda mudança de estoque.qtd grava também uma linha em estoque_movimentos, na mesma
+# transação (entrada, venda, estorno, inicial). A previsão lê a demanda diária de
+# vendas_diarias só na janela JANELA_LONGA e guarda taxa de consumo e ponto de pedido
+# em estoque_previsao; o saldo vem ao vivo de estoque, então as páginas só juntam duas
+# tabelas pequenas. O recálculo é incremental: só os produtos com venda ou estorno
+# depois do último movimento processado, ou todos quando o dia vira (a janela andou).
+# Quem grava chama agendar() depois do commit: uma thread por processo junta os
+# pedidos e roda atualizar(), fora da requisição e da fila de escrita. As páginas só
+# leem. O recálculo completo diário fica com `flask previsao --completo` (cron).
+JANELA_CURTA = int(os.environ.get('EGGPRO_PREVISAO_JANELA_CURTA', '7'))
+JANELA_LONGA = int(os.environ.get('EGGPRO_PREVISAO_JANELA_LONGA', '28'))
+PRAZO_REPOSICAO = float(os.environ.get('EGGPRO_PRAZO_REPOSICAO_DIAS', '2'))
+COBERTURA = float(os.environ.get('EGGPRO_COBERTURA_DIAS', '7'))
+Z_SERVICO = float(os.environ.get('EGGPRO_PREVISAO_Z', '1.65'))  # ~95% sem ruptura durante o prazo
+
+
+# --- MOVIMENTOS ---
+def movimentar(conn, produto, qtd, tipo, venda_id=None, quando=None):
+    """Registra uma mudança de saldo (qtd com sinal). Chamar dentro da transação que alterou estoque."""
+    quando = quando or datetime.now()
+    conn.execute("INSERT INTO estoque_movimentos (produto, dia, quando, tipo, qtd, venda_id) VALUES (?,?,?,?,?,?)",
+                 (produto, quando.strftime("%Y-%m-%d"), quando.isoformat(sep=' ', timespec='seconds'), tipo, qtd, venda_id))
+
+
+def movimentar_vendas(conn, apos_id):
+    """Uma saída por linha de venda com id > apos_id (as que a transação atual acabou de inserir)."""
+    conn.execute('''INSERT INTO estoque_movimentos (produto, dia, quando, tipo, qtd, venda_id)
+                    SELECT prod, dia, timestamp, 'venda', -qtd, id FROM vendas WHERE id > ?''', (apos_id,))
+
+
+# --- PREVISÃO ---
+def demanda(conn, produtos, hoje):
+    """Matriz produtos x JANELA_LONGA dias (o último é hoje) com as quantidades vendidas."""
+    inicio = hoje - timedelta(days=JANELA_LONGA - 1)
+    m = np.zeros((len(produtos), JANELA_LONGA))
+    if not produtos:
+        return m
+    indice = {p: i for i, p in enumerate(produtos)}
+    marcas = ",".join("?" * len(produtos))
+    linhas = conn.execute(f'''SELECT prod, dia, qtd FROM vendas_diarias
+                              WHERE dia >= ? AND dia <= ? AND prod IN ({marcas})''',
+                          (inicio.strftime("%Y-%m-%d"), hoje.strftime("%Y-%m-%d"), *produtos)).fetchall()
+    if linhas:
+        prods, dias, qtds = zip(*linhas)
+        linha = np.fromiter((indice[p] for p in prods), dtype=np.int64, count=len(prods))
+        coluna = (np.array(dias, dtype='datetime64[D]') - np.datetime64(inicio.strftime("%Y-%m-%d"), 'D')).astype(np.int64)
+        np.add.at(m, (linha, coluna), np.asarray(qtds, dtype=float))
+    return m
+
+
+def calcular(m):
+    """Taxas e ponto de pedido de todos os produtos de uma vez, com médias móveis por cumsum.
+
+    taxa é a maior entre a média curta e a longa: reage a uma semana forte sem
+    esquecer o consumo do mês. O estoque de segurança usa o desvio das somas móveis
+    de JANELA_CURTA dias, convertido para o prazo de reposição.
+    """
+    soma = np.concatenate([np.zeros((len(m), 1)), np.cumsum(m, axis=1)], axis=1)
+    moveis = soma[:, JANELA_CURTA:] - soma[:, :-JANELA_CURTA]  # somas de JANELA_CURTA dias, deslizando um dia
+    taxa_curta = moveis[:, -1] / JANELA_CURTA
+    taxa_longa = soma[:, -1] / m.shape[1]
+    taxa = np.maximum(taxa_curta, taxa_longa)
+    desvio_diario = moveis.std(axis=1) / math.sqrt(JANELA_CURTA)
+    seguranca = Z_SERVICO * desvio_diario * math.sqrt(PRAZO_REPOSICAO)
+    ponto = taxa * PRAZO_REPOSICAO + seguranca
+    return {'taxa_curta': taxa_curta, 'taxa_longa': taxa_longa, 'taxa': taxa, 'seguranca': seguranca, 'ponto_pedido': ponto}
+
+
+def atualizar(conn, completo=False, hoje=None):
+    """Recalcula estoque_previsao do que mudou desde a última vez; devolve quantos produtos."""
+    hoje = hoje or datetime.now()
+    dia = hoje.strftime("%Y-%m-%d")
+
+    def pendente():
+        estado = conn.execute("SELECT ultimo_movimento, dia_base FROM estoque_previsao_estado").fetchone()
+        ultimo = conn.execute("SELECT COALESCE(MAX(id), 0) FROM estoque_movimentos").fetchone()[0]
+        return estado, ultimo, completo or estado['dia_base'] != dia
+
+    # Olha sem lock; se houver o que fazer, confere de novo já com o lock de escrita.
+    estado, ultimo, tudo = pendente()
+    if not tudo and ultimo <= estado['ultimo_movimento']:
+        return 0
+    with db.transacao(conn):
+        estado, ultimo, tudo = pendente()
+        if tudo:
+            produtos = [r[0] for r in conn.execute("SELECT produto FROM estoque ORDER BY produto")]
+        else:
+            produtos = [r[0] for r in conn.execute('''SELECT DISTINCT m.produto FROM estoque_movimentos m JOIN estoque e ON e.produto = m.produto
+                                                       WHERE m.id > ? AND m.id <= ? AND m.tipo IN ('venda', 'estorno')''',
+                                                    (estado['ultimo_movimento'], ultimo))]
+        if produtos:
+            r = calcular(demanda(conn, produtos, hoje))
+            agora = hoje.isoformat(timespec='seconds')
+            conn.executemany('''INSERT INTO estoque_previsao (produto, taxa_curta, taxa_longa, taxa, seguranca, ponto_pedido, calculado_em)
+                                VALUES (?,?,?,?,?,?,?)
+                                ON CONFLICT(produto) DO UPDATE SET taxa_curta = excluded.taxa_curta, taxa_longa = excluded.taxa_longa,
+                                    taxa = excluded.taxa, seguranca = excluded.seguranca, ponto_pedido = excluded.ponto_pedido,
+                                    calculado_em = excluded.calculado_em''',
+                             [(p, *(float(r[k][i]) for k in ('taxa_curta', 'taxa_longa', 'taxa', 'seguranca', 'ponto_pedido')), agora)
+                              for i, p in enumerate(produtos)])
+        conn.execute("UPDATE estoque_previsao_estado SET ultimo_movimento = ?, dia_base = ?", (ultimo, dia))
+    return len(produtos)
+
+
+# --- ATUALIZAÇÃO EM SEGUNDO PLANO ---
+_lock = threading.Lock()
+_pedido = threading.Event()
+_pid = None
+
+
+def agendar():
+    """Pede um atualizar() assíncrono; vários pedidos seguidos viram uma execução só."""
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            _pid = os.getpid()
+            threading.Thread(target=_atualizador, name='eggpro-previsao', daemon=True).start()
+    _pedido.set()
+
+
+def _atualizador():
+    while True:
+        _pedido.wait()
+        _pedido.clear()
+        try:
+            with db.get_db() as conn:
+                atualizar(conn)
+        except Exception:
+            log.exception("atualização da previsão de estoque falhou")
+
+
+# --- LEITURA ---
+def situacao(conn):
+    """Um dict por produto: saldo atual, taxa, dias até acabar, ponto de pedido, alerta e sugestão de compra."""
+    linhas = conn.execute('''SELECT e.produto, e.qtd AS saldo, p.taxa, p.taxa_curta, p.taxa_longa, p.ponto_pedido, p.seguranca
+                             FROM estoque e LEFT JOIN estoque_previsao p ON p.produto = e.produto ORDER BY e.produto''').fetchall()
+    resultado = []
+    for r in linhas:
+        saldo, taxa = r['saldo'] or 0, r['taxa'] or 0.0
+        ponto = r['ponto_pedido'] or 0.0
+        alvo = taxa * (PRAZO_REPOSICAO + COBERTURA) + (r['seguranca'] or 0.0)
+        resultado.append({
+            'produto': r['produto'], 'saldo': saldo, 'taxa': taxa, 'taxa_curta': r['taxa_curta'] or 0.0,
+            'taxa_longa': r['taxa_longa'] or 0.0, 'ponto_pedido': ponto,
+            'dias_restantes': saldo / taxa if taxa > 0 else None,
+            'alerta': saldo <= 0 or (taxa > 0 and saldo <= ponto),
+            'sugestao': max(math.ceil(alvo - saldo), 0),
+        })
+    return resultado
+
+
+def alertas(conn):
+    return [s for s in situacao(conn) if s['alerta']]
@@ -0,0 +1,312 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import db
+
+log = logging.getLogger('eggpro.rotas')
+
+# --- ROTAS DE ENTREGA ---
+# Cada cliente é geocodificado uma vez e fica em clientes_geo junto com o endereço
+# usado (chave): mudou o endereço, geocodifica de novo. A geocodificação nunca roda
+# dentro da requisição: a página só lê clientes_geo, lista quem está sem coordenadas
+# e agenda esses clientes numa thread de fundo (ou `flask geocodificar`). A rota do
+# dia junta quem comprou no dia e quem tem saldo em aberto, monta a matriz de
+# distâncias (haversine, vetorizada) e ordena as paradas com vizinho mais próximo
+# seguido de 2-opt.
+RAIO_TERRA_KM = 6371.0088
+TEMPO_2OPT = float(os.environ.get('EGGPRO_ROTA_2OPT_S', '0.5'))
+TIMEOUT = float(os.environ.get('EGGPRO_GEO_TIMEOUT_S', '10'))
+# Endereço não achado é tentado de novo depois desse prazo (o mapa da fonte pode ter melhorado).
+VALIDADE_NAO_ENCONTRADO = timedelta(days=float(os.environ.get('EGGPRO_GEO_VALIDADE_404_DIAS', '7')))
+
+
+class GeocodificadorIndisponivel(Exception):
+    pass
+
+
+def origem_padrao():
+    """Ponto de partida (lat, lon) de EGGPRO_ROTA_ORIGEM='lat,lon'; None usa o centro das paradas."""
+    valor = os.environ.get('EGGPRO_ROTA_ORIGEM')
+    if not valor:
+        return None
+    lat, lon = (float(x) for x in valor.split(','))
+    return lat, lon
+
+
+def chave(c):
+    partes = (c['rua'], c['numero'], c['bairro'], c['cidade'], c['estado'], c['cep'])
+    return '|'.join(' '.join(str(p or '').lower().split()) for p in partes)
+
+
+# --- GEOCODIFICADORES ---
+# Recebem a linha do cliente e devolvem (lat, lon), None se o endereço não foi achado,
+# ou levantam GeocodificadorIndisponivel. EGGPRO_GEO_FONTE escolhe entre FONTES.
+_nominatim = None
+_nominatim_lock = threading.Lock()
+
+
+def _geocoder():
+    global _nominatim
+    with _nominatim_lock:
+        if _nominatim is None:
+            from geopy.extra.rate_limiter import RateLimiter
+            from geopy.geocoders import Nominatim
+            # A política de uso do Nominatim é de no máximo uma consulta por segundo; o próprio
+            # RateLimiter serializa as chamadas. Sem swallow_exceptions a falha de rede chega aqui.
+            _nominatim = RateLimiter(Nominatim(user_agent='eggpro', timeout=TIMEOUT).geocode,
+                                     min_delay_seconds=1, max_retries=0, swallow_exceptions=False)
+        return _nominatim
+
+
+def nominatim(c):
+    from geopy.exc import GeopyError
+    geocode = _geocoder()
+    consultas = [
+        {'street': f"{c['numero'] or ''} {c['rua'] or ''}".strip(), 'city': c['cidade'], 'state': c['estado'],
+         'postalcode': c['cep'], 'country': 'Brasil'},
+        {'postalcode': c['cep'], 'city': c['cidade'], 'country': 'Brasil'},
+    ]
+    try:
+        for consulta in consultas:
+            local = geocode({k: v for k, v in consulta.items() if v}, country_codes='br')
+            if local:
+                return local.latitude, local.longitude
+    except (GeopyError, OSError) as e:
+        raise GeocodificadorIndisponivel(str(e)) from e
+    return None
+
+
+def stub(c):
+    """Coordenadas determinísticas a partir do endereço (~20 km em volta de São Paulo), sem rede."""
+    k = chave(c)
+    if not k.replace('|', ''):
+        return None
+    h = hashlib.sha1(k.encode()).digest()
+    return -23.55 + (h[0] / 255 - 0.5) * 0.2, -46.63 + (h[1] / 255 - 0.5) * 0.2
+
+
+def desligado(c):
+    raise GeocodificadorIndisponivel("geocodificação desligada")
+
+
+FONTES = {'nominatim': nominatim, 'stub': stub, 'off': desligado}
+fonte = FONTES[os.environ.get('EGGPRO_GEO_FONTE', 'nominatim')]
+
+
+def usar_fonte(nova):
+    """Troca o geocodificador (função ou nome em FONTES); devolve o anterior."""
+    global fonte
+    anterior, fonte = fonte, FONTES[nova] if isinstance(nova, str) else nova
+    return anterior
+
+
+def _valida(g, c, agora):
+    # Linha do cache que ainda vale para o endereço atual do cliente.
+    if g is None or g['chave'] != chave(c):
+        return False
+    return g['encontrado'] or datetime.fromisoformat(g['atualizado_em']) + VALIDADE_NAO_ENCONTRADO > agora
+
+
+def coordenadas(conn, clientes):
+    """Só lê clientes_geo: ({id: (lat, lon)}, clientes sem coordenada válida para o endereço atual)."""
+    if not clientes:
+        return {}, []
+    marcas = ",".join("?" * len(clientes))
+    cache = {r['cli_id']: r for r in conn.execute(f"SELECT * FROM clientes_geo WHERE cli_id IN ({marcas})", [c['id'] for c in clientes])}
+    agora, coords, faltam = datetime.now(), {}, []
+    for c in clientes:
+        g = cache.get(c['id'])
+        if _valida(g, c, agora):
+            if g['encontrado']:
+                coords[c['id']] = (g['lat'], g['lon'])
+        else:
+            faltam.append(c)
+    return coords, faltam
+
+
+def _gravar(conn, c, ponto):
+    with db.transacao(conn):
+        conn.execute('''INSERT INTO clientes_geo (cli_id, chave, lat, lon, encontrado, origem, atualizado_em) VALUES (?,?,?,?,?,?,?)
+                        ON CONFLICT(cli_id) DO UPDATE SET chave = excluded.chave, lat = excluded.lat, lon = excluded.lon,
+                            encontrado = excluded.encontrado, origem = excluded.origem, atualizado_em = excluded.atualizado_em''',
+                     (c['id'], chave(c), *(ponto or (None, None)), int(ponto is not None),
+                      getattr(fonte, '__name__', 'fonte'), datetime.now().isoformat(timespec='seconds')))
+
+
+def geocodificar(conn, clientes, limite=None):
+    """Consulta a fonte para os clientes sem coordenada válida; devolve {id: (lat, lon)} de todos.
+
+    Cada resultado é gravado logo, fora de qualquer transação aberta durante a rede.
+    Falha da fonte interrompe a rodada sem gravar nada para aquele cliente: só "não
+    achado" de verdade vira encontrado = 0.
+    """
+    coords, faltam = coordenadas(conn, clientes)
+    for c in faltam[:limite]:
+        try:
+            ponto = fonte(c)
+        except GeocodificadorIndisponivel as e:
+            log.warning("geocodificador indisponível: %s", e)
+            break
+        _gravar(conn, c, ponto)
+        if ponto:
+            coords[c['id']] = ponto
+    return coords
+
+
+# --- GEOCODIFICAÇÃO EM SEGUNDO PLANO ---
+# Uma thread por processo (recriada depois de um fork) consome os ids agendados pela página.
+_fundo_lock = threading.Lock()
+_agendados = set()
+_executor = None
+_pid = None
+
+
+def agendar(ids):
+    """Agenda a geocodificação dos clientes; não espera. Devolve quantos ficaram na fila."""
+    global _executor, _pid
+    with _fundo_lock:
+        if _executor is None or _pid != os.getpid():
+            _executor, _pid = ThreadPoolExecutor(max_workers=1, thread_name_prefix='eggpro-geo'), os.getpid()
+            _agendados.clear()
+        novos = set(ids) - _agendados
+        _agendados.update(novos)
+        if novos:
+            _executor.submit(_geocodificar_agendados, novos)
+        return len(_agendados)
+
+
+def _geocodificar_agendados(ids):
+    # Conexão do pool só para ler e gravar; a espera pela fonte acontece sem segurar nenhuma.
+    try:
+        marcas = ",".join("?" * len(ids))
+        with db.get_db() as conn:
+            _, faltam = coordenadas(conn, conn.execute(f"SELECT * FROM clientes WHERE id IN ({marcas})", list(ids)).fetchall())
+        for c in faltam:
+            try:
+                ponto = fonte(c)
+            except GeocodificadorIndisponivel as e:
+                log.warning("geocodificador indisponível: %s", e)
+                break
+            with db.get_db() as conn:
+                _gravar(conn, c, ponto)
+    except Exception:
+        log.exception("geocodificação em segundo plano falhou")
+    finally:
+        with _fundo_lock:
+            _agendados.difference_update(ids)
+
+
+# --- DISTÂNCIAS E ORDEM DAS PARADAS ---
+def matriz_distancias(lat, lon):
+    """Matriz n x n de distâncias em km (haversine), calculada de uma vez com broadcasting."""
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vizinho_mais_proximo(D, inicio=0):
+    n = len(D)
+    rota = np.empty(n, dtype=np.int64)
+    visitado = np.zeros(n, dtype=bool)
+    atual = inicio
+    for k in range(n):
+        rota[k] = atual
+        visitado[atual] = True
+        if k < n - 1:
+            atual = int(np.argmin(np.where(visitado, np.inf, D[atual])))
+    return rota
+
+
+def dois_opt(D, rota, limite_s=TEMPO_2OPT):
+    """Melhora a volta fechada invertendo trechos enquanto houver ganho (ou até limite_s).
+
+    rota[0] (a origem) nunca sai do lugar. Para cada aresta i, o ganho de todas as
+    trocas com as arestas seguintes é calculado num só vetor e a melhor é aplicada.
+    """
+    rota = np.array(rota, dtype=np.int64)
+    n = len(rota)
+    if n < 4:
+        return rota
+    prazo = time.perf_counter() + limite_s
+    melhorou = True
+    while melhorou and time.perf_counter() < prazo:
+        melhorou = False
+        for i in range(n - 2):
+            a, b = rota[i], rota[i + 1]
+            c = rota[i + 2:]
+            d = np.append(rota[i + 3:], rota[0])
+            ganho = D[a, c] + D[b, d] - D[a, b] - D[c, d]
+            j = int(np.argmin(ganho))
+            if ganho[j] < -1e-9:
+                j += i + 2
+                rota[i + 1:j + 1] = rota[i + 1:j + 1][::-1].copy()
+                melhorou = True
+    return rota
+
+
+def comprimento(D, rota):
+    return float(D[rota, np.roll(rota, -1)].sum())
+
+
+# --- ROTA DO DIA ---
+def paradas(conn, dia, pendentes=True):
+    """Clientes com venda no dia e/ou (se pendentes) saldo em aberto."""
+    return conn.execute('''WITH alvo AS (
+                               SELECT cli_id, TOTAL(qtd) AS qtd_dia, 0 AS pendente FROM vendas WHERE dia = :dia GROUP BY cli_id
+                               UNION ALL
+                               SELECT cli_id, 0, TOTAL(pendente) FROM vendas WHERE pendente > 0 AND :pendentes GROUP BY cli_id)
+                           SELECT c.*, TOTAL(a.qtd_dia) AS qtd_dia, TOTAL(a.pendente) AS pendente
+                           FROM alvo a JOIN clientes c ON c.id = a.cli_id
+                           GROUP BY c.id ORDER BY c.id''', {'dia': dia, 'pendentes': int(pendentes)}).fetchall()
+
+
+def planejar(conn, dia, pendentes=True, origem=None):
+    """Ordena as paradas do dia; só lê coordenadas já gravadas (ver coordenadas())."""
+    inicio = time.perf_counter()
+    clientes = paradas(conn, dia, pendentes)
+    coords, faltam = coordenadas(conn, clientes)
+    com = [c for c in clientes if c['id'] in coords]
+    sem = [c for c in clientes if c['id'] not in coords]
+    origem = origem or origem_padrao()
+    resultado = {'dia': dia, 'paradas': [], 'sem_coordenadas': sem, 'a_geocodificar': [c['id'] for c in faltam], 'total_km': 0.0, 'km_sem_2opt': 0.0,
+                 'origem': origem, 'origem_centro': origem is None}
+    if com:
+        pontos = np.array([coords[c['id']] for c in com], dtype=float)
+        if origem is None:
+            origem = tuple(pontos.mean(axis=0))
+            resultado['origem'] = origem
+        pontos = np.vstack([origem, pontos])  # índice 0 é a origem
+        D = matriz_distancias(pontos[:, 0], pontos[:, 1])
+        rota = vizinho_mais_proximo(D)
+        resultado['km_sem_2opt'] = comprimento(D, rota)
+        rota = dois_opt(D, rota)
+        resultado['total_km'] = comprimento(D, rota)
+        trechos = D[rota, np.roll(rota, -1)]
+        acumulado = np.cumsum(trechos)
+        for k, idx in enumerate(rota[1:], start=1):
+            c = com[idx - 1]
+            resultado['paradas'].append({'ordem': k, 'cliente': c, 'lat': float(pontos[idx, 0]), 'lon': float(pontos[idx, 1]),
+                                         'trecho_km': float(trechos[k - 1]), 'acumulado_km': float(acumulado[k - 1])})
+        resultado['volta_km'] = float(trechos[-1])
+        resultado['desenho'] = _desenho(pontos[rota])
+    resultado['duracao'] = time.perf_counter() - inicio
+    return resultado
+
+
+def _desenho(pontos, largura=100.0, margem=4.0):
+    # Coordenadas SVG (0..largura) da volta, na ordem da rota; y invertido (norte em cima).
+    lat, lon = pontos[:, 0], pontos[:, 1]
+    escala_lon = np.cos(np.radians(lat.mean()))
+    x, y = (lon - lon.min()) * escala_lon, lat.max() - lat
+    lado = max(x.max(), y.max()) or 1.0
+    f = (largura - 2 * margem) / lado
+    return [(round(float(a * f + margem), 2), round(float(b * f + margem), 2)) for a, b in zip(x, y)]
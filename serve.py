@@ -0,0 +1,75 @@
+"""Servidor de produção do EggPro, sobre o gunicorn.
+
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+
+As migrações rodam uma vez no processo mestre, antes do fork; cada worker abre o
+seu próprio pool de conexões. `kill -HUP <pid do mestre>` troca os workers um a um,
+esperando as requisições em andamento (--graceful-timeout). Como o app é carregado
+no mestre, código novo entra com `kill -USR2` (sobe um mestre novo) seguido de
+`kill -QUIT` no antigo.
+
+O balanceador deve olhar /pronto: só responde 200 com o banco acessível e o schema
+na versão esperada por este código.
+"""
+import argparse
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class Servidor(BaseApplication):
+    def __init__(self, app, opcoes):
+        self.app = app
+        self.opcoes = opcoes
+        super().__init__()
+
+    def load_config(self):
+        for nome, valor in self.opcoes.items():
+            if valor is not None:
+                self.cfg.set(nome, valor)
+
+    def load(self):
+        return self.app
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--bind', default=os.environ.get('EGGPRO_BIND', '0.0.0.0:5000'))
+    ap.add_argument('--workers', type=int, default=int(os.environ.get('EGGPRO_WORKERS', os.cpu_count() or 1)),
+                    help='processos (padrão: número de núcleos)')
+    ap.add_argument('--threads', type=int, default=int(os.environ.get('EGGPRO_THREADS', '4')),
+                    help='threads por processo; mantenha <= EGGPRO_POOL_SIZE')
+    ap.add_argument('--timeout', type=int, default=60, help='segundos até um worker travado ser reiniciado')
+    ap.add_argument('--graceful-timeout', type=int, default=30, help='segundos para terminar requisições ao recarregar')
+    ap.add_argument('--max-requests', type=int, default=0, help='recicla o worker depois de N requisições (0 = nunca)')
+    ap.add_argument('--pidfile')
+    ap.add_argument('--db', help='arquivo do banco (padrão: EGGPRO_DB)')
+    args = ap.parse_args(argv)
+
+    if args.db:
+        os.environ['EGGPRO_DB'] = args.db  # antes do import: db.py lê o caminho ao carregar
+    import db
+    from app import app, init_db
+
+    aplicadas = init_db()
+    if aplicadas:
+        print(f"migrações aplicadas: {aplicadas}")
+    db.pool.close()  # conexões do mestre não podem ser herdadas pelos workers
+
+    Servidor(app, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10 if args.max_requests else None,
+        'pidfile': args.pidfile,
+        'preload_app': True,
+        'accesslog': '-',
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
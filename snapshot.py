@@ -0,0 +1,136 @@
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import db
+
+log = logging.getLogger('eggpro.snapshot')
+# --- CÓPIA DE LEITURA (SNAPSHOT) ---
+# Relatórios e análises leem uma cópia da base feita com a API de backup do SQLite,
+# guardada ao lado do arquivo vivo. A cópia é trocada inteira (os.replace) e nunca
+# alterada no lugar, então é aberta como imutável: sem locks, sem -wal/-shm e sem
+# disputar o cache de páginas com as vendas. Com EGGPRO_SNAPSHOT desligado tudo lê
+# a base viva, como antes.
+# A cópia é refeita por uma thread de cada processo quando passa de MAX_IDADE, nunca
+# dentro de uma requisição (só a primeira, se ainda não existe cópia nenhuma). Um flock
+# em caminho() + '.lock' deixa um processo copiar por vez; os outros, ao pegar a trava,
+# encontram a cópia nova e não repetem.
+ATIVO = os.environ.get('EGGPRO_SNAPSHOT', '') not in ('', '0')
+MAX_IDADE = float(os.environ.get('EGGPRO_SNAPSHOT_MAX_S', '300'))
+
+_lock = threading.Lock()        # estatísticas
+_atualizando = threading.Lock()  # uma cópia por vez neste processo (o flock cuida dos outros)
+_pedido = threading.Event()
+_pid = None
+_stats = {'copias': 0, 'ultima_duracao': 0.0, 'ultimos_bytes': 0}
+
+
+def caminho():
+    return os.environ.get('EGGPRO_SNAPSHOT_PATH') or db.DB_PATH + '.snapshot'
+
+
+def idade():
+    """Segundos desde a última cópia (None se ainda não existe)."""
+    try:
+        return max(time.time() - os.path.getmtime(caminho()), 0.0)
+    except FileNotFoundError:
+        return None
+
+
+def versao():
+    """Muda a cada cópia nova (mtime em ns); entra na ETag das páginas que leem o snapshot."""
+    try:
+        return os.stat(caminho()).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def atualizar(max_idade=None):
+    """Copia a base viva para o snapshot. Em WAL a leitura não bloqueia quem está gravando.
+
+    Com max_idade, não copia se, já com a trava, a cópia existente for mais nova que isso
+    (outro processo acabou de refazê-la). Devolve True se copiou.
+    """
+    destino = caminho()
+    with _atualizando, open(destino + '.lock', 'a') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        i = idade()
+        if max_idade is not None and i is not None and i <= max_idade:
+            return False
+        tmp = f"{destino}.{os.getpid()}.tmp"
+        inicio = time.perf_counter()
+        origem = db.conexao_leitura()
+        try:
+            copia = sqlite3.connect(tmp)
+            try:
+                origem.backup(copia)  # um passo só: cópia consistente de um único instante
+                copia.execute("PRAGMA journal_mode = DELETE")  # a cópia é aberta imutável, sem WAL
+            finally:
+                copia.close()
+        finally:
+            origem.close()
+        os.replace(tmp, destino)
+    with _lock:
+        _stats['copias'] += 1
+        _stats['ultima_duracao'] = time.perf_counter() - inicio
+        _stats['ultimos_bytes'] = os.path.getsize(destino)
+    return True
+
+
+# --- ATUALIZAÇÃO EM SEGUNDO PLANO ---
+def iniciar():
+    """Sobe a thread que mantém a cópia em dia (uma por processo; barato chamar sempre)."""
+    global _pid
+    if not ATIVO:
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+    threading.Thread(target=_renovador, name='eggpro-snapshot', daemon=True).start()
+
+
+def agendar():
+    """Pede uma cópia nova já, fora da requisição."""
+    iniciar()
+    _pedido.set()
+
+
+def _renovador():
+    espera = None
+    while True:
+        if espera is None:
+            i = idade()
+            espera = 0 if i is None else max(MAX_IDADE - i, 0)  # acorda quando a cópia vence
+        pedido = _pedido.wait(espera)
+        _pedido.clear()
+        espera = None
+        try:
+            # Sem pedido explícito, cópia feita há menos de meio período por outro processo vale.
+            atualizar(None if pedido else MAX_IDADE / 2)
+        except Exception:
+            log.exception("atualização do snapshot falhou")
+            espera = MAX_IDADE
+
+
+def conexao():
+    """Conexão só-leitura para leituras pesadas, na cópia como ela estiver."""
+    if not ATIVO:
+        return db.conexao_leitura()
+    iniciar()
+    if idade() is None:
+        atualizar(MAX_IDADE)  # primeira cópia: sem ela não há o que ler
+    return db.conexao_leitura(caminho(), imutavel=True)
+
+
+def info():
+    with _lock:
+        s = dict(_stats)
+    v = versao() if ATIVO else None
+    s.update(ativo=ATIVO, idade=idade() if ATIVO else None, max_idade=MAX_IDADE,
+             feita_em=datetime.fromtimestamp(v / 1e9).strftime("%d/%m %H:%M:%S") if v else None)
+    return s
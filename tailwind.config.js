@@ -0,0 +1,11 @@
+import daisyui from 'daisyui';
+
+// Varre os templates embutidos nos .py; classes montadas em tempo de execução
+// (alert-{{ category }}) precisam entrar no safelist.
+export default {
+  content: ['./*.py'],
+  safelist: [{ pattern: /^alert-(success|error|info|warning)$/ }],
+  theme: { extend: {} },
+  plugins: [daisyui],
+  daisyui: { themes: ['dark'], logs: false },
+};